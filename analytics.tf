@@ -0,0 +1,99 @@
+# S3 Bucket
+resource "aws_s3_bucket" "snapshots_bucket" {
+  bucket_prefix = "${var.prefix}-snapshots"
+}
+
+resource "aws_s3_bucket_acl" "snapshots_bucket" {
+  bucket = aws_s3_bucket.snapshots_bucket.id
+  acl    = "private"
+}
+
+resource "aws_s3_bucket_public_access_block" "snapshots_bucket" {
+  bucket = aws_s3_bucket.snapshots_bucket.id
+
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+# Lambda - Parquet snapshot of all tables for offline analytics
+
+module "table_snapshot" {
+  source = "terraform-aws-modules/lambda/aws"
+
+  source_path = [
+    {
+      path             = "${path.module}/lambda/cron/table_snapshot"
+      pip_requirements = false
+    }
+  ]
+
+  function_name = "${var.prefix}-table_snapshot-lambda"
+  description   = "Snapshot DynamoDB tables to Parquet in S3"
+  handler       = "index.handler"
+
+  runtime       = local.lambda_runtime
+  architectures = local.lambda_architecture
+
+  attach_cloudwatch_logs_policy = true
+
+  attach_policy_statements = true
+  policy_statements = {
+    dynamodb_scan = {
+      actions = [
+        "dynamodb:Scan",
+      ]
+      resources = [
+        aws_dynamodb_table.applications_table.arn,
+        aws_dynamodb_table.event_allocation_table.arn,
+        aws_dynamodb_table.event_instance_table.arn,
+        aws_dynamodb_table.event_series_table.arn,
+        aws_dynamodb_table.members_table.arn,
+        aws_dynamodb_table.references_table.arn
+      ]
+    }
+
+    s3 = {
+      actions = [
+        "s3:PutObject"
+      ]
+      resources = [
+        "${aws_s3_bucket.snapshots_bucket.arn}/*"
+      ]
+    }
+  }
+
+  role_name = "${var.prefix}-table_snapshot-role"
+
+  publish = true
+  allowed_triggers = {
+    eventbridge = {
+      principal  = "events.amazonaws.com"
+      source_arn = aws_cloudwatch_event_rule.daily_0700.arn
+    }
+  }
+
+  timeout     = 900
+  memory_size = 2048
+
+  environment_variables = {
+    ALLOCATIONS_TABLE    = aws_dynamodb_table.event_allocation_table.name
+    APPLICATIONS_TABLE   = aws_dynamodb_table.applications_table.name
+    EVENT_INSTANCE_TABLE = aws_dynamodb_table.event_instance_table.name
+    EVENT_SERIES_TABLE   = aws_dynamodb_table.event_series_table.name
+    MEMBERS_TABLE        = aws_dynamodb_table.members_table.name
+    REFERENCES_TABLE     = aws_dynamodb_table.references_table.name
+    SCAN_SEGMENTS        = 4
+    SNAPSHOT_BUCKET      = aws_s3_bucket.snapshots_bucket.id
+  }
+
+  layers = [
+    local.pandas_layer_arn
+  ]
+}
+
+resource "aws_cloudwatch_event_target" "table_snapshot" {
+  rule = aws_cloudwatch_event_rule.daily_0700.name
+  arn  = module.table_snapshot.lambda_function_arn
+}
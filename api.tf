@@ -43,7 +43,9 @@ resource "aws_api_gateway_deployment" "portal" {
     modules = sha1(join(":", [
       jsonencode(module.members_GET),
       jsonencode(module.members_compare_POST),
+      jsonencode(module.members_compare_upload_POST),
       jsonencode(module.members_export_POST),
+      jsonencode(module.members_photos_POST),
       jsonencode(module.members_id_GET),
       jsonencode(module.members_id_DELETE),
       jsonencode(module.members_id_PUT),
@@ -53,6 +55,7 @@ resource "aws_api_gateway_deployment" "portal" {
       jsonencode(module.members_id_payment_POST),
       jsonencode(module.members_id_photo_GET),
       jsonencode(module.members_id_photo_PUT),
+      jsonencode(module.members_id_photo_upload_POST),
       jsonencode(module.members_id_role_PATCH),
       jsonencode(module.members_id_suspended_PATCH),
       jsonencode(module.members_report_GET),
@@ -104,7 +107,9 @@ resource "aws_api_gateway_deployment" "portal" {
   depends_on = [
     module.members_GET,
     module.members_compare_POST,
+    module.members_compare_upload_POST,
     module.members_export_POST,
+    module.members_photos_POST,
     module.members_id_GET,
     module.members_id_DELETE,
     module.members_id_PUT,
@@ -114,6 +119,7 @@ resource "aws_api_gateway_deployment" "portal" {
     module.members_id_payment_POST,
     module.members_id_photo_GET,
     module.members_id_photo_PUT,
+    module.members_id_photo_upload_POST,
     module.members_id_role_PATCH,
     module.members_id_suspended_PATCH,
     module.members_report_GET,
@@ -169,6 +175,10 @@ resource "aws_api_gateway_authorizer" "portal" {
   rest_api_id            = aws_api_gateway_rest_api.portal.id
   authorizer_uri         = module.auth_lambda.lambda_function_invoke_arn
   authorizer_credentials = aws_iam_role.auth_invocation_role.arn
+
+  # Policies cover every method the user can call, so one result can be reused for the whole session
+  identity_source                  = "method.request.header.Authorization"
+  authorizer_result_ttl_in_seconds = 300
 }
 
 # IAM
@@ -34,6 +34,7 @@ module "applications_GET" {
   lambda_env = {
     APPLICATIONS_TABLE           = aws_dynamodb_table.applications_table.id
     REFERENCES_TABLE             = aws_dynamodb_table.references_table.id
+    SCAN_SEGMENTS                = 4
     POWERTOOLS_METRICS_NAMESPACE = var.prefix
     POWERTOOLS_SERVICE_NAME      = "${var.prefix}-applications"
   }
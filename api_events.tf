@@ -563,6 +563,7 @@ module "events_seriesId_eventId_allocate_PUT" {
 
   lambda_env = {
     EVENT_ALLOCATIONS_TABLE = aws_dynamodb_table.event_allocation_table.id
+    MAX_WORKERS             = 10
     SUSPENDED_ARN           = module.utils_members_suspended.lambda_function_arn
   }
 
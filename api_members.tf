@@ -36,6 +36,7 @@ module "members_GET" {
   lambda_env = {
     COMMITTEE_GROUP = aws_cognito_user_group.committee.name
     MEMBERS_TABLE   = aws_dynamodb_table.members_table.name
+    SCAN_SEGMENTS   = 4
   }
 
   lambda_architecture = local.lambda_architecture
@@ -75,10 +76,62 @@ module "members_compare_POST" {
       actions   = ["dynamodb:Scan"]
       resources = [aws_dynamodb_table.members_table.arn]
     }
+
+    s3 = {
+      actions   = ["s3:GetObject"]
+      resources = ["${aws_s3_bucket.member_exports_bucket.arn}/compass/*"]
+    }
   }
 
   lambda_env = {
-    MEMBERS_TABLE = aws_dynamodb_table.members_table.name
+    COMPASS_BUCKET_NAME = aws_s3_bucket.member_exports_bucket.id
+    COMPASS_PREFIX      = "compass/"
+    MEMBERS_TABLE       = aws_dynamodb_table.members_table.name
+  }
+
+  lambda_architecture = local.lambda_architecture
+  lambda_runtime      = local.lambda_runtime
+}
+
+# /members/compare/upload
+
+module "members_compare_upload" {
+  source     = "./api_resource"
+  depends_on = [aws_api_gateway_rest_api.portal]
+
+  rest_api_id = aws_api_gateway_rest_api.portal.id
+  parent_id   = module.members_compare.resource_id
+  path_part   = "upload"
+}
+
+module "members_compare_upload_POST" {
+  source     = "./api_method_lambda"
+  depends_on = [aws_api_gateway_rest_api.portal]
+
+  rest_api_name = aws_api_gateway_rest_api.portal.name
+  path          = module.members_compare_upload.resource_path
+
+  http_method = "POST"
+
+  prefix      = var.prefix
+  name        = "members_compare_upload"
+  description = "Get presigned POST to upload Compass export"
+
+  authorizer_id = aws_api_gateway_authorizer.portal.id
+
+  lambda_path = "${path.module}/lambda/api/members/compare/upload/POST"
+
+  lambda_policy = {
+    s3 = {
+      actions   = ["s3:PutObject"]
+      resources = ["${aws_s3_bucket.member_exports_bucket.arn}/compass/*"]
+    }
+  }
+
+  lambda_env = {
+    COMPASS_BUCKET_NAME = aws_s3_bucket.member_exports_bucket.id
+    COMPASS_PREFIX      = "compass/"
+    EXPIRATION          = 300
   }
 
   lambda_architecture = local.lambda_architecture
@@ -121,19 +174,99 @@ module "members_export_POST" {
 
     members = {
       actions = [
-        "dynamodb:GetItem",
+        "dynamodb:BatchGetItem",
         "dynamodb:Scan"
       ]
       resources = [aws_dynamodb_table.members_table.arn]
     }
+
+    s3 = {
+      actions = [
+        "s3:AbortMultipartUpload",
+        "s3:GetObject",
+        "s3:PutObject"
+      ]
+      resources = ["${aws_s3_bucket.member_exports_bucket.arn}/*"]
+    }
   }
 
   lambda_env = {
-    ALLOCATIONS_TABLE = aws_dynamodb_table.event_allocation_table.name
-    FIELD_NAMES       = "membershipNumber,surname,firstName,preferredName,email,telephone,address,postcode,dateOfBirth,dietaryRequirements,medicalInformation,emergencyContactName,emergencyContactTelephone,nationality,placeOfBirth,joinDate,status,role,membershipExpires,receivedNecker,lastUpdated"
+    ALLOCATIONS_TABLE  = aws_dynamodb_table.event_allocation_table.name
+    BATCH_WORKERS      = 4
+    EXPIRATION         = 900
+    EXPORT_BUCKET_NAME = aws_s3_bucket.member_exports_bucket.id
+    FIELD_NAMES        = "membershipNumber,surname,firstName,preferredName,email,telephone,address,postcode,dateOfBirth,dietaryRequirements,medicalInformation,emergencyContactName,emergencyContactTelephone,nationality,placeOfBirth,joinDate,status,role,membershipExpires,receivedNecker,lastUpdated"
+    MEMBERS_TABLE      = aws_dynamodb_table.members_table.name
+  }
+
+  lambda_timeout = 60
+
+  lambda_layers = [
+    local.common_layer_arn
+  ]
+
+  lambda_architecture = local.lambda_architecture
+  lambda_runtime      = local.lambda_runtime
+}
+
+# /members/photos
+
+module "members_photos" {
+  source     = "./api_resource"
+  depends_on = [aws_api_gateway_rest_api.portal]
+
+  rest_api_id = aws_api_gateway_rest_api.portal.id
+  parent_id   = module.members.resource_id
+  path_part   = "photos"
+}
+
+module "members_photos_POST" {
+  source     = "./api_method_lambda"
+  depends_on = [aws_api_gateway_rest_api.portal]
+
+  rest_api_name = aws_api_gateway_rest_api.portal.name
+  path          = module.members_photos.resource_path
+
+  http_method = "POST"
+
+  prefix      = var.prefix
+  name        = "members_photos"
+  description = "Get photos of multiple members"
+
+  authorizer_id = aws_api_gateway_authorizer.portal.id
+
+  lambda_path = "${path.module}/lambda/api/members/photos/POST"
+
+  lambda_policy = {
+    dynamodb = {
+      actions   = ["dynamodb:BatchGetItem", "dynamodb:UpdateItem"]
+      resources = [aws_dynamodb_table.members_table.arn]
+    }
+
+    s3 = {
+      actions   = ["s3:GetObject"]
+      resources = ["${aws_s3_bucket.member_photos_bucket.arn}/*.jpg", "${aws_s3_bucket.member_photos_bucket.arn}/*.webp"]
+    }
+
+    s3_bucket = {
+      actions   = ["s3:ListBucket"]
+      resources = [aws_s3_bucket.member_photos_bucket.arn]
+    }
+  }
+
+  lambda_env = {
+    BATCH_WORKERS     = 4
+    EXPIRATION        = 3600
+    MAX_MEMBERS       = 500
     MEMBERS_TABLE     = aws_dynamodb_table.members_table.name
+    PHOTO_BUCKET_NAME = aws_s3_bucket.member_photos_bucket.id
+    RENDITION_SIZES   = local.photo_rendition_sizes
   }
 
+  lambda_layers = [
+    local.common_layer_arn
+  ]
+
   lambda_architecture = local.lambda_architecture
   lambda_runtime      = local.lambda_runtime
 }
@@ -339,7 +472,7 @@ module "members_id_membershipnumber_POST" {
 
   lambda_policy = {
     allocations = {
-      actions = ["dynamodb:GetItem", "dynamodb:PutItem", "dynamodb:Query"]
+      actions = ["dynamodb:DeleteItem", "dynamodb:PutItem", "dynamodb:Query"]
       resources = [
         aws_dynamodb_table.event_allocation_table.arn,
         "${aws_dynamodb_table.event_allocation_table.arn}/index/${var.prefix}-member_event_allocations"
@@ -347,17 +480,35 @@ module "members_id_membershipnumber_POST" {
     }
 
     members = {
-      actions   = ["dynamodb:GetItem", "dynamodb:PutItem"]
+      actions   = ["dynamodb:DeleteItem", "dynamodb:GetItem", "dynamodb:PutItem", "dynamodb:UpdateItem"]
       resources = [aws_dynamodb_table.members_table.arn]
     }
+
+    s3 = {
+      actions   = ["s3:GetObject", "s3:PutObject"]
+      resources = ["${aws_s3_bucket.member_photos_bucket.arn}/*.jpg", "${aws_s3_bucket.member_photos_bucket.arn}/*.webp"]
+    }
+
+    s3_bucket = {
+      actions   = ["s3:ListBucket"]
+      resources = [aws_s3_bucket.member_photos_bucket.arn]
+    }
   }
 
   lambda_env = {
     EVENT_ALLOCATIONS_INDEX = "${var.prefix}-member_event_allocations"
     EVENT_ALLOCATIONS_TABLE = aws_dynamodb_table.event_allocation_table.id
     MEMBERS_TABLE           = aws_dynamodb_table.members_table.id
+    PHOTO_BUCKET_NAME       = aws_s3_bucket.member_photos_bucket.id
+    RENDITION_SIZES         = local.photo_rendition_sizes
   }
 
+  lambda_timeout = 60
+
+  lambda_layers = [
+    local.common_layer_arn
+  ]
+
   lambda_architecture = local.lambda_architecture
   lambda_runtime      = local.lambda_runtime
 }
@@ -453,6 +604,7 @@ module "members_id_payment_POST" {
     API_KEY_SECRET_NAME = aws_secretsmanager_secret.api_keys.arn
     MEMBERS_TABLE       = aws_dynamodb_table.members_table.id
     PORTAL_DOMAIN       = aws_route53_record.portal.fqdn
+    SECRET_TTL          = 3600
 
     # We have to build this manually to avoid a dependency cycle
     SUCCESS_URL = "https://${aws_api_gateway_rest_api.portal.id}.execute-api.${data.aws_region.current.name}.amazonaws.com/${var.prefix}/payments/membership/{CHECKOUT_SESSION_ID}"
@@ -529,18 +681,75 @@ module "members_id_photo_PUT" {
   lambda_path = "${path.module}/lambda/api/members/{id}/photo/PUT"
 
   lambda_policy = {
+    dynamodb = {
+      actions   = ["dynamodb:UpdateItem"]
+      resources = [aws_dynamodb_table.members_table.arn]
+    }
+
     s3 = {
-      actions   = ["s3:PutObject", "s3:DeleteObject"]
-      resources = ["${aws_s3_bucket.member_photos_bucket.arn}/*.jpg"]
+      actions   = ["s3:DeleteObject"]
+      resources = ["${aws_s3_bucket.member_photos_bucket.arn}/*.jpg", "${aws_s3_bucket.member_photos_bucket.arn}/*.webp"]
+    }
+
+    s3_uploads = {
+      actions   = ["s3:PutObject"]
+      resources = ["${aws_s3_bucket.member_photos_bucket.arn}/uploads/*"]
     }
   }
 
   lambda_env = {
+    MEMBERS_TABLE     = aws_dynamodb_table.members_table.name
     PHOTO_BUCKET_NAME = aws_s3_bucket.member_photos_bucket.id
+    RENDITION_SIZES   = local.photo_rendition_sizes
+    UPLOAD_PREFIX     = "uploads/"
   }
 
-  # lambda_architecture = local.lambda_architecture
-  lambda_architecture = ["x86_64"]    # Pillow requires x86_64
+  lambda_architecture = local.lambda_architecture
+  lambda_runtime      = local.lambda_runtime
+}
+
+# /members/{id}/photo/upload
+
+module "members_id_photo_upload" {
+  source     = "./api_resource"
+  depends_on = [aws_api_gateway_rest_api.portal]
+
+  rest_api_id = aws_api_gateway_rest_api.portal.id
+  parent_id   = module.members_id_photo.resource_id
+  path_part   = "upload"
+}
+
+module "members_id_photo_upload_POST" {
+  source     = "./api_method_lambda"
+  depends_on = [aws_api_gateway_rest_api.portal]
+
+  rest_api_name = aws_api_gateway_rest_api.portal.name
+  path          = module.members_id_photo_upload.resource_path
+
+  http_method = "POST"
+
+  prefix      = var.prefix
+  name        = "members_id_photo_upload"
+  description = "Get presigned POST to upload photo"
+
+  authorizer_id = aws_api_gateway_authorizer.portal.id
+
+  lambda_path = "${path.module}/lambda/api/members/{id}/photo/upload/POST"
+
+  lambda_policy = {
+    s3 = {
+      actions   = ["s3:PutObject"]
+      resources = ["${aws_s3_bucket.member_photos_bucket.arn}/uploads/*"]
+    }
+  }
+
+  lambda_env = {
+    EXPIRATION        = 300
+    PHOTO_BUCKET_NAME = aws_s3_bucket.member_photos_bucket.id
+    UPLOAD_PREFIX     = "uploads/"
+  }
+
+  lambda_architecture = local.lambda_architecture
   lambda_runtime      = local.lambda_runtime
 }
 
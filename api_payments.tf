@@ -89,6 +89,7 @@ module "payments_membership_session_GET" {
     API_KEY_SECRET_NAME = aws_secretsmanager_secret.api_keys.arn
     MEMBERS_TABLE       = aws_dynamodb_table.members_table.id
     PORTAL_DOMAIN       = aws_route53_record.portal.fqdn
+    SECRET_TTL          = 3600
   }
 
   lambda_architecture = local.lambda_architecture
@@ -118,7 +118,7 @@ module "sync_applications" {
     dynamodb_references = {
       actions = [
         "dynamodb:Query",
-        "dynamodb:DeleteItem"
+        "dynamodb:BatchWriteItem"
       ]
       resources = [
         aws_dynamodb_table.references_table.arn
@@ -134,6 +134,15 @@ module "sync_applications" {
         data.aws_ses_domain_identity.qswp.arn
       ]
     }
+
+    sqs = {
+      actions = [
+        "sqs:SendMessage"
+      ]
+      resources = [
+        aws_sqs_queue.stream_failures.arn
+      ]
+    }
   }
 
   role_name = "${var.prefix}-sync_applications-role"
@@ -143,19 +152,40 @@ module "sync_applications" {
   timeout     = 300
   memory_size = 512
 
+  layers = [
+    local.powertools_layer_arn,
+    local.common_layer_arn
+  ]
+
   environment_variables = {
     APPLICATION_RECEIVED_TEMPLATE = aws_ses_template.application_received.name
+    BATCH_WORKERS                 = 4
     EVIDENCE_BUCKET_NAME          = aws_s3_bucket.applications_evidence_bucket.id
     MEMBERS_EMAIL                 = var.members_email
     PORTAL_DOMAIN                 = aws_route53_record.portal.fqdn
     REFERENCES_TABLE              = aws_dynamodb_table.references_table.name
+
+    POWERTOOLS_METRICS_NAMESPACE = var.prefix
+    POWERTOOLS_SERVICE_NAME      = "${var.prefix}-sync_applications"
   }
 }
 
 resource "aws_lambda_event_source_mapping" "sync_applications" {
-  event_source_arn  = aws_dynamodb_table.applications_table.stream_arn
-  function_name     = module.sync_applications.lambda_function_arn
-  starting_position = "LATEST"
+  event_source_arn        = aws_dynamodb_table.applications_table.stream_arn
+  function_name           = module.sync_applications.lambda_function_arn
+  starting_position       = "LATEST"
+  function_response_types = ["ReportBatchItemFailures"]
+
+  # Give up on records which keep failing, rather than holding back the rest of the shard,
+  # and keep them for investigation
+  maximum_retry_attempts         = 5
+  bisect_batch_on_function_error = true
+
+  destination_config {
+    on_failure {
+      destination_arn = aws_sqs_queue.stream_failures.arn
+    }
+  }
 }
 
 # Sync references and trigger actions
@@ -219,6 +249,15 @@ module "sync_references" {
         data.aws_ses_domain_identity.qswp.arn
       ]
     }
+
+    sqs = {
+      actions = [
+        "sqs:SendMessage"
+      ]
+      resources = [
+        aws_sqs_queue.stream_failures.arn
+      ]
+    }
   }
 
   role_name = "${var.prefix}-sync_references-role"
@@ -228,17 +267,37 @@ module "sync_references" {
   timeout     = 300
   memory_size = 512
 
+  layers = [
+    local.powertools_layer_arn,
+    local.common_layer_arn
+  ]
+
   environment_variables = {
     APPLICATION_TABLE           = aws_dynamodb_table.applications_table.name
     MEMBERS_EMAIL               = var.members_email
     PORTAL_DOMAIN               = aws_route53_record.portal.fqdn
     REFERENCE_REQUEST_TEMPLATE  = aws_ses_template.reference_request.name
     REFERENCE_RECEIVED_TEMPLATE = aws_ses_template.reference_received.name
+
+    POWERTOOLS_METRICS_NAMESPACE = var.prefix
+    POWERTOOLS_SERVICE_NAME      = "${var.prefix}-sync_references"
   }
 }
 
 resource "aws_lambda_event_source_mapping" "sync_references" {
-  event_source_arn  = aws_dynamodb_table.references_table.stream_arn
-  function_name     = module.sync_references.lambda_function_arn
-  starting_position = "LATEST"
+  event_source_arn        = aws_dynamodb_table.references_table.stream_arn
+  function_name           = module.sync_references.lambda_function_arn
+  starting_position       = "LATEST"
+  function_response_types = ["ReportBatchItemFailures"]
+
+  # Give up on records which keep failing, rather than holding back the rest of the shard,
+  # and keep them for investigation
+  maximum_retry_attempts         = 5
+  bisect_batch_on_function_error = true
+
+  destination_config {
+    on_failure {
+      destination_arn = aws_sqs_queue.stream_failures.arn
+    }
+  }
 }
\ No newline at end of file
@@ -26,10 +26,20 @@ module "auth_lambda" {
   }
   assume_role_policy_statements = local.lambda_assume_role_policy
 
+  layers = [
+    local.powertools_layer_arn
+  ]
+
   environment_variables = {
-    TABLE_NAME            = aws_dynamodb_table.auth_table.id
-    COGNITO_USER_POOL_ID  = aws_cognito_user_pool.portal.id
-    COGNITO_APP_CLIENT_ID = aws_cognito_user_pool_client.portal.id
+    TABLE_NAME                   = aws_dynamodb_table.auth_table.id
+    COGNITO_USER_POOL_ID         = aws_cognito_user_pool.portal.id
+    COGNITO_APP_CLIENT_ID        = aws_cognito_user_pool_client.portal.id
+    BATCH_DEADLINE               = 2
+    POWERTOOLS_METRICS_NAMESPACE = var.prefix
+    POWERTOOLS_SERVICE_NAME      = "${var.prefix}-auth"
+    JWKS_MAX_AGE                 = 3600
+    JWKS_MIN_REFRESH_INTERVAL    = 60
+    POLICY_CACHE_TTL             = 300
   }
 }
 
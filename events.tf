@@ -26,6 +26,51 @@ resource "aws_dynamodb_table" "event_instance_table" {
     type = "S"
   }
 
+  attribute {
+    name = "locationType"
+    type = "S"
+  }
+
+  attribute {
+    name = "startDate"
+    type = "S"
+  }
+
+  attribute {
+    name = "endDate"
+    type = "S"
+  }
+
+  attribute {
+    name = "registrationDate"
+    type = "S"
+  }
+
+  # Every event has a locationType, so the reminder crons can query each type's events by date
+  global_secondary_index {
+    name               = "${var.prefix}-event_instances_start"
+    hash_key           = "locationType"
+    range_key          = "startDate"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["location"]
+  }
+
+  global_secondary_index {
+    name               = "${var.prefix}-event_instances_end"
+    hash_key           = "locationType"
+    range_key          = "endDate"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["location"]
+  }
+
+  global_secondary_index {
+    name               = "${var.prefix}-event_instances_registration"
+    hash_key           = "locationType"
+    range_key          = "registrationDate"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["location"]
+  }
+
   stream_enabled   = true
   stream_view_type = "NEW_IMAGE"
 }
@@ -119,7 +164,7 @@ module "sync_events" {
     dynamodb_allocations = {
       actions = [
         "dynamodb:Query",
-        "dynamodb:DeleteItem"
+        "dynamodb:BatchWriteItem"
       ]
       resources = [
         aws_dynamodb_table.event_allocation_table.arn
@@ -147,13 +192,29 @@ module "sync_events" {
 
     ses = {
       actions = [
-        "ses:SendTemplatedEmail"
+        "ses:SendBulkTemplatedEmail"
       ]
       resources = [
         aws_ses_template.event_added.arn,
         data.aws_ses_domain_identity.qswp.arn
       ]
     }
+
+    ses_quota = {
+      actions = [
+        "ses:GetSendQuota"
+      ]
+      resources = ["*"]
+    }
+
+    sqs = {
+      actions = [
+        "sqs:SendMessage"
+      ]
+      resources = [
+        aws_sqs_queue.stream_failures.arn
+      ]
+    }
   }
 
   role_name = "${var.prefix}-sync_events-role"
@@ -163,21 +224,43 @@ module "sync_events" {
   timeout     = 300
   memory_size = 512
 
+  layers = [
+    local.powertools_layer_arn,
+    local.common_layer_arn
+  ]
+
   environment_variables = {
     ALLOCATIONS_TABLE    = aws_dynamodb_table.event_allocation_table.name
+    BATCH_WORKERS        = 4
     EVENT_ADDED_TEMPLATE = aws_ses_template.event_added.name
     EVENT_SERIES_TABLE   = aws_dynamodb_table.event_series_table.name
     EVENTS_EMAIL         = var.events_email
+    MAX_WORKERS          = 4
     MEMBERS_STATUS_INDEX = "${var.prefix}-membership_status"
     MEMBERS_TABLE        = aws_dynamodb_table.members_table.name
     PORTAL_DOMAIN        = aws_route53_record.portal.fqdn
+
+    POWERTOOLS_METRICS_NAMESPACE = var.prefix
+    POWERTOOLS_SERVICE_NAME      = "${var.prefix}-sync_events"
   }
 }
 
 resource "aws_lambda_event_source_mapping" "sync_events" {
-  event_source_arn  = aws_dynamodb_table.event_instance_table.stream_arn
-  function_name     = module.sync_events.lambda_function_arn
-  starting_position = "LATEST"
+  event_source_arn        = aws_dynamodb_table.event_instance_table.stream_arn
+  function_name           = module.sync_events.lambda_function_arn
+  starting_position       = "LATEST"
+  function_response_types = ["ReportBatchItemFailures"]
+
+  # Give up on records which keep failing, rather than holding back the rest of the shard,
+  # and keep them for investigation
+  maximum_retry_attempts         = 5
+  bisect_batch_on_function_error = true
+
+  destination_config {
+    on_failure {
+      destination_arn = aws_sqs_queue.stream_failures.arn
+    }
+  }
 }
 
 # Lambda - New Allocation Notification
@@ -216,7 +299,7 @@ module "sync_allocations" {
 
     dynamodb_events = {
       actions = [
-        "dynamodb:GetItem"
+        "dynamodb:BatchGetItem"
       ]
       resources = [
         aws_dynamodb_table.event_series_table.arn
@@ -225,7 +308,7 @@ module "sync_allocations" {
 
     dynamodb_members = {
       actions = [
-        "dynamodb:GetItem"
+        "dynamodb:BatchGetItem"
       ]
       resources = [
         aws_dynamodb_table.members_table.arn
@@ -234,13 +317,29 @@ module "sync_allocations" {
 
     ses = {
       actions = [
-        "ses:SendTemplatedEmail"
+        "ses:SendBulkTemplatedEmail"
       ]
       resources = [
         aws_ses_template.event_allocation.arn,
         data.aws_ses_domain_identity.qswp.arn
       ]
     }
+
+    ses_quota = {
+      actions = [
+        "ses:GetSendQuota"
+      ]
+      resources = ["*"]
+    }
+
+    sqs = {
+      actions = [
+        "sqs:SendMessage"
+      ]
+      resources = [
+        aws_sqs_queue.stream_failures.arn
+      ]
+    }
   }
 
   role_name = "${var.prefix}-sync_allocations-role"
@@ -250,18 +349,42 @@ module "sync_allocations" {
   timeout     = 300
   memory_size = 512
 
+  layers = [
+    local.powertools_layer_arn,
+    local.common_layer_arn
+  ]
+
   environment_variables = {
     EVENT_ALLOCATION_TEMPLATE = aws_ses_template.event_allocation.name
     EVENT_SERIES_TABLE        = aws_dynamodb_table.event_series_table.name
     EVENTS_EMAIL              = var.events_email
     MEMBERS_TABLE             = aws_dynamodb_table.members_table.name
+
+    POWERTOOLS_METRICS_NAMESPACE = var.prefix
+    POWERTOOLS_SERVICE_NAME      = "${var.prefix}-sync_allocations"
   }
 }
 
 resource "aws_lambda_event_source_mapping" "sync_allocations" {
-  event_source_arn  = aws_dynamodb_table.event_allocation_table.stream_arn
-  function_name     = module.sync_allocations.lambda_function_arn
-  starting_position = "LATEST"
+  event_source_arn        = aws_dynamodb_table.event_allocation_table.stream_arn
+  function_name           = module.sync_allocations.lambda_function_arn
+  starting_position       = "LATEST"
+  function_response_types = ["ReportBatchItemFailures"]
+
+  # Wait briefly so that a committed allocation arrives as a single batch
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = 5
+
+  # Give up on records which keep failing, rather than holding back every later allocation,
+  # and keep them for investigation
+  maximum_retry_attempts         = 5
+  bisect_batch_on_function_error = true
+
+  destination_config {
+    on_failure {
+      destination_arn = aws_sqs_queue.stream_failures.arn
+    }
+  }
 }
 
 # Lambda - Allocation Reminder
@@ -287,21 +410,21 @@ module "event_allocation_reminder" {
 
   attach_policy_statements = true
   policy_statements = {
-    dynamodb_get = {
+    dynamodb_series = {
       actions = [
-        "dynamodb:GetItem",
+        "dynamodb:BatchGetItem",
       ]
       resources = [
         aws_dynamodb_table.event_series_table.arn
       ]
     }
 
-    dynamodb_scan = {
+    dynamodb_instances = {
       actions = [
-        "dynamodb:Scan",
+        "dynamodb:Query",
       ]
       resources = [
-        aws_dynamodb_table.event_instance_table.arn
+        "${aws_dynamodb_table.event_instance_table.arn}/index/*"
       ]
     }
 
@@ -329,12 +452,18 @@ module "event_allocation_reminder" {
   timeout     = 300
   memory_size = 512
 
+  layers = [
+    local.common_layer_arn
+  ]
+
   environment_variables = {
     ALLOCATION_REMINDER_TEMPLATE = aws_ses_template.event_allocation_reminder.name
+    END_DATE_INDEX               = "${var.prefix}-event_instances_end"
     EVENT_INSTANCE_TABLE         = aws_dynamodb_table.event_instance_table.name
     EVENT_SERIES_TABLE           = aws_dynamodb_table.event_series_table.name
     EVENTS_EMAIL                 = var.events_email
     PORTAL_DOMAIN                = aws_route53_record.portal.fqdn
+    REGISTRATION_DATE_INDEX      = "${var.prefix}-event_instances_registration"
   }
 }
 
@@ -367,21 +496,21 @@ module "event_reminder" {
 
   attach_policy_statements = true
   policy_statements = {
-    dynamodb_get = {
+    dynamodb_series = {
       actions = [
-        "dynamodb:GetItem",
+        "dynamodb:BatchGetItem",
       ]
       resources = [
         aws_dynamodb_table.event_series_table.arn
       ]
     }
 
-    dynamodb_scan = {
+    dynamodb_instances = {
       actions = [
-        "dynamodb:Scan",
+        "dynamodb:Query",
       ]
       resources = [
-        aws_dynamodb_table.event_instance_table.arn
+        "${aws_dynamodb_table.event_instance_table.arn}/index/*"
       ]
     }
 
@@ -409,12 +538,17 @@ module "event_reminder" {
   timeout     = 300
   memory_size = 512
 
+  layers = [
+    local.common_layer_arn
+  ]
+
   environment_variables = {
     EVENT_INSTANCE_TABLE    = aws_dynamodb_table.event_instance_table.name
     EVENT_REMINDER_TEMPLATE = aws_ses_template.event_reminder.name
     EVENT_SERIES_TABLE      = aws_dynamodb_table.event_series_table.name
     EVENTS_EMAIL            = var.events_email
     PORTAL_DOMAIN           = aws_route53_record.portal.fqdn
+    START_DATE_INDEX        = "${var.prefix}-event_instances_start"
   }
 }
 
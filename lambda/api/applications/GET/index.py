@@ -3,6 +3,7 @@ from aws_lambda_powertools.utilities.typing import LambdaContext
 
 import boto3
 from   boto3.dynamodb.conditions import Attr
+from   concurrent.futures import ThreadPoolExecutor
 import datetime
 import json
 import os
@@ -12,10 +13,12 @@ logger = Logger()
 
 APPLICATIONS_TABLE = os.getenv('APPLICATIONS_TABLE')
 REFERENCES_TABLE = os.getenv('REFERENCES_TABLE')
+SCAN_SEGMENTS = int(os.getenv('SCAN_SEGMENTS', "4"))
 
 logger.info("Initialising Lambda", extra={"environment_variables": {
   "APPLICATIONS_TABLE": APPLICATIONS_TABLE,
-  "REFERENCES_TABLE": REFERENCES_TABLE
+  "REFERENCES_TABLE": REFERENCES_TABLE,
+  "SCAN_SEGMENTS": SCAN_SEGMENTS
 }})
 
 headers = {
@@ -34,7 +37,7 @@ def handler(event, context: LambdaContext):
   # Get data
   logger.debug("Scanning for all applications")
   try:
-    applications = scan_table(applications_table)
+    applications = scan_table(applications_table, SCAN_SEGMENTS)
   except Exception as e:
     logger.error("Unable to scan applications table", extra={"error": str(e)})
     return {
@@ -45,7 +48,7 @@ def handler(event, context: LambdaContext):
 
   logger.debug("Scanning for all references")
   try:
-    references = scan_table(references_table, FilterExpression=Attr("submittedAt").gt(0))
+    references = scan_table(references_table, SCAN_SEGMENTS, FilterExpression=Attr("submittedAt").gt(0))
   except Exception as e:
     logger.error("Unable to scan references table", extra={"error": str(e)})
     return {
@@ -96,25 +99,25 @@ def handler(event, context: LambdaContext):
     "body": json.dumps(results)
   }
 
-def scan_table(table, **kwargs):
-  results = []
-  last_evaluated_key = None
+def scan_table(table, total_segments=1, **kwargs):
+  if total_segments <= 1:
+    return list(iter_scan(table, **kwargs))
+
+  # Each segment is paginated independently, so segments can be scanned in parallel
+  with ThreadPoolExecutor(max_workers=total_segments) as executor:
+    segments = executor.map(lambda segment: list(iter_scan(table, Segment=segment, TotalSegments=total_segments, **kwargs)), range(total_segments))
+
+    return [item for items in segments for item in items]
+
+def iter_scan(table, **kwargs):
+  # Use the table's client rather than the table itself, as clients are thread safe
+  client = table.meta.client
 
   while True:
-    if last_evaluated_key:
-      response = table.scan(
-        ExclusiveStartKey=last_evaluated_key
-        **kwargs
-      )
-    else: 
-      response = table.scan(
-        **kwargs
-      )
-
-    last_evaluated_key = response.get('LastEvaluatedKey')    
-    results.extend(response['Items'])
-        
-    if not last_evaluated_key:
+    response = client.scan(TableName=table.name, **kwargs)
+    yield from response['Items']
+
+    if 'LastEvaluatedKey' not in response:
       break
 
-  return results
+    kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -1,5 +1,6 @@
 
 import boto3
+from   concurrent.futures import ThreadPoolExecutor
 import json
 import logging
 import os
@@ -9,9 +10,11 @@ logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
 EVENT_ALLOCATIONS_TABLE = os.getenv('EVENT_ALLOCATIONS_TABLE')
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', "10"))
 SUSPENDED_ARN = os.getenv('SUSPENDED_ARN')
 
 logger.info(f"EVENT_ALLOCATIONS_TABLE = {EVENT_ALLOCATIONS_TABLE}")
+logger.info(f"MAX_WORKERS = {MAX_WORKERS}")
 logger.info(f"SUSPENDED_ARN = {SUSPENDED_ARN}")
 
 headers = {
@@ -35,55 +38,93 @@ def handler(event, context):
 
   body = json.loads(event['body'])
 
+  # Check suspension status of everyone being allocated in a single request
+  to_allocate = set()
+  for a in body.get("allocations", []):
+    if a.get("allocation") == "ALLOCATED" or a.get("allocation") == "RESERVE":
+      to_allocate.update(a.get("membershipNumbers", []))
+
+  suspended = get_suspended(list(to_allocate)) if len(to_allocate) > 0 else {}
+
+  # Work out the new allocation for each member, with later allocations taking precedence as they would if applied in turn
+  updates = {}
+  refused = {}
+
   for a in body.get("allocations", []):
     allocation = a.get("allocation")
     if allocation is None:
       logger.warn(f"No allocation provided in {a}")
       continue
 
-    if allocation == "ALLOCATED" or allocation == "RESERVE":
-      # Can't allocate suspended members
-      membership_numbers = [m for m in a.get("membershipNumbers", []) if not is_suspended(m)]
-      logger.info(f"Updating event allocation for {len(membership_numbers)} non-suspended members")
-    else:
-      # Any other allocation status is applicable to suspended members (including ATTENDED, as they might have attended prior to suspension)
-      membership_numbers = a.get("membershipNumbers", [])
-      logger.info(f"Updating event allocation for {len(membership_numbers)} members")
-    
-
-    for m in membership_numbers:
-      # Update allocation
-      try:
-        event_allocations_table.update_item(
-          Key={
-            "combinedEventId": combined_id,
-            "membershipNumber": m
-          },
-          UpdateExpression="SET allocation = :v",
-          ExpressionAttributeValues={
-            ":v": allocation
-          },
-          ReturnValues="ALL_NEW"
-        )
-      except Exception as e:
-        logger.error(f"Unable to update event allocation (Event Series = {event_series_id}, Event ID = {event_id}, Membership Number = {m}) in {EVENT_ALLOCATIONS_TABLE}: {str(e)}")
-        raise e
-
-      logger.info(f"Set allocation to {allocation} for {m} on event {combined_id}")
+    for m in a.get("membershipNumbers", []):
+      # Can't allocate suspended members, but any other allocation status is applicable to them (including ATTENDED, as they might have attended prior to suspension)
+      # Any earlier allocation for them is still applied, as it would have been before this one was refused
+      if (allocation == "ALLOCATED" or allocation == "RESERVE") and suspended.get(str(m), False):
+        refused[m] = {"allocation": allocation, "result": "SUSPENDED"}
+      else:
+        refused.pop(m, None)
+        updates[m] = allocation
+
+  logger.info(f"Updating event allocation for {len(updates)} members ({len(refused)} allocations refused for suspended members)")
+
+  # Apply updates concurrently
+  outcomes = {}
+  with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+    for m, allocation, result in executor.map(lambda u: update_allocation(combined_id, *u), updates.items()):
+      outcomes[m] = {"allocation": allocation, "result": result}
+
+  # Report refusals, unless an earlier allocation for the same member failed
+  for m, outcome in refused.items():
+    if outcomes.get(m, {}).get("result") != "FAILED":
+      outcomes[m] = outcome
+
+  failed = [m for m, o in outcomes.items() if o["result"] == "FAILED"]
+  if len(failed) > 0:
+    logger.error(f"Unable to update event allocation for {len(failed)} members on event {combined_id}: {failed}")
 
   return {
-    "statusCode": 200,
-    "headers": headers
+    "statusCode": 500 if len(failed) > 0 else 200,
+    "headers": headers,
+    "body": json.dumps(outcomes)
   }
 
-def is_suspended(membership_number):
+def update_allocation(combined_id, membership_number, allocation):
+  # Use the table's client rather than the table itself, as clients are thread safe
+  client = event_allocations_table.meta.client
+
+  # Only update existing registrations, so a registration cancelled or deleted concurrently isn't recreated
+  try:
+    client.update_item(
+      TableName=EVENT_ALLOCATIONS_TABLE,
+      Key={
+        "combinedEventId": combined_id,
+        "membershipNumber": membership_number
+      },
+      UpdateExpression="SET allocation = :v",
+      ConditionExpression="attribute_exists(combinedEventId)",
+      ExpressionAttributeValues={
+        ":v": allocation
+      },
+      ReturnValues="NONE"
+    )
+  except client.exceptions.ConditionalCheckFailedException:
+    logger.warn(f"Not setting allocation to {allocation} for {membership_number} on event {combined_id}, as they are not registered")
+    return (membership_number, allocation, "NOT_REGISTERED")
+  except Exception as e:
+    logger.error(f"Unable to update event allocation (Combined Event ID = {combined_id}, Membership Number = {membership_number}) in {EVENT_ALLOCATIONS_TABLE}: {str(e)}")
+    return (membership_number, allocation, "FAILED")
+
+  logger.info(f"Set allocation to {allocation} for {membership_number} on event {combined_id}")
+  return (membership_number, allocation, "UPDATED")
+
+def get_suspended(membership_numbers):
   try:
     suspended = json.loads(lambda_client.invoke(
       FunctionName=SUSPENDED_ARN,
-      Payload=json.dumps({"membershipNumbers": [membership_number]})
+      Payload=json.dumps({"membershipNumbers": membership_numbers})
     )['Payload'].read())
   except Exception as e:
-    logger.error(f"Unable to get suspension status of member: {str(e)}")
+    logger.error(f"Unable to get suspension status of members: {str(e)}")
     raise e
   
-  return suspended.get(membership_number, False)
\ No newline at end of file
+  return suspended
\ No newline at end of file
@@ -1,6 +1,7 @@
 
 import boto3
 from   boto3.dynamodb.conditions import Attr
+from   concurrent.futures import ThreadPoolExecutor
 import datetime
 import json
 import logging
@@ -12,9 +13,11 @@ logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
 COMMITTEE_GROUP = os.getenv('COMMITTEE_GROUP')
 MEMBERS_TABLE = os.getenv('MEMBERS_TABLE')
+SCAN_SEGMENTS = int(os.getenv('SCAN_SEGMENTS', "4"))
 
 logger.info(f"COMMITTEE_GROUP = {COMMITTEE_GROUP}")
 logger.info(f"MEMBERS_TABLE = {MEMBERS_TABLE}")
+logger.info(f"SCAN_SEGMENTS = {SCAN_SEGMENTS}")
 
 headers = {
   "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
@@ -44,7 +47,7 @@ def handler(event, context):
     if COMMITTEE_GROUP in groups:
       projectionExpression += ",email,dateOfBirth,suspended"
 
-    members = scan_table(members_table, ProjectionExpression=projectionExpression, ExpressionAttributeNames=expressionAttributeNames)
+    members = scan_table(members_table, SCAN_SEGMENTS, ProjectionExpression=projectionExpression, ExpressionAttributeNames=expressionAttributeNames)
 
     if COMMITTEE_GROUP in groups:
       today = datetime.date.today()
@@ -71,25 +74,25 @@ def handler(event, context):
     "body": json.dumps(members)
   }
 
-def scan_table(table, **kwargs):
-  results = []
-  last_evaluated_key = None
+def scan_table(table, total_segments=1, **kwargs):
+  if total_segments <= 1:
+    return list(iter_scan(table, **kwargs))
+
+  # Each segment is paginated independently, so segments can be scanned in parallel
+  with ThreadPoolExecutor(max_workers=total_segments) as executor:
+    segments = executor.map(lambda segment: list(iter_scan(table, Segment=segment, TotalSegments=total_segments, **kwargs)), range(total_segments))
+
+    return [item for items in segments for item in items]
+
+def iter_scan(table, **kwargs):
+  # Use the table's client rather than the table itself, as clients are thread safe
+  client = table.meta.client
 
   while True:
-    if last_evaluated_key:
-      response = table.scan(
-        ExclusiveStartKey=last_evaluated_key
-        **kwargs
-      )
-    else: 
-      response = table.scan(
-        **kwargs
-      )
-
-    last_evaluated_key = response.get('LastEvaluatedKey')    
-    results.extend(response['Items'])
-        
-    if not last_evaluated_key:
+    response = client.scan(TableName=table.name, **kwargs)
+    yield from response['Items']
+
+    if 'LastEvaluatedKey' not in response:
       break
 
-  return results
+    kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -1,6 +1,10 @@
-
+from   array import array
+import base64
 import boto3
+import codecs
+import csv
 import datetime
+import io
 import json
 import logging
 import os
@@ -9,7 +13,12 @@ import os
 logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
+COMPASS_BUCKET_NAME = os.getenv('COMPASS_BUCKET_NAME')
+COMPASS_PREFIX = os.getenv('COMPASS_PREFIX', "compass/")
 MEMBERS_TABLE = os.getenv('MEMBERS_TABLE')
+
+logger.info(f"COMPASS_BUCKET_NAME = {COMPASS_BUCKET_NAME}")
+logger.info(f"COMPASS_PREFIX = {COMPASS_PREFIX}")
 logger.info(f"MEMBERS_TABLE = {MEMBERS_TABLE}")
 
 headers = {
@@ -18,15 +27,26 @@ headers = {
   "Access-Control-Allow-Origin": "*"
 }
 
+# Column headings which may hold the membership number in a Compass export
+MEMBERSHIP_NUMBER_COLUMNS = ["membershipnumber", "membership number", "membership no", "membership no.", "contact number"]
+
 # Set up AWS
 dynamodb = boto3.resource('dynamodb')
+s3 = boto3.client('s3')
 
 members_table = dynamodb.Table(MEMBERS_TABLE)
 
 def handler(event, context):
-  # Get submitted list
-  body = json.loads(event['body'])
-  compass_members = body.get('members', [])
+  # Get submitted list, either as a JSON list, a CSV body or a CSV object in S3
+  try:
+    compass_members = read_compass_members(event)
+  except Exception as e:
+    logger.warn(f"Unable to read member list: {str(e)}")
+    return {
+      "statusCode": 400,
+      "headers": headers,
+      "body": "Unable to read member list"
+    }
 
   if len(compass_members) == 0:
     logger.warn("Empty member list received")
@@ -38,7 +58,7 @@ def handler(event, context):
 
   # Get list from Portal
   try:
-    portal_members = scan_members()
+    portal_members_map = scan_members()
   except Exception as e:
     logger.error(f"Unable to list members: {str(e)}")
     return {
@@ -47,20 +67,17 @@ def handler(event, context):
       "body": "Unable to list members"
     }
 
-  # Combine and restructure lists
-  combined_members = set(compass_members)
-  portal_members_map = {}
-  for m in portal_members:
-    portal_members_map[int(m["membershipNumber"])] = m
-    combined_members.add(int(m["membershipNumber"]))
+  logger.info(f"Comparing {len(compass_members)} Compass members to {len(portal_members_map)} Portal members")
 
-  # Calculate response
+  # Calculate response by merging the two sorted lists of membership numbers
+  today = datetime.date.today().isoformat()
   grace_period = (datetime.date.today() - datetime.timedelta(days=60)).isoformat()
+
+  compass_sorted = array('q', sorted(compass_members))
+  portal_sorted = array('q', sorted(portal_members_map.keys()))
+
   comparison_result = []
-  for m in combined_members:
-    compass = (m in compass_members)
-    portal = (m in portal_members_map)
-    
+  for m, compass, portal in merge_sorted(compass_sorted, portal_sorted):
     name = None
 
     if portal:
@@ -71,8 +88,8 @@ def handler(event, context):
 
       name = fname + " " + pm['surname']
 
-      portal_active = (portal_members_map[m]['status'] == "ACTIVE")
-      portal_grace = (portal_members_map[m].get('membershipExpires', datetime.date.today().isoformat()) > grace_period)
+      portal_active = (pm['status'] == "ACTIVE")
+      portal_grace = (pm.get('membershipExpires', today) > grace_period)
       
       if portal_active == compass:
         action = "NONE"
@@ -97,8 +114,80 @@ def handler(event, context):
     "body": json.dumps(comparison_result)
   }
 
+def merge_sorted(compass_sorted, portal_sorted):
+  # Walk both sorted lists together, yielding each membership number once with where it was found
+  i = 0
+  j = 0
+
+  while i < len(compass_sorted) or j < len(portal_sorted):
+    if j == len(portal_sorted) or (i < len(compass_sorted) and compass_sorted[i] < portal_sorted[j]):
+      yield (compass_sorted[i], True, False)
+      i += 1
+    elif i == len(compass_sorted) or portal_sorted[j] < compass_sorted[i]:
+      yield (portal_sorted[j], False, True)
+      j += 1
+    else:
+      yield (compass_sorted[i], True, True)
+      i += 1
+      j += 1
+
+def read_compass_members(event):
+  content_type = {k.lower(): v for k, v in (event.get('headers') or {}).items()}.get('content-type', "application/json")
+
+  body = event.get('body') or ""
+  if event.get('isBase64Encoded', False):
+    body = base64.b64decode(body).decode("utf-8-sig")
+
+  # CSV export from Compass posted directly
+  if content_type.startswith("text/csv"):
+    return parse_membership_numbers(csv.reader(io.StringIO(body)))
+
+  body = json.loads(body)
+
+  # CSV export from Compass previously uploaded to S3 via /members/compare/upload, which is streamed rather than loaded into memory
+  if body.get('key'):
+    # Only allow the requestor's own uploads to be read
+    requestor = event['requestContext']['authorizer']['membershipNumber']
+    if not body['key'].startswith(f"{COMPASS_PREFIX}{requestor}/"):
+      raise Exception(f"Key {body['key']} was not uploaded by {requestor}")
+
+    logger.info(f"Reading Compass export from s3://{COMPASS_BUCKET_NAME}/{body['key']}")
+    obj = s3.get_object(Bucket=COMPASS_BUCKET_NAME, Key=body['key'])
+    return parse_membership_numbers(csv.reader(codecs.getreader("utf-8-sig")(obj['Body'])))
+
+  # List of membership numbers
+  return set(map(int, body.get('members', [])))
+
+def parse_membership_numbers(reader):
+  # Use the membership number column if there's a recognised header, otherwise the first column
+  column = 0
+  members = set()
+  invalid = 0
+
+  for row_number, row in enumerate(reader):
+    if len(row) == 0:
+      continue
+
+    if row_number == 0:
+      headings = [h.strip().lower() for h in row]
+      matches = [i for i, h in enumerate(headings) if h in MEMBERSHIP_NUMBER_COLUMNS]
+      if matches:
+        column = matches[0]
+        continue
+
+    try:
+      members.add(int(row[column].strip()))
+    except (IndexError, ValueError):
+      invalid += 1
+
+  if invalid > 0:
+    logger.warn(f"{invalid} rows without a valid membership number were ignored")
+
+  return members
+
 def scan_members(**kwargs):
-  results = []
+  # Build the lookup as pages are read, rather than holding a list of every item as well
+  results = {}
   last_evaluated_key = None
 
   while True:
@@ -121,7 +210,8 @@ def scan_members(**kwargs):
       )
 
     last_evaluated_key = response.get('LastEvaluatedKey')    
-    results.extend(response['Items'])
+    for m in response['Items']:
+      results[int(m["membershipNumber"])] = m
         
     if not last_evaluated_key:
       break
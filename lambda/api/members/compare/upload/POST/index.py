@@ -0,0 +1,72 @@
+import boto3
+import datetime
+import json
+import logging
+import os
+import uuid
+
+logger = logging.getLogger()
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+COMPASS_BUCKET_NAME = os.getenv("COMPASS_BUCKET_NAME")
+COMPASS_PREFIX = os.getenv("COMPASS_PREFIX", "compass/")
+EXPIRATION = int(os.getenv("EXPIRATION", "300"))
+MAX_SIZE = int(os.getenv("MAX_SIZE", str(10 * 1024 * 1024)))
+
+logger.info(f"COMPASS_BUCKET_NAME = {COMPASS_BUCKET_NAME}")
+logger.info(f"COMPASS_PREFIX = {COMPASS_PREFIX}")
+logger.info(f"EXPIRATION = {EXPIRATION}")
+logger.info(f"MAX_SIZE = {MAX_SIZE}")
+
+headers = {
+  "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
+  "Access-Control-Allow-Methods": "OPTIONS,POST",
+  "Access-Control-Allow-Origin": "*"
+}
+
+s3 = boto3.client("s3")
+
+def handler(event, context):
+  try:
+    requestor = event['requestContext']['authorizer']['membershipNumber']
+  except Exception as e:
+    logger.warn(f"Unable to get membership number of requestor: {str(e)}")
+    return {
+      "statusCode": 500,
+      "headers": headers,
+      "body": "Unable to get membership number of requestor"
+    }
+
+  # Generate presigned POST, so the Compass export is uploaded straight to S3 and then compared by key
+  key = f"{COMPASS_PREFIX}{requestor}/{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4()}.csv"
+
+  try:
+    post = s3.generate_presigned_post(
+      Bucket=COMPASS_BUCKET_NAME,
+      Key=key,
+      Conditions=[
+        ["starts-with", "$Content-Type", "text/"],
+        ["content-length-range", 1, MAX_SIZE]
+      ],
+      ExpiresIn=EXPIRATION
+    )
+  except Exception as e:
+    logger.error(f"Failed to generate presigned POST: {str(e)}")
+    return {
+      "statusCode": 500,
+      "headers": headers,
+      "body": "Failed to generate presigned POST"
+    }
+
+  logger.info(f"Presigned POST generated for {requestor} to upload {key}")
+
+  return {
+    "statusCode": 200,
+    "headers": headers,
+    "body": json.dumps({
+      "url": post["url"],
+      "fields": post["fields"],
+      "key": key,
+      "maxSize": MAX_SIZE
+    })
+  }
@@ -1,13 +1,17 @@
 
 import boto3
 from   boto3.dynamodb.conditions import Attr, Key
+from   concurrent.futures import ThreadPoolExecutor
 import csv
 import datetime
+from   functools import lru_cache
 from   io import StringIO
 import json
 import logging
 import os
 import phonenumbers
+from   portal_common.dynamodb import BATCH_GET_SIZE, batch_get
+import uuid
 
 
 # Configure logging
@@ -15,10 +19,16 @@ logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
 ALLOCATIONS_TABLE = os.getenv('ALLOCATIONS_TABLE')
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', "4"))
+EXPIRATION = int(os.getenv('EXPIRATION', "900"))
+EXPORT_BUCKET_NAME = os.getenv('EXPORT_BUCKET_NAME')
 FIELD_NAMES = os.getenv('FIELD_NAMES', "membershipNumber,firstName,preferredName,surname").split(",")
 MEMBERS_TABLE = os.getenv('MEMBERS_TABLE')
 
 logger.info(f"ALLOCATIONS_TABLE = {ALLOCATIONS_TABLE}")
+logger.info(f"BATCH_WORKERS = {BATCH_WORKERS}")
+logger.info(f"EXPIRATION = {EXPIRATION}")
+logger.info(f"EXPORT_BUCKET_NAME = {EXPORT_BUCKET_NAME}")
 logger.info(f"FIELD_NAMES = {FIELD_NAMES}")
 logger.info(f"MEMBERS_TABLE = {MEMBERS_TABLE}")
 
@@ -29,17 +39,28 @@ headers = {
   "Content-Type": "text/csv"
 }
 
+json_headers = {
+  **headers,
+  "Content-Type": "application/json"
+}
+
+# Minimum size of all but the last part of a multipart upload
+PART_SIZE = 5 * 1024 * 1024
+
 # Set up AWS
 dynamodb = boto3.resource('dynamodb')
 
 allocations_table = dynamodb.Table(ALLOCATIONS_TABLE)
 members_table = dynamodb.Table(MEMBERS_TABLE)
 
+s3 = boto3.client('s3')
+
 def handler(event, context):
   body = json.loads(event.get('body', '{}'))
 
   combinedEventId = body.get('combinedEventId', None)
   members = body.get('members', [])
+  output = body.get('output', 'inline')
 
   try:
     requestor = event['requestContext']['authorizer']['membershipNumber']
@@ -77,24 +98,45 @@ def handler(event, context):
   else:
     member_information = get_all_members()
   
-  # Format fields
-  for member in member_information:
-    if member.get("lastUpdated"):
-      member["lastUpdated"] = datetime.datetime.fromtimestamp(int(member["lastUpdated"])).isoformat()
-    
-    if member.get("telephone"):
-      tel = phonenumbers.parse(member["telephone"], None)
-      member["telephone"] = phonenumbers.format_number(tel, phonenumbers.PhoneNumberFormat.INTERNATIONAL)
-    
-    if member.get("emergencyContactTelephone"):
-      tel = phonenumbers.parse(member["emergencyContactTelephone"], None)
-      member["emergencyContactTelephone"] = phonenumbers.format_number(tel, phonenumbers.PhoneNumberFormat.INTERNATIONAL)
-
-  # Convert to CSV
+  # Format fields as they are written, so that scanned members needn't all be held in memory
+  rows = map(format_member, member_information)
+
+  # Write CSV to S3 and return a link to it
+  if output == "s3":
+    key = f"{requestor}/{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4()}.csv"
+
+    try:
+      with S3MultipartWriter(EXPORT_BUCKET_NAME, key, "text/csv") as s3_writer:
+        writer = csv.DictWriter(s3_writer, fieldnames=field_names, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+      url = s3.generate_presigned_url("get_object", ExpiresIn=EXPIRATION, Params={
+        "Bucket": EXPORT_BUCKET_NAME,
+        "Key": key,
+        "ResponseContentDisposition": "attachment; filename=\"export.csv\""
+      })
+    except Exception as e:
+      logger.error(f"Unable to write export to S3: {str(e)}")
+      return {
+        "statusCode": 500,
+        "headers": json_headers,
+        "body": "Unable to write export to S3"
+      }
+
+    logger.info(f"Export of {s3_writer.size} bytes written to s3://{EXPORT_BUCKET_NAME}/{key}")
+
+    return {
+      "statusCode": 200,
+      "headers": json_headers,
+      "body": json.dumps({"url": url, "expiresIn": EXPIRATION})
+    }
+
+  # Otherwise convert to CSV and return inline
   csv_string = StringIO()
   writer = csv.DictWriter(csv_string, fieldnames=field_names, extrasaction='ignore')
   writer.writeheader()
-  writer.writerows(member_information)
+  writer.writerows(rows)
 
   return {
     "statusCode": 200,
@@ -103,24 +145,61 @@ def handler(event, context):
   }
 
 
+def format_member(member):
+  if member.get("lastUpdated"):
+    member["lastUpdated"] = datetime.datetime.fromtimestamp(int(member["lastUpdated"])).isoformat()
+  
+  # Use the formatted numbers stored by PUT /members/{id} where available, and format older records on the fly
+  if member.get("telephone"):
+    member["telephone"] = member.get("telephoneFormatted") or format_telephone(member["telephone"])
+  
+  if member.get("emergencyContactTelephone"):
+    member["emergencyContactTelephone"] = member.get("emergencyContactTelephoneFormatted") or format_telephone(member["emergencyContactTelephone"])
+
+  return member
+
+
+# Emergency contacts are often shared between members, so the same numbers are formatted repeatedly
+@lru_cache(maxsize=4096)
+def format_telephone(telephone):
+  tel = phonenumbers.parse(telephone, None)
+  return phonenumbers.format_number(tel, phonenumbers.PhoneNumberFormat.INTERNATIONAL)
+
+
 def get_members(members):
-  results = []
+  # BatchGetItem rejects duplicate keys, so remove them (preserving order)
+  members = list(dict.fromkeys(members))
+  chunks = [members[i:i + BATCH_GET_SIZE] for i in range(0, len(members), BATCH_GET_SIZE)]
 
-  for member in members:
-    try:
-      result = members_table.get_item(Key={
-        "membershipNumber": member
-      })['Item']
+  found = {}
+  with ThreadPoolExecutor(max_workers=max(1, min(BATCH_WORKERS, len(chunks)))) as executor:
+    for items in executor.map(batch_get_members, chunks):
+      if items is None:
+        continue
 
-      results.append(result)
-    except Exception as e:
-      logger.error(f"Unable to get details of {member}: {str(e)}")
+      for item in items:
+        found[item['membershipNumber']] = item
+
+  results = []
+  for member in members:
+    if member in found:
+      results.append(found[member])
+    else:
+      logger.error(f"Unable to get details of {member}")
 
   return results
 
 
+def batch_get_members(membership_numbers):
+  try:
+    return batch_get(dynamodb, MEMBERS_TABLE, [{"membershipNumber": m} for m in membership_numbers])
+  except Exception as e:
+    logger.error(f"Unable to get details of {len(membership_numbers)} members: {str(e)}")
+    return None
+
+
 def get_all_members():
-  results = []
+  # Yield members a page at a time, rather than loading the whole table
   last_evaluated_key = None
 
   while True:
@@ -132,13 +211,11 @@ def get_all_members():
       response = members_table.scan()
 
     last_evaluated_key = response.get('LastEvaluatedKey')    
-    results.extend(response['Items'])
+    yield from response['Items']
         
     if not last_evaluated_key:
       break
 
-  return results
-
 
 def get_allocations(combined_event_id):
   results = []
@@ -169,4 +246,87 @@ def get_allocations(combined_event_id):
 def merge_allocations(member_information, allocations):
   for m in member_information:
     status = allocations.get(m['membershipNumber'], "NOT_REGISTERED")
-    m['allocationStatus'] = status
\ No newline at end of file
+    m['allocationStatus'] = status
+
+
+# File-like object which streams text written to it to S3 as a multipart upload
+class S3MultipartWriter:
+
+  def __init__(self, bucket, key, content_type):
+    self.bucket = bucket
+    self.key = key
+    self.content_type = content_type
+
+    self.parts = []
+    self.buffer = []
+    self.buffer_size = 0
+    self.size = 0
+    self.upload_id = None
+
+  def __enter__(self):
+    self.upload_id = s3.create_multipart_upload(
+      Bucket=self.bucket,
+      Key=self.key,
+      ContentType=self.content_type
+    )['UploadId']
+
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is not None:
+      self.abort()
+      return False
+
+    try:
+      self.flush()
+      s3.complete_multipart_upload(
+        Bucket=self.bucket,
+        Key=self.key,
+        UploadId=self.upload_id,
+        MultipartUpload={"Parts": self.parts}
+      )
+    except Exception:
+      self.abort()
+      raise
+
+    return False
+
+  def write(self, text):
+    data = text.encode("utf-8")
+
+    self.buffer.append(data)
+    self.buffer_size += len(data)
+    self.size += len(data)
+
+    if self.buffer_size >= PART_SIZE:
+      self.flush()
+
+    return len(text)
+
+  def flush(self):
+    # S3 requires at least one part, even if it is empty
+    if self.buffer_size == 0 and len(self.parts) > 0:
+      return
+
+    part_number = len(self.parts) + 1
+    response = s3.upload_part(
+      Bucket=self.bucket,
+      Key=self.key,
+      UploadId=self.upload_id,
+      PartNumber=part_number,
+      Body=b"".join(self.buffer)
+    )
+
+    self.parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+    self.buffer = []
+    self.buffer_size = 0
+
+  def abort(self):
+    try:
+      s3.abort_multipart_upload(
+        Bucket=self.bucket,
+        Key=self.key,
+        UploadId=self.upload_id
+      )
+    except Exception as e:
+      logger.error(f"Unable to abort multipart upload {self.upload_id}: {str(e)}")
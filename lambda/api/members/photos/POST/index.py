@@ -0,0 +1,161 @@
+import boto3
+from   botocore.exceptions import ClientError
+from   concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+from   portal_common.dynamodb import batch_get_items
+
+logger = logging.getLogger()
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', "4"))
+EXPIRATION = int(os.getenv("EXPIRATION", "3600"))
+MAX_MEMBERS = int(os.getenv("MAX_MEMBERS", "500"))
+MEMBERS_TABLE = os.getenv('MEMBERS_TABLE')
+PHOTO_BUCKET_NAME = os.getenv("PHOTO_BUCKET_NAME")
+RENDITION_SIZES = sorted([int(s) for s in os.getenv('RENDITION_SIZES', "64,128,256,512,1024").split(",")], reverse=True)
+
+logger.info(f"BATCH_WORKERS = {BATCH_WORKERS}")
+logger.info(f"EXPIRATION = {EXPIRATION}")
+logger.info(f"MAX_MEMBERS = {MAX_MEMBERS}")
+logger.info(f"MEMBERS_TABLE = {MEMBERS_TABLE}")
+logger.info(f"PHOTO_BUCKET_NAME = {PHOTO_BUCKET_NAME}")
+logger.info(f"RENDITION_SIZES = {RENDITION_SIZES}")
+
+headers = {
+  "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
+  "Access-Control-Allow-Methods": "OPTIONS,POST",
+  "Access-Control-Allow-Origin": "*"
+}
+
+# Legacy photos are only available as a 128px thumbnail and a 1024px original
+LEGACY_THUMBNAIL_SIZE = 128
+
+# Set up AWS
+dynamodb = boto3.resource('dynamodb')
+s3 = boto3.client("s3")
+
+members_table = dynamodb.Table(MEMBERS_TABLE)
+
+def handler(event, context):
+  try:
+    body = json.loads(event['body'])
+    members = [str(m) for m in body['members']]
+    size = body.get('size')
+  except Exception as e:
+    logger.warning(f"Unable to parse request: {str(e)}")
+    return {
+      "statusCode": 400,
+      "headers": headers,
+      "body": "Request must contain a list of members"
+    }
+
+  if len(members) > MAX_MEMBERS:
+    return {
+      "statusCode": 400,
+      "headers": headers,
+      "body": f"No more than {MAX_MEMBERS} members can be requested at once"
+    }
+
+  if size is not None and size not in RENDITION_SIZES:
+    return {
+      "statusCode": 400,
+      "headers": headers,
+      "body": f"Size must be one of {', '.join([str(s) for s in RENDITION_SIZES])}"
+    }
+
+  # Check which members have a photo (and in which sizes) from the members table, rather than listing the bucket
+  try:
+    has_photo = get_has_photo(members)
+  except Exception as e:
+    logger.error(f"Unable to get photo status of members: {str(e)}")
+    return {
+      "statusCode": 500,
+      "headers": headers,
+      "body": "Unable to get photo status of members"
+    }
+
+  # Presigned URLs are signed locally, so this makes no requests to S3
+  photos = {}
+  try:
+    for membershipNumber in members:
+      if has_photo.get(membershipNumber) is not None:
+        photos[membershipNumber] = s3.generate_presigned_url("get_object", ExpiresIn=EXPIRATION, Params={
+          "Bucket": PHOTO_BUCKET_NAME,
+          "Key": photo_key(membershipNumber, size, has_photo[membershipNumber])
+        })
+      else:
+        photos[membershipNumber] = None
+  except Exception as e:
+    logger.error(f"Failed to generate presigned URLs: {str(e)}")
+    return {
+      "statusCode": 500,
+      "headers": headers,
+      "body": "Failed to generate presigned URLs"
+    }
+
+  return {
+    "statusCode": 200,
+    "headers": headers,
+    "body": json.dumps({"photos": photos, "expiresIn": EXPIRATION})
+  }
+
+def photo_key(membershipNumber, size, renditions):
+  if size is None:
+    return membershipNumber + ".thumb.jpg"
+
+  if size in renditions:
+    return f"{membershipNumber}.{size}.webp"
+
+  # Fall back to the nearest JPEG which exists for photos without the requested rendition
+  return membershipNumber + (".thumb.jpg" if size <= LEGACY_THUMBNAIL_SIZE else ".jpg")
+
+def get_has_photo(members):
+  # Maps each member with a photo to the rendition sizes available, and those without a photo to None
+  items = batch_get_items(dynamodb, MEMBERS_TABLE, [{"membershipNumber": m} for m in members], "membershipNumber, hasPhoto, photoRenditions", workers=BATCH_WORKERS)
+
+  has_photo = {}
+  unknown = []
+  for item in items:
+    if 'hasPhoto' not in item:
+      unknown.append(item['membershipNumber'])
+    elif item['hasPhoto']:
+      has_photo[item['membershipNumber']] = [int(s) for s in item.get('photoRenditions', [])]
+    else:
+      has_photo[item['membershipNumber']] = None
+
+  # Members whose photo predates the hasPhoto flag are checked once, and the flag recorded for next time
+  if len(unknown) > 0:
+    logger.info(f"Checking for photos of {len(unknown)} members without a hasPhoto flag")
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_WORKERS, len(unknown)))) as executor:
+      for membershipNumber, found in zip(unknown, executor.map(backfill_has_photo, unknown)):
+        # Photos found this way predate renditions
+        has_photo[membershipNumber] = [] if found else None
+
+  return has_photo
+
+def backfill_has_photo(membershipNumber):
+  try:
+    s3.head_object(Bucket=PHOTO_BUCKET_NAME, Key=membershipNumber + ".jpg")
+    found = True
+  except ClientError as e:
+    if e.response.get('Error', {}).get('Code') not in ["NoSuchKey", "404"]:
+      logger.error(f"Unable to check photo for {membershipNumber}: {str(e)}")
+      return False
+
+    found = False
+
+  try:
+    members_table.meta.client.update_item(
+      TableName=MEMBERS_TABLE,
+      Key={"membershipNumber": membershipNumber},
+      UpdateExpression="SET hasPhoto = :hasPhoto",
+      ConditionExpression="attribute_exists(membershipNumber) AND attribute_not_exists(hasPhoto)",
+      ExpressionAttributeValues={":hasPhoto": found}
+    )
+  except ClientError as e:
+    if e.response.get('Error', {}).get('Code') != "ConditionalCheckFailedException":
+      logger.warning(f"Unable to record hasPhoto for {membershipNumber}: {str(e)}")
+
+  return found
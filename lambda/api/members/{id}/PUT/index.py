@@ -116,7 +116,7 @@ def handler(event, context):
   response = table.update_item(Key = { "membershipNumber": membershipNumber },
     ConditionExpression = "membershipNumber = :membershipNumber",
     ReturnValues = "UPDATED_NEW",
-    UpdateExpression = "SET firstName = :firstName, surname = :surname, preferredName = :preferredName, medicalInformation = :medicalInformation, dietaryRequirements = :dietaryRequirements, email = :email, telephone = :telephone, address = :address, postcode = :postcode, emergencyContactName = :emergencyContactName, emergencyContactTelephone = :emergencyContactTelephone, lastUpdated = :lastUpdated",
+    UpdateExpression = "SET firstName = :firstName, surname = :surname, preferredName = :preferredName, medicalInformation = :medicalInformation, dietaryRequirements = :dietaryRequirements, email = :email, telephone = :telephone, address = :address, postcode = :postcode, emergencyContactName = :emergencyContactName, emergencyContactTelephone = :emergencyContactTelephone, telephoneFormatted = :telephoneFormatted, emergencyContactTelephoneFormatted = :emergencyContactTelephoneFormatted, lastUpdated = :lastUpdated",
     ExpressionAttributeValues = {
       ":membershipNumber": membershipNumber,
       ":firstName": firstName,
@@ -130,6 +130,8 @@ def handler(event, context):
       ":postcode": postcode[:-3] + " " + postcode[-3:],
       ":emergencyContactName": emergencyContactName,
       ":emergencyContactTelephone": phonenumbers.format_number(emergencyContactTelephone, phonenumbers.PhoneNumberFormat.E164),
+      ":telephoneFormatted": phonenumbers.format_number(telephone, phonenumbers.PhoneNumberFormat.INTERNATIONAL),
+      ":emergencyContactTelephoneFormatted": phonenumbers.format_number(emergencyContactTelephone, phonenumbers.PhoneNumberFormat.INTERNATIONAL),
       ":lastUpdated": int(time.time())
     }
   )
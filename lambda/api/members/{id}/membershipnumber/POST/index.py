@@ -1,5 +1,6 @@
 import boto3
-from   boto3.dynamodb.conditions import Attr
+from   boto3.dynamodb.conditions import Attr, Key
+from   botocore.exceptions import ClientError
 import json
 import logging
 import os
@@ -11,10 +12,14 @@ logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 EVENT_ALLOCATIONS_INDEX = os.getenv('EVENT_ALLOCATIONS_INDEX')
 EVENT_ALLOCATIONS_TABLE = os.getenv('EVENT_ALLOCATIONS_TABLE')
 MEMBERS_TABLE = os.getenv('MEMBERS_TABLE')
+PHOTO_BUCKET_NAME = os.getenv('PHOTO_BUCKET_NAME')
+RENDITION_SIZES = sorted([int(s) for s in os.getenv('RENDITION_SIZES', "64,128,256,512,1024").split(",")], reverse=True)
 
 logger.info(f"EVENT_ALLOCATIONS_INDEX = {EVENT_ALLOCATIONS_INDEX}")
 logger.info(f"EVENT_ALLOCATIONS_TABLE = {EVENT_ALLOCATIONS_TABLE}")
 logger.info(f"MEMBERS_TABLE = {MEMBERS_TABLE}")
+logger.info(f"PHOTO_BUCKET_NAME = {PHOTO_BUCKET_NAME}")
+logger.info(f"RENDITION_SIZES = {RENDITION_SIZES}")
 
 headers = {
   "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
@@ -22,10 +27,17 @@ headers = {
   "Access-Control-Allow-Origin": "*"
 }
 
+# Every rendition of a member's photo, as written by the sync_photos Lambda
+PHOTO_SUFFIXES = [".jpg", ".thumb.jpg"] + [f".{size}.{ext}" for size in RENDITION_SIZES for ext in ["webp", "jpg"]]
+
+# Allocations moved per transaction, as each is a put and a delete and a transaction is limited to 100 items
+TRANSACTION_ALLOCATIONS = 50
+
 # TODO: Can we avoid Cognito creating a new account, and instead reuse the existing one?
 
 # Set up AWS
 dynamodb = boto3.resource('dynamodb')
+s3 = boto3.client('s3')
 
 event_allocations_table = dynamodb.Table(EVENT_ALLOCATIONS_TABLE)
 members_table = dynamodb.Table(MEMBERS_TABLE)
@@ -63,7 +75,7 @@ def handler(event, context):
   logger.info(f"Confirming member {membershipNumber} exists")
 
   try:
-    member = members_table.get_item(Key={'membershipNumber': str(membershipNumber)}, ProjectionExpression="membershipNumber")['Item']
+    member = members_table.get_item(Key={'membershipNumber': str(membershipNumber)}, ProjectionExpression="membershipNumber, renumberedTo")['Item']
   except Exception as e:
     logger.error(f"Unable to confirm member {membershipNumber} exists: {str(e)}")
     return {
@@ -75,7 +87,7 @@ def handler(event, context):
   logger.info("Validating input")
 
   try:
-    newMembershipNumber = int(event['body']['membershipNumber'])
+    newMembershipNumber = int(json.loads(event['body'])['membershipNumber'])
   except Exception as e:
     logger.error(f"Unable to parse new membership number: {str(e)}")
     return {
@@ -92,32 +104,49 @@ def handler(event, context):
       "body": "Membership number must be positive"
     }
   
-  # TODO: Confirm membership number is different
+  if str(newMembershipNumber) == str(membershipNumber):
+    logger.error(f"Membership number {newMembershipNumber} is unchanged")
+    return {
+      "statusCode": 422,
+      "headers": headers,
+      "body": "Membership number is unchanged"
+    }
   
+  # A member left with renumberedTo by an earlier request which failed part way through is finished
+  # off by repeating it
+  resuming = member.get('renumberedTo') == str(newMembershipNumber)
+
+  if 'renumberedTo' in member and not resuming:
+    logger.error(f"Member {membershipNumber} is already being renumbered to {member['renumberedTo']}")
+    return {
+      "statusCode": 422,
+      "headers": headers,
+      "body": "Member is already being renumbered"
+    }
+
   logger.info(f"Confirming member {newMembershipNumber} does not already exist")
 
   try:
-    member = members_table.get_item(Key={'membershipNumber': str(newMembershipNumber)}, ProjectionExpression="membershipNumber")['Item']
+    existing = members_table.get_item(Key={'membershipNumber': str(newMembershipNumber)}, ProjectionExpression="membershipNumber")
+  except Exception as e:
+    logger.error(f"Unable to confirm member {newMembershipNumber} does not already exist: {str(e)}")
+    return {
+      "statusCode": 500,
+      "headers": headers,
+      "body": "Unable to confirm member does not already exist"
+    }
 
-    logger.error(f"Member {newMembershipNumber} already exists: {str(e)}")
+  if 'Item' in existing and not resuming:
+    logger.error(f"Member {newMembershipNumber} already exists")
     return {
       "statusCode": 422,
       "headers": headers,
       "body": "Member already exists"
     }
-  except Exception as e:
-    # Do nothing - we want this to fail as the member shouldn't already exist
-    pass
 
   logger.info(f"Getting event allocations for member {membershipNumber}")
   try:
-    allocations = event_allocations_table.query(
-      IndexName=EVENT_ALLOCATIONS_INDEX,
-      KeyConditionExpression="membershipNumber=:membershipNumber",
-      ExpressionAttributeValues={
-        ":membershipNumber": str(membershipNumber)
-      }
-    )['Items']
+    allocations = get_allocations(str(membershipNumber))
   except Exception as e:
     logger.error(f"Unable to get allocations for member {membershipNumber}: {str(e)}")
     return {
@@ -127,21 +156,51 @@ def handler(event, context):
     }
 
   logger.info(f"Updating membership number for member {membershipNumber} to {newMembershipNumber}")
-  
-  # TODO: Copy photo - must be done prior to deleting from membership table
 
-  # Update (delete and recreate) membership table
-  logger.info(f"Updating membership table for member {membershipNumber}")
-  replace_dynamodb_item(members_table, {'membershipNumber': str(membershipNumber)}, {'membershipNumber': str(newMembershipNumber)})
+  # Copy photo - must be done prior to deleting from membership table, as that deletes the photo
+  try:
+    copy_photo(str(membershipNumber), str(newMembershipNumber))
+  except Exception as e:
+    logger.error(f"Unable to copy photo for member {membershipNumber}: {str(e)}")
+    return {
+      "statusCode": 500,
+      "headers": headers,
+      "body": "Couldn't copy photo"
+    }
+
+  # Update (delete and recreate) event allocations before the member, so if any can't be moved the member
+  # keeps their old number and a retry moves the rest
+  logger.info(f"Updating {len(allocations)} event allocations for member {membershipNumber}")
+  migrated, failed = replace_allocations(allocations, str(newMembershipNumber))
 
-  # Update (delete and recreate) event allocations
-  logger.info(f"Updating event allocations table for member {membershipNumber}")
-  for allocation in allocations:
-    logger.debug(f"Updating membership number for event {allocation['combinedEventId']}")
-    replace_dynamodb_item(event_allocations_table, {'combinedEventId': allocation['combinedEventId'], 'membershipNumber': str(membershipNumber)}, {'combinedEventId': allocation['combinedEventId'], 'membershipNumber': str(newMembershipNumber)})
+  if failed > 0:
+    logger.error(f"Unable to update {failed} of {len(allocations)} event allocations for member {membershipNumber}")
+    return {
+      "statusCode": 500,
+      "headers": headers,
+      "body": "Couldn't update all event allocations"
+    }
 
+  # Update (delete and recreate) membership table in a single transaction, so the member can't be lost or duplicated
+  logger.info(f"Updating membership table for member {membershipNumber}")
+  try:
+    replace_member(str(membershipNumber), str(newMembershipNumber))
+  except dynamodb.meta.client.exceptions.TransactionCanceledException as e:
+    logger.error(f"Unable to update membership table for member {membershipNumber}: {str(e)}")
+    return {
+      "statusCode": 422,
+      "headers": headers,
+      "body": "Member already exists"
+    }
+  except Exception as e:
+    logger.error(f"Unable to update membership table for member {membershipNumber}: {str(e)}")
+    return {
+      "statusCode": 500,
+      "headers": headers,
+      "body": "Couldn't update membership number"
+    }
 
-  logger.info(f"Successfully updated membership number for member {membershipNumber} to {newMembershipNumber}")
+  logger.info(f"Successfully updated membership number for member {membershipNumber} to {newMembershipNumber} ({migrated} event allocations)")
 
   # TODO: Send an e-mail explaining that their membership number has been changed and that they'll have received the welcome e-mail again?
 
@@ -150,13 +209,112 @@ def handler(event, context):
     "headers": headers
   }
 
-def replace_dynamodb_item(table, key, new_key):
-  curr = table.get_item(Key=key)['Item']
-  # TODO: Delete item
-  
-  new_item = curr | new_key
+def get_allocations(membership_number):
+  # The index projects all attributes, so the allocations can be recreated without reading them again
+  results = []
+  last_evaluated_key = None
+
+  while True:
+    if last_evaluated_key:
+      response = event_allocations_table.query(
+        IndexName=EVENT_ALLOCATIONS_INDEX,
+        KeyConditionExpression=Key("membershipNumber").eq(membership_number),
+        ExclusiveStartKey=last_evaluated_key
+      )
+    else: 
+      response = event_allocations_table.query(
+        IndexName=EVENT_ALLOCATIONS_INDEX,
+        KeyConditionExpression=Key("membershipNumber").eq(membership_number)
+      )
+
+    last_evaluated_key = response.get('LastEvaluatedKey')    
+    results.extend(response['Items'])
+        
+    if not last_evaluated_key:
+      break
+
+  return results
+
+def copy_photo(membership_number, new_membership_number):
+  # Server-side copy, so the photo never passes through the Lambda
+  for suffix in PHOTO_SUFFIXES:
+    try:
+      s3.copy_object(
+        Bucket=PHOTO_BUCKET_NAME,
+        Key=new_membership_number + suffix,
+        CopySource={
+          "Bucket": PHOTO_BUCKET_NAME,
+          "Key": membership_number + suffix
+        }
+      )
+    except ClientError as e:
+      if e.response.get('Error', {}).get('Code') in ["NoSuchKey", "404"]:
+        logger.debug(f"No photo {membership_number + suffix} to copy")
+        continue
+
+      raise e
 
-  table.put_item(
-    Item=new_item,
-    ReturnValues = "NONE"
+def replace_member(membership_number, new_membership_number):
+  curr = members_table.get_item(Key={'membershipNumber': membership_number}, ConsistentRead=True)['Item']
+
+  # The old item is marked with renumberedTo as the new one is created, so when it's deleted sync_members
+  # knows the member still exists and leaves their MailChimp subscription alone
+  if curr.get('renumberedTo') != new_membership_number:
+    dynamodb.meta.client.transact_write_items(
+      TransactItems=[
+        {
+          "Put": {
+            "TableName": MEMBERS_TABLE,
+            "Item": curr | {'membershipNumber': new_membership_number},
+            "ConditionExpression": "attribute_not_exists(membershipNumber)"
+          }
+        },
+        {
+          "Update": {
+            "TableName": MEMBERS_TABLE,
+            "Key": {'membershipNumber': membership_number},
+            "UpdateExpression": "SET renumberedTo = :new",
+            "ConditionExpression": "attribute_exists(membershipNumber) AND attribute_not_exists(renumberedTo)",
+            "ExpressionAttributeValues": {':new': new_membership_number}
+          }
+        }
+      ]
+    )
+
+  members_table.delete_item(
+    Key={'membershipNumber': membership_number},
+    ConditionExpression=Attr('renumberedTo').eq(new_membership_number)
   )
+
+def replace_allocations(allocations, new_membership_number):
+  # Each allocation is a put of the new key and a delete of the old key, written in the same transaction
+  # so an allocation is never lost or duplicated
+  migrated = 0
+  failed = 0
+
+  for i in range(0, len(allocations), TRANSACTION_ALLOCATIONS):
+    chunk = allocations[i:i + TRANSACTION_ALLOCATIONS]
+
+    items = []
+    for allocation in chunk:
+      items.append({
+        "Put": {
+          "TableName": EVENT_ALLOCATIONS_TABLE,
+          "Item": allocation | {'membershipNumber': new_membership_number}
+        }
+      })
+      items.append({
+        "Delete": {
+          "TableName": EVENT_ALLOCATIONS_TABLE,
+          "Key": {'combinedEventId': allocation['combinedEventId'], 'membershipNumber': allocation['membershipNumber']}
+        }
+      })
+
+    try:
+      dynamodb.meta.client.transact_write_items(TransactItems=items)
+      migrated += len(chunk)
+    except Exception as e:
+      logger.error(f"Unable to update {len(chunk)} event allocations: {str(e)}")
+      failed += len(chunk)
+
+  return (migrated, failed)
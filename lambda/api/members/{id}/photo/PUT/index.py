@@ -1,15 +1,24 @@
 import base64
+import binascii
 import boto3
 import io
 import logging
+import mmap
 import os
-from PIL import Image, ImageOps
+import resource
 
 logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
+MEMBERS_TABLE = os.getenv('MEMBERS_TABLE')
 PHOTO_BUCKET_NAME = os.getenv('PHOTO_BUCKET_NAME')
+RENDITION_SIZES = sorted([int(s) for s in os.getenv('RENDITION_SIZES', "64,128,256,512,1024").split(",")], reverse=True)
+UPLOAD_PREFIX = os.getenv('UPLOAD_PREFIX', "uploads/")
+
+logger.info(f"MEMBERS_TABLE = {MEMBERS_TABLE}")
 logger.info(f"PHOTO_BUCKET_NAME = {PHOTO_BUCKET_NAME}")
+logger.info(f"RENDITION_SIZES = {RENDITION_SIZES}")
+logger.info(f"UPLOAD_PREFIX = {UPLOAD_PREFIX}")
 
 headers = {
   "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
@@ -17,9 +26,28 @@ headers = {
   "Access-Control-Allow-Origin": "*"
 }
 
+dynamodb = boto3.resource('dynamodb')
 s3 = boto3.resource('s3')
+
+members_table = dynamodb.Table(MEMBERS_TABLE)
 photo_bucket = s3.Bucket(PHOTO_BUCKET_NAME)
 
+# Number of base64 characters decoded at a time (must be a multiple of 4)
+DECODE_CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of each image format sync_photos can read (JPEG, PNG, GIF, WebP, BMP and TIFF),
+# as (offset, bytes) pairs which must all match
+IMAGE_SIGNATURES = [
+  [(0, b"\xff\xd8\xff")],
+  [(0, b"\x89PNG\r\n\x1a\n")],
+  [(0, b"GIF87a")],
+  [(0, b"GIF89a")],
+  [(0, b"RIFF"), (8, b"WEBP")],
+  [(0, b"BM")],
+  [(0, b"II*\x00")],
+  [(0, b"MM\x00*")]
+]
+
 def handler(event, context):
 
   # Get membership number
@@ -35,20 +63,9 @@ def handler(event, context):
   # Remove existing image if event['body'] is null
   if event['body'] is None or not event['body']:
     photo_bucket.delete_objects(Delete={
-      'Objects': [
-        {
-          'Key': membershipNumber + ".jpg"
-        }
-      ]
-    })
-
-    photo_bucket.delete_objects(Delete={
-      'Objects': [
-        {
-          'Key': membershipNumber + ".thumb.jpg"
-        }
-      ]
+      'Objects': [{'Key': key} for key in rendition_keys(membershipNumber)]
     })
+    remove_has_photo(membershipNumber)
 
     return {
       "statusCode": 200,
@@ -57,70 +74,103 @@ def handler(event, context):
   
   logger.info(f"Updating photo for {membershipNumber}")
 
+  # Pop the body from the event, so the base64 string can be freed as soon as it's decoded
+  data_url = event.pop('body')
+
   try:
-    photo = Image.open(io.BytesIO(base64.decodebytes(bytes(event['body'].split(",", 1)[1], "utf-8")))).convert("RGB")
+    content_type = data_url[len("data:"):data_url.index(",")].split(";")[0] or "application/octet-stream"
+    photo_b = decode_data_url(data_url)
+    del data_url
   except Exception as e:
-    logger.warning(f"Unable to open photo: {str(e)}")
+    logger.warning(f"Unable to decode photo: {str(e)}")
     return {
       "statusCode": 500,
       "headers": headers,
-      "body": "Unable to open uploaded photo"
+      "body": "Unable to decode uploaded photo"
     }
-  
-  # Resize image if it's too large
-  if photo.width > 1024 or photo.height > 1024:
-    logger.debug(f"Resizing photo for {membershipNumber}")
-    try:
-      photo = ImageOps.contain(photo, (1024, 1024))
-    except Exception as e:
-      logger.warning(f"Unable to resize photo: {str(e)}")
-      return {
-        "statusCode": 500,
-        "headers": headers,
-        "body": "Unable to resize uploaded photo"
-      }
-  
-  # Create thumbnail for avatars
-  logger.debug(f"Resizing photo for {membershipNumber} to create thumbnail")
+
+  # Check it's an image now, as sync_photos can't report back to the client if it isn't
+  if not is_image(photo_b):
+    photo_b.close()
+    logger.warning(f"Uploaded photo for {membershipNumber} is not a supported image")
+    return {
+      "statusCode": 400,
+      "headers": headers,
+      "body": "Uploaded file is not a supported image"
+    }
+
+  # Hand the original over to the sync_photos Lambda, which creates the renditions as it does for presigned uploads
   try:
-    thumbnail = ImageOps.contain(photo, (128, 128))
+    with photo_b:
+      photo_bucket.meta.client.upload_fileobj(photo_b, PHOTO_BUCKET_NAME, UPLOAD_PREFIX + membershipNumber, ExtraArgs={'ContentType': content_type})
   except Exception as e:
-    logger.warning(f"Unable to resize photo for thumbnail: {str(e)}")
+    logger.error(f"Failed to upload photo for {membershipNumber} to S3: {str(e)}")
     return {
       "statusCode": 500,
       "headers": headers,
-      "body": "Unable to create thumbnail"
+      "body": "Unable to upload photo"
     }
 
-  # Upload photo to S3 as JPEG
-  logger.debug(f"Uploading photo as JPEG to S3 bucket for {membershipNumber}")
+  logger.info(f"Photo uploaded for {membershipNumber}")
 
-  photo_b = io.BytesIO()
-  photo.save(photo_b, "JPEG")
-  photo_b.seek(0)
+  # ru_maxrss is in KB on Linux, and covers every invocation of this execution environment
+  logger.info(f"Peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MB")
 
-  upload_image(membershipNumber + ".jpg", photo_b)
+  return {
+    "statusCode": 200,
+    "headers": headers
+  }
 
-  # Upload thumbnail to S3 as JPEG
-  logger.debug(f"Uploading thumbnail as JPEG to S3 bucket for {membershipNumber}")
+def decode_data_url(data_url):
+  # Decode a slice at a time into an anonymous memory map, which can be uploaded directly,
+  # rather than copying the whole string several times over (split, encode, decode, BytesIO)
+  start = data_url.index(",") + 1
+  length = len(data_url) - start
 
-  thumbnail_b = io.BytesIO()
-  thumbnail.save(thumbnail_b, "JPEG")
-  thumbnail_b.seek(0)
+  try:
+    if length % 4 != 0:
+      raise ValueError("Base64 data is not a multiple of 4 characters")
 
-  upload_image(membershipNumber + ".thumb.jpg", thumbnail_b)
+    size = (length // 4) * 3 - data_url[-2:].count("=")
+    buffer = mmap.mmap(-1, max(size, 1))
 
+    for i in range(start, len(data_url), DECODE_CHUNK_SIZE):
+      buffer.write(binascii.a2b_base64(data_url[i:i + DECODE_CHUNK_SIZE].encode("ascii")))
 
-  logger.info(f"Photo updated for {membershipNumber}")
+    if buffer.tell() != size:
+      raise ValueError("Decoded data is not the expected size")
+  except ValueError as e:
+    # Fall back to the lenient decoder if the data contains line breaks or other non-base64 characters
+    logger.debug(f"Unable to decode photo in chunks, falling back to base64.decodebytes: {str(e)}")
+    return io.BytesIO(base64.decodebytes(data_url[start:].encode("ascii")))
 
-  return {
-    "statusCode": 200,
-    "headers": headers
-  }
+  buffer.seek(0)
+  return buffer
+
+def is_image(photo_b):
+  header = photo_b.read(16)
+  photo_b.seek(0)
+
+  return any(all(header[offset:offset + len(magic)] == magic for offset, magic in signature) for signature in IMAGE_SIGNATURES)
 
-def upload_image(filename, bytes):
+def rendition_keys(membershipNumber):
+  # Original 1024px photo and 128px thumbnail names are kept for existing clients
+  keys = [membershipNumber + ".jpg", membershipNumber + ".thumb.jpg"]
+  for size in RENDITION_SIZES:
+    keys.append(f"{membershipNumber}.{size}.webp")
+    keys.append(f"{membershipNumber}.{size}.jpg")
+
+  return keys
+
+def remove_has_photo(membershipNumber):
+  # Kept on the member so that photo URLs can be signed without checking the bucket
   try:
-    photo_bucket.upload_fileobj(bytes, filename, ExtraArgs={'ContentType': 'image/jpeg'})
+    members_table.update_item(
+      Key={"membershipNumber": membershipNumber},
+      UpdateExpression="SET hasPhoto = :hasPhoto REMOVE photoRenditions",
+      ConditionExpression="attribute_exists(membershipNumber)",
+      ExpressionAttributeValues={":hasPhoto": False}
+    )
   except Exception as e:
-    logger.error(f"Failed to upload photo {filename} to S3: {str(e)}")
-    raise e
+    logger.error(f"Unable to set hasPhoto for {membershipNumber}: {str(e)}")
+
@@ -0,0 +1,70 @@
+import boto3
+import json
+import logging
+import os
+
+logger = logging.getLogger()
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+EXPIRATION = int(os.getenv("EXPIRATION", "300"))
+MAX_SIZE = int(os.getenv("MAX_SIZE", str(20 * 1024 * 1024)))
+PHOTO_BUCKET_NAME = os.getenv("PHOTO_BUCKET_NAME")
+UPLOAD_PREFIX = os.getenv("UPLOAD_PREFIX", "uploads/")
+
+logger.info(f"EXPIRATION = {EXPIRATION}")
+logger.info(f"MAX_SIZE = {MAX_SIZE}")
+logger.info(f"PHOTO_BUCKET_NAME = {PHOTO_BUCKET_NAME}")
+logger.info(f"UPLOAD_PREFIX = {UPLOAD_PREFIX}")
+
+headers = {
+  "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
+  "Access-Control-Allow-Methods": "OPTIONS,POST",
+  "Access-Control-Allow-Origin": "*"
+}
+
+s3 = boto3.client("s3")
+
+def handler(event, context):
+
+  # Get membership number
+  membershipNumber = event["pathParameters"]["id"]
+  if membershipNumber is None:
+    logger.warn("Unable to get membership number from path")
+    return {
+      "statusCode": 500,
+      "headers": headers,
+      "body": "Unable to get membership number from path"
+    }
+
+  # Generate presigned POST, so the original is uploaded straight to S3 and resized by sync/photos
+  key = UPLOAD_PREFIX + membershipNumber
+
+  try:
+    post = s3.generate_presigned_post(
+      Bucket=PHOTO_BUCKET_NAME,
+      Key=key,
+      Conditions=[
+        ["starts-with", "$Content-Type", "image/"],
+        ["content-length-range", 1, MAX_SIZE]
+      ],
+      ExpiresIn=EXPIRATION
+    )
+  except Exception as e:
+    logger.error(f"Failed to generate presigned POST: {str(e)}")
+    return {
+      "statusCode": 500,
+      "headers": headers,
+      "body": "Failed to generate presigned POST"
+    }
+
+  logger.info(f"Presigned POST generated for {membershipNumber}")
+
+  return {
+    "statusCode": 200,
+    "headers": headers,
+    "body": json.dumps({
+      "url": post["url"],
+      "fields": post["fields"],
+      "maxSize": MAX_SIZE
+    })
+  }
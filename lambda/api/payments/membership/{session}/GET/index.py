@@ -5,6 +5,7 @@ import json
 import logging
 import os
 import stripe
+import time
 
 # Configure logging
 logger = logging.getLogger()
@@ -13,10 +14,12 @@ logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 API_KEY_SECRET_NAME = os.getenv('API_KEY_SECRET_NAME')
 MEMBERS_TABLE = os.getenv('MEMBERS_TABLE')
 PORTAL_DOMAIN = os.getenv('PORTAL_DOMAIN')
+SECRET_TTL = int(os.getenv('SECRET_TTL', "3600"))
 
 logger.info(f"API_KEY_SECRET_NAME = {API_KEY_SECRET_NAME}")
 logger.info(f"MEMBERS_TABLE = {MEMBERS_TABLE}")
 logger.info(f"PORTAL_DOMAIN = {PORTAL_DOMAIN}")
+logger.info(f"SECRET_TTL = {SECRET_TTL}")
 
 headers = {
   "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
@@ -30,14 +33,8 @@ secrets = boto3.client('secretsmanager')
 
 members_table = dynamodb.Table(MEMBERS_TABLE)
 
-# Get Stripe
-try:
-  stripe.api_key = json.loads(secrets.get_secret_value(
-    SecretId=API_KEY_SECRET_NAME
-  )['SecretString'])['stripe']
-except Exception as e:
-  logger.error(f"Failed to get Stripe secret key from Secrets Manager: {str(e)}")
-  stripe.api_key = None
+# Stripe key is fetched on first use rather than at import, and cached while the container is warm
+stripe_key_loaded_at = None
 
 def handler(event, context):
   session_id = event['pathParameters']['session']
@@ -52,7 +49,7 @@ def handler(event, context):
   logger.info(f"Getting Stripe session details for {session_id}")
 
   try:
-    session = stripe.checkout.Session.retrieve(session_id)
+    session = call_stripe(stripe.checkout.Session.retrieve, session_id)
   except Exception as e:
     logger.error(f"Failed to get Stripe session details: {str(e)}")
     return {
@@ -137,3 +134,28 @@ def handler(event, context):
     "statusCode": 303,
     "headers": redir_headers
   }
+
+def load_stripe_key(refresh=False):
+  global stripe_key_loaded_at
+
+  if not refresh and stripe_key_loaded_at is not None and time.monotonic() - stripe_key_loaded_at < SECRET_TTL:
+    return
+
+  started = time.perf_counter()
+  stripe.api_key = json.loads(secrets.get_secret_value(
+    SecretId=API_KEY_SECRET_NAME
+  )['SecretString'])['stripe']
+  stripe_key_loaded_at = time.monotonic()
+
+  logger.info(f"Stripe secret key loaded from Secrets Manager in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+def call_stripe(fn, *args, **kwargs):
+  load_stripe_key()
+
+  try:
+    return fn(*args, **kwargs)
+  except stripe.AuthenticationError:
+    # Key may have been rotated since it was cached, so fetch it again and retry once
+    logger.warning("Stripe rejected the secret key - reloading from Secrets Manager")
+    load_stripe_key(refresh=True)
+    return fn(*args, **kwargs)
@@ -1,8 +1,12 @@
 import os
 import boto3
 import json
+import random
+import re
 import time
 import urllib.request
+from aws_lambda_powertools import Metrics
+from aws_lambda_powertools.metrics import MetricUnit
 from jose import jwk, jwt
 from jose.utils import base64url_decode
 import logging
@@ -10,31 +14,100 @@ import logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+metrics = Metrics()
+
 # envs
 TABLE_NAME = os.environ['TABLE_NAME']
 AWS_REGION = os.environ['AWS_REGION']
 COGNITO_USER_POOL_ID = os.environ['COGNITO_USER_POOL_ID']
 COGNITO_APP_CLIENT_ID = os.environ['COGNITO_APP_CLIENT_ID']
+BATCH_DEADLINE = float(os.getenv('BATCH_DEADLINE', '2'))
+JWKS_MAX_AGE = int(os.getenv('JWKS_MAX_AGE', '3600'))
+JWKS_MIN_REFRESH_INTERVAL = int(os.getenv('JWKS_MIN_REFRESH_INTERVAL', '60'))
+POLICY_CACHE_TTL = int(os.getenv('POLICY_CACHE_TTL', '300'))
 
 logger.debug(f"AWS Region: "+AWS_REGION)
 logger.debug(f"Table Name: "+TABLE_NAME)
 logger.debug(f"Cognito User Pool: "+COGNITO_USER_POOL_ID)
 logger.debug(f"Cognito App Client: "+COGNITO_APP_CLIENT_ID)
+logger.debug(f"Batch Deadline: {BATCH_DEADLINE}")
+logger.debug(f"JWKS Max Age: {JWKS_MAX_AGE}")
+logger.debug(f"JWKS Min Refresh Interval: {JWKS_MIN_REFRESH_INTERVAL}")
+logger.debug(f"Policy Cache TTL: {POLICY_CACHE_TTL}")
+
+dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
+
+# maximum number of keys in a single BatchGetItem request
+BATCH_SIZE = 100
+
+# policies are cached for the lifetime of the container (up to POLICY_CACHE_TTL),
+# both per group and merged for each combination of groups, so that DynamoDB
+# is only queried when a cached policy expires
+group_policy_cache = {}
+merged_policy_cache = {}
 
 
 keys_url = 'https://cognito-idp.{}.amazonaws.com/{}/.well-known/jwks.json'.format(AWS_REGION, COGNITO_USER_POOL_ID)
-logger.info(f"Downloading Cognito key from {keys_url}")
 
-# instead of re-downloading the public keys every time
-# we download them only on cold start
+# public keys are constructed once and kept by kid for the lifetime of the container,
 # https://aws.amazon.com/blogs/compute/container-reuse-in-lambda/
-with urllib.request.urlopen(keys_url) as f:
-    response = f.read()
-keys = json.loads(response.decode('utf-8'))['keys']
+# they are re-downloaded when older than JWKS_MAX_AGE, or when a token has an unknown
+# kid (e.g. after key rotation), but no more than once every JWKS_MIN_REFRESH_INTERVAL
+public_keys = {}
+keys_downloaded_at = 0
+keys_attempted_at = 0
+
+
+def refresh_keys():
+    global public_keys, keys_downloaded_at, keys_attempted_at
+
+    now = time.time()
+    if now - keys_attempted_at < JWKS_MIN_REFRESH_INTERVAL:
+        logger.debug("Cognito keys were refreshed recently; not refreshing")
+        return False
+
+    keys_attempted_at = now
+    logger.info(f"Downloading Cognito keys from {keys_url}")
+
+    try:
+        with urllib.request.urlopen(keys_url, timeout=5) as f:
+            response = f.read()
+        keys = json.loads(response.decode('utf-8'))['keys']
+
+        public_keys = {key['kid']: jwk.construct(key) for key in keys}
+        keys_downloaded_at = now
+    except Exception as e:
+        # keep using the keys we already have
+        logger.error(f"Unable to download Cognito keys: {e}")
+        return False
+
+    logger.info(f"Downloaded {len(public_keys)} Cognito keys")
+    return True
+
+
+def get_public_key(kid):
+    if time.time() - keys_downloaded_at > JWKS_MAX_AGE:
+        refresh_keys()
 
-logger.info("Downloaded Cognito key")
+    if kid not in public_keys:
+        logger.info(f"Public key {kid} not known; refreshing Cognito keys")
+        refresh_keys()
 
+    return public_keys.get(kid)
+
+
+refresh_keys()
+
+@metrics.log_metrics
 def handler(event, context):
+    started = time.perf_counter()
+    try:
+        return authorize(event)
+    finally:
+        metrics.add_metric(name="AuthLatency", unit=MetricUnit.Milliseconds, value=(time.perf_counter() - started) * 1000)
+
+
+def authorize(event):
     logger.debug(event)
 
     logger.info("Parsing token")
@@ -52,19 +125,20 @@ def handler(event, context):
         groups = claims['cognito:groups']
         logger.debug(f"Groups: {groups}")
 
-        results = batch_query_wrapper(TABLE_NAME, 'group', groups)
-        logger.debug(f"Query results: {results}")
+        statements = get_policy_statements(groups)
 
-        if len(results) > 0:
+        if len(statements) > 0:
+            # only the membership number differs between users with the same groups
             policy = {
                 'Version': "2012-10-17",
-                'Statement': []
+                'Statement': substitute(statements, '{membershipNumber}', claims['username'])
             }
-            for item in results:
-                pol = json.loads(item['policy'].replace('{membershipNumber}', claims['username']))
-                policy['Statement'] = policy['Statement'] + pol['Statement']
-            
+
             logger.debug(f"Policy generated: {policy}")
+            metrics.add_metric(name="AuthPolicySize", unit=MetricUnit.Bytes, value=len(json.dumps(policy)))
+
+            # the policy covers everything the user may call, rather than just event['methodArn'],
+            # so API Gateway can reuse the cached result for every request made with this token
 
             return get_response_object(policy, principalId=claims['username'], context={"membershipNumber": claims['username'], "groups": ','.join(groups)})
 
@@ -105,20 +179,156 @@ def get_deny_policy():
     }
 
 
+def get_policy_statements(groups):
+    key = tuple(sorted(set(groups)))
+    now = time.time()
+
+    cached = merged_policy_cache.get(key)
+    if cached is not None and cached[0] > now:
+        logger.debug(f"Using cached policy for groups {key}")
+        return cached[1]
+
+    policies, expires = get_group_policies(key, now)
+
+    statements = []
+    for group in key:
+        if policies[group] is not None:
+            statements.extend(policies[group]['Statement'])
+
+    compacted = compact_statements(statements)
+    logger.info(f"Policy for groups {key} compacted from {len(json.dumps(statements))} to {len(json.dumps(compacted))} bytes")
+    statements = compacted
+
+    # expire with the oldest group policy, so a merged policy is never staler than its parts
+    merged_policy_cache[key] = (expires, statements)
+    return statements
+
+
+def get_group_policies(groups, now):
+    policies = {}
+    expires = now + POLICY_CACHE_TTL
+    missing = []
+
+    for group in groups:
+        cached = group_policy_cache.get(group)
+        if cached is not None and cached[0] > now:
+            policies[group] = cached[1]
+            expires = min(expires, cached[0])
+        else:
+            missing.append(group)
+
+    if len(missing) > 0:
+        logger.info(f"Loading policies for groups {missing}")
+
+        results = batch_query_wrapper(TABLE_NAME, 'group', missing)
+        logger.debug(f"Query results: {results}")
+
+        found = {item['group']: json.loads(item['policy']) for item in results}
+        for group in missing:
+            # groups without a policy are cached too, so they aren't looked up on every request
+            policies[group] = found.get(group)
+            group_policy_cache[group] = (now + POLICY_CACHE_TTL, policies[group])
+
+    return policies, expires
+
+
+def compact_statements(statements):
+    # merge statements with the same effect, action and condition into one, dropping
+    # duplicate resources and any resource already matched by another's wildcards
+    merged = {}
+    for statement in statements:
+        key = (statement['Effect'], json.dumps(statement['Action'], sort_keys=True), json.dumps(statement.get('Condition'), sort_keys=True))
+        resources = statement['Resource'] if isinstance(statement['Resource'], list) else [statement['Resource']]
+
+        merged.setdefault(key, {})
+        for resource in resources:
+            merged[key][resource] = None
+
+    compacted = []
+    for (effect, action, condition), resources in merged.items():
+        statement = {
+            'Action': json.loads(action),
+            'Effect': effect,
+            'Resource': remove_covered_resources(list(resources))
+        }
+        if condition != 'null':
+            statement['Condition'] = json.loads(condition)
+
+        compacted.append(statement)
+
+    return compacted
+
+
+def remove_covered_resources(resources):
+    patterns = {r: wildcard_pattern(r) for r in resources if '*' in r or '?' in r}
+
+    kept = []
+    for i, resource in enumerate(resources):
+        covered = False
+        for j, other in enumerate(resources):
+            if i == j or other not in patterns or not patterns[other].fullmatch(resource):
+                continue
+
+            # where two resources match each other, keep the first
+            if resource not in patterns or not patterns[resource].fullmatch(other) or j < i:
+                covered = True
+                break
+
+        if not covered:
+            kept.append(resource)
+
+    return kept
+
+
+def wildcard_pattern(resource):
+    # IAM-style wildcards: * matches any characters (including /) and ? matches one
+    return re.compile(re.escape(resource).replace(r'\*', '.*').replace(r'\?', '.'))
+
+
+def substitute(value, placeholder, replacement):
+    if isinstance(value, str):
+        return value.replace(placeholder, replacement)
+    if isinstance(value, list):
+        return [substitute(v, placeholder, replacement) for v in value]
+    if isinstance(value, dict):
+        return {k: substitute(v, placeholder, replacement) for k, v in value.items()}
+
+    return value
+
+
 def batch_query_wrapper(table, key, values):
     results = []
+    retries = 0
+    deadline = time.monotonic() + BATCH_DEADLINE
 
-    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
-    values_list = [values[x:x + 25] for x in range(0, len(values), 25)]
+    values_list = [values[x:x + BATCH_SIZE] for x in range(0, len(values), BATCH_SIZE)]
 
     for vlist in values_list:
-        response = dynamodb.batch_get_item(RequestItems={table: {'Keys': [{key: val} for val in vlist]}})
-        results.extend(response['Responses'][table])
+        request = {table: {'Keys': [{key: val} for val in vlist]}}
+        attempt = 0
+
+        while True:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            results.extend(response['Responses'].get(table, []))
+
+            # only resubmit the keys which weren't processed
+            request = response.get('UnprocessedKeys')
+            if not request:
+                break
+
+            # back off with full jitter, but give up rather than exceed the deadline
+            delay = random.uniform(0, 0.05 * (2 ** attempt))
+            if time.monotonic() + delay > deadline:
+                metrics.add_metric(name="AuthPolicyBatchDeadlineExceeded", unit=MetricUnit.Count, value=1)
+                raise Exception(f"{len(request[table]['Keys'])} keys still unprocessed after {attempt + 1} attempts")
 
-        while response['UnprocessedKeys']:
-            response = dynamodb.batch_get_item(RequestItems={table: {'Keys': [{key: val} for val in vlist]}})
-            results.extend(response['Response'][table])
+            logger.warning(f"{len(request[table]['Keys'])} keys unprocessed; retrying in {delay:.3f}s")
+            time.sleep(delay)
 
+            attempt += 1
+            retries += 1
+
+    metrics.add_metric(name="AuthPolicyBatchRetries", unit=MetricUnit.Count, value=retries)
     return results
 
 
@@ -149,20 +359,12 @@ def validate_token(token):
     headers = jwt.get_unverified_headers(token)
     kid = headers['kid']
 
-    # search for the kid in the downloaded public keys
-    key_index = -1
-    for i in range(len(keys)):
-        if kid == keys[i]['kid']:
-            key_index = i
-            break
-
-    if key_index == -1:
+    # look up the constructed public key for the kid
+    public_key = get_public_key(kid)
+    if public_key is None:
         logger.warning('Public key not found in jwks.json')
         return False
 
-    # construct the public key
-    public_key = jwk.construct(keys[key_index])
-
     # get the last two sections of the token,
     # message and signature (encoded in base64)
     message, encoded_signature = str(token).rsplit('.', 1)
@@ -170,12 +372,16 @@ def validate_token(token):
     # decode the signature
     decoded_signature = base64url_decode(encoded_signature.encode('utf-8'))
 
-    # verify the signature
-    if not public_key.verify(message.encode("utf8"), decoded_signature):
-        logger.warning('Signature verification failed')
+    # verify the signature, timing it so key handling changes can be benchmarked
+    started = time.perf_counter()
+    verified = public_key.verify(message.encode("utf8"), decoded_signature)
+    verification_ms = (time.perf_counter() - started) * 1000
+
+    if not verified:
+        logger.warning(f'Signature verification failed in {verification_ms:.2f}ms')
         return False
 
-    logger.info('Signature successfully verified')
+    logger.info(f'Signature successfully verified in {verification_ms:.2f}ms')
 
     # since we passed the verification, we can now safely
     # use the unverified claims
@@ -4,11 +4,13 @@ from   boto3.dynamodb.conditions import Key
 import datetime
 import logging
 import os
+from   portal_common.dynamodb import bulk_delete
 
 logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
 ACCOUNT_DELETED_TEMPLATE = os.getenv('ACCOUNT_DELETED_TEMPLATE')
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', "4"))
 DELETED_SOON_TEMPLATE = os.getenv('DELETED_SOON_TEMPLATE')
 MEMBERS_EMAIL = os.getenv('MEMBERS_EMAIL')
 PORTAL_DOMAIN = os.getenv('PORTAL_DOMAIN')
@@ -18,6 +20,7 @@ TABLE_NAME = os.getenv('TABLE_NAME')
 GRACE_PERIOD_DAYS = 730 # 2 years
 
 logger.info(f"ACCOUNT_DELETED_TEMPLATE = {ACCOUNT_DELETED_TEMPLATE}")
+logger.info(f"BATCH_WORKERS = {BATCH_WORKERS}")
 logger.info(f"DELETED_SOON_TEMPLATE = {DELETED_SOON_TEMPLATE}")
 logger.info(f"MEMBERS_EMAIL = {MEMBERS_EMAIL}")
 logger.info(f"PORTAL_DOMAIN = {PORTAL_DOMAIN}")
@@ -62,41 +65,30 @@ def handler(event, context):
 
   # Delete accounts
 
-  deletedCount = 0
-  deletedErrors = 0
   deletedEmailCount = 0
   deletedEmailErrors = 0
 
   try:
-    toDelete = table.query(
-      IndexName=STATUS_INDEX_NAME,
-      KeyConditionExpression=Key('status').eq('INACTIVE') & Key('membershipExpires').lt(expiredDate.isoformat())
-    )
+    toDelete = get_expired_members(table, expiredDate)
   except Exception as e:
     logger.error(f"Unable to get list of members to delete: {str(e)}")
-    toDelete = {'Items':[]}
+    toDelete = []
   
-  logger.info(f"{len(toDelete['Items'])} accounts found for deletion, which expired before {expiredDate.isoformat()}")
+  logger.info(f"{len(toDelete)} accounts found for deletion, which expired before {expiredDate.isoformat()}")
 
-
-  for member in toDelete['Items']:
+  for member in toDelete:
     logger.info(f"Inactive member {member['membershipNumber']} ({member['firstName']} {member['surname']}) expired on {member['membershipExpires']} - account will be deleted")
 
-    # Delete accounts from DynamoDB
-    try:
-      table.delete_item(
-        Key={
-          'membershipNumber': member['membershipNumber']
-        }
-      )
+  # Delete accounts from DynamoDB
+  # Don't need to delete accounts from Cognito, this will be done by DynamoDB Streams and Lambda
+  deletedCount, failed = bulk_delete(dynamodb, TABLE_NAME, ({'membershipNumber': member['membershipNumber']} for member in toDelete), BATCH_WORKERS)
+  deletedErrors = len(failed)
 
-      deletedCount += 1
-    except Exception as e:
-      logger.error(f"Unable to delete {member['membershipNumber']} from DynamoDB: {str(e)}")
-      deletedErrors += 1
+  failedMembers = {key['membershipNumber'] for key in failed}
+  for member in toDelete:
+    if member['membershipNumber'] in failedMembers:
+      logger.error(f"Unable to delete {member['membershipNumber']} from DynamoDB")
       continue
-  
-    # Don't need to delete accounts from Cognito, this will be done by DynamoDB Streams and Lambda
 
     # Send e-mail to members who have expired
     try:
@@ -128,6 +120,28 @@ def handler(event, context):
   logger.info(f"Account deleted e-mails sent: {deletedEmailCount} ({deletedEmailErrors} errors)")
 
 
+def get_expired_members(table, expiredDate):
+  results = []
+  last_evaluated_key = None
+
+  while True:
+    kwargs = {
+      'IndexName': STATUS_INDEX_NAME,
+      'KeyConditionExpression': Key('status').eq('INACTIVE') & Key('membershipExpires').lt(expiredDate.isoformat())
+    }
+    if last_evaluated_key:
+      kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+    response = table.query(**kwargs)
+    results.extend(response['Items'])
+
+    last_evaluated_key = response.get('LastEvaluatedKey')
+    if not last_evaluated_key:
+      break
+
+  return results
+
+
 def reminders(expiredDate, table):
   try:
     reminderMembers = table.query(
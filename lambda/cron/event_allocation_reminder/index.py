@@ -1,30 +1,34 @@
 import json
 import boto3
-from   boto3.dynamodb.conditions import Attr
+from   boto3.dynamodb.conditions import Key
 import datetime
 import logging
 import os
+from   portal_common.events import get_event_details, get_series_names, query_index
 
 logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
 ALLOCATION_REMINDER_TEMPLATE = os.getenv('ALLOCATION_REMINDER_TEMPLATE')
+END_DATE_INDEX = os.getenv('END_DATE_INDEX')
 EVENT_INSTANCE_TABLE = os.getenv('EVENT_INSTANCE_TABLE')
 EVENT_SERIES_TABLE = os.getenv('EVENT_SERIES_TABLE')
 EVENTS_EMAIL = os.getenv('EVENTS_EMAIL')
 PORTAL_DOMAIN = os.getenv('PORTAL_DOMAIN')
+REGISTRATION_DATE_INDEX = os.getenv('REGISTRATION_DATE_INDEX')
 
 logger.info(f"ALLOCATION_REMINDER_TEMPLATE = {ALLOCATION_REMINDER_TEMPLATE}")
+logger.info(f"END_DATE_INDEX = {END_DATE_INDEX}")
 logger.info(f"EVENT_INSTANCE_TABLE = {EVENT_INSTANCE_TABLE}")
 logger.info(f"EVENT_SERIES_TABLE = {EVENT_SERIES_TABLE}")
 logger.info(f"EVENTS_EMAIL = {EVENTS_EMAIL}")
 logger.info(f"PORTAL_DOMAIN = {PORTAL_DOMAIN}")
+logger.info(f"REGISTRATION_DATE_INDEX = {REGISTRATION_DATE_INDEX}")
 
 dynamodb = boto3.resource('dynamodb')
 ses = boto3.client('ses')
 
 event_instance_table = dynamodb.Table(EVENT_INSTANCE_TABLE)
-event_series_table = dynamodb.Table(EVENT_SERIES_TABLE)
 
 def handler(event, context):
   yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
@@ -32,64 +36,27 @@ def handler(event, context):
 
   # Find all events that finished yesterday
   try:
-    finished_events = event_instance_table.scan(
-      FilterExpression=Attr('endDate').begins_with(yesterday)
-    )['Items']
+    finished_events = query_index(event_instance_table, END_DATE_INDEX, Key('endDate').begins_with(yesterday))
   except Exception as ex:
-    logger.error(f"Unable to scan for events that finished yesterday: {str(ex)}")
+    logger.error(f"Unable to query for events that finished yesterday: {str(ex)}")
     raise ex
 
   logger.info(f"{len(finished_events)} events found that finished yesterday")
   
   # Find all events that registration closed yesterday
   try:
-    closed_events = event_instance_table.scan(
-      FilterExpression=Attr('registrationDate').eq(yesterday)
-    )['Items']
+    closed_events = query_index(event_instance_table, REGISTRATION_DATE_INDEX, Key('registrationDate').eq(yesterday))
   except Exception as ex:
-    logger.error(f"Unable to scan for events that closed yesterday: {str(ex)}")
+    logger.error(f"Unable to query for events that closed yesterday: {str(ex)}")
     raise ex
 
   logger.info(f"{len(closed_events)} events found that closed yesterday")
 
-  # Get event names - TODO: Avoid looking up the same key multiple times
-  closed = []
-  for event in closed_events:
-    try:
-      series = event_series_table.get_item(
-        Key={
-          'eventSeriesId': event["eventSeriesId"]
-        }
-      )['Item']
-
-      closed.append({
-        "eventSeriesId": event["eventSeriesId"],
-        "eventId": event["eventId"],
-        "location": event["location"],
-        "name": series["name"]
-      })
-    except Exception as ex:
-      logger.error(f"Unable to get event series information for {event['eventSeriesId']}: {str(ex)}")
-      continue
+  # Get event names, looking up each series once for both lists
+  series_names = get_series_names(dynamodb, EVENT_SERIES_TABLE, [e["eventSeriesId"] for e in closed_events + finished_events])
 
-  finished = []
-  for event in finished_events:
-    try:
-      series = event_series_table.get_item(
-        Key={
-          'eventSeriesId': event["eventSeriesId"]
-        }
-      )['Item']
-
-      finished.append({
-        "eventSeriesId": event["eventSeriesId"],
-        "eventId": event["eventId"],
-        "location": event["location"],
-        "name": series["name"]
-      })
-    except Exception as ex:
-      logger.error(f"Unable to get event series information for {event['eventSeriesId']}: {str(ex)}")
-      continue
+  closed = get_event_details(closed_events, series_names)
+  finished = get_event_details(finished_events, series_names)
 
   # Send e-mail
   if len(finished) + len(closed) > 0:
@@ -116,4 +83,4 @@ def handler(event, context):
 
     except Exception as ex:
       logger.error(f"Unable to send {ALLOCATION_REMINDER_TEMPLATE} e-mail to {EVENTS_EMAIL}: {str(ex)}")
-      raise ex
\ No newline at end of file
+      raise ex
@@ -1,10 +1,11 @@
 import json
 import boto3
-from   boto3.dynamodb.conditions import Attr
+from   boto3.dynamodb.conditions import Key
 import datetime
 from dateutil.relativedelta import relativedelta
 import logging
 import os
+from   portal_common.events import get_event_details, get_series_names, query_index
 
 logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
@@ -14,12 +15,14 @@ EVENT_REMINDER_TEMPLATE = os.getenv('EVENT_REMINDER_TEMPLATE')
 EVENT_SERIES_TABLE = os.getenv('EVENT_SERIES_TABLE')
 EVENTS_EMAIL = os.getenv('EVENTS_EMAIL')
 PORTAL_DOMAIN = os.getenv('PORTAL_DOMAIN')
+START_DATE_INDEX = os.getenv('START_DATE_INDEX')
 
 logger.info(f"EVENT_INSTANCE_TABLE = {EVENT_INSTANCE_TABLE}")
 logger.info(f"EVENT_REMINDER_TEMPLATE = {EVENT_REMINDER_TEMPLATE}")
 logger.info(f"EVENT_SERIES_TABLE = {EVENT_SERIES_TABLE}")
 logger.info(f"EVENTS_EMAIL = {EVENTS_EMAIL}")
 logger.info(f"PORTAL_DOMAIN = {PORTAL_DOMAIN}")
+logger.info(f"START_DATE_INDEX = {START_DATE_INDEX}")
 
 MONTHS = {1: "January", 2: "February", 3: "March", 4: "April", 5: "May", 6: "June", 7: "July", 8: "August", 9: "September", 10: "October", 11: "November", 12: "December"}
 
@@ -27,7 +30,6 @@ dynamodb = boto3.resource('dynamodb')
 ses = boto3.client('ses')
 
 event_instance_table = dynamodb.Table(EVENT_INSTANCE_TABLE)
-event_series_table = dynamodb.Table(EVENT_SERIES_TABLE)
 
 def handler(event, context):
   # Find all events that started 8 months ago
@@ -36,36 +38,18 @@ def handler(event, context):
   month = int(year_month[5:])
   logger.info(f"8 months ago: {year_month}")
 
-  # Find all events that finished yesterday
   try:
-    events = event_instance_table.scan(
-      FilterExpression=Attr('startDate').begins_with(year_month)
-    )['Items']
+    events = query_index(event_instance_table, START_DATE_INDEX, Key('startDate').begins_with(year_month))
   except Exception as ex:
-    logger.error(f"Unable to scan for events that started 8 months ago: {str(ex)}")
+    logger.error(f"Unable to query for events that started 8 months ago: {str(ex)}")
     raise ex
 
   logger.info(f"{len(events)} events found that started 8 months ago")
 
-  # Get event names - TODO: Avoid looking up the same key multiple times
-  event_details = []
-  for event in events:
-    try:
-      series = event_series_table.get_item(
-        Key={
-          'eventSeriesId': event["eventSeriesId"]
-        }
-      )['Item']
+  # Get event names
+  series_names = get_series_names(dynamodb, EVENT_SERIES_TABLE, [e["eventSeriesId"] for e in events])
 
-      event_details.append({
-        "eventSeriesId": event["eventSeriesId"],
-        "eventId": event["eventId"],
-        "location": event["location"],
-        "name": series["name"]
-      })
-    except Exception as ex:
-      logger.error(f"Unable to get event series information for {event['eventSeriesId']}: {str(ex)}")
-      continue
+  event_details = get_event_details(events, series_names)
 
   # Send e-mail
   if len(event_details) > 0:
@@ -93,4 +77,4 @@ def handler(event, context):
 
     except Exception as ex:
       logger.error(f"Unable to send {EVENT_REMINDER_TEMPLATE} e-mail to {EVENTS_EMAIL}: {str(ex)}")
-      raise ex
\ No newline at end of file
+      raise ex
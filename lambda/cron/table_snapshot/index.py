@@ -0,0 +1,246 @@
+import base64
+import boto3
+from   boto3.dynamodb.types import Binary, TypeDeserializer
+from   concurrent.futures import ThreadPoolExecutor, as_completed
+import datetime
+from   decimal import Decimal
+import io
+import json
+import logging
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger()
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+ALLOCATIONS_TABLE = os.getenv('ALLOCATIONS_TABLE')
+APPLICATIONS_TABLE = os.getenv('APPLICATIONS_TABLE')
+EVENT_INSTANCE_TABLE = os.getenv('EVENT_INSTANCE_TABLE')
+EVENT_SERIES_TABLE = os.getenv('EVENT_SERIES_TABLE')
+MEMBERS_TABLE = os.getenv('MEMBERS_TABLE')
+REFERENCES_TABLE = os.getenv('REFERENCES_TABLE')
+SCAN_SEGMENTS = int(os.getenv('SCAN_SEGMENTS', "4"))
+SNAPSHOT_BUCKET = os.getenv('SNAPSHOT_BUCKET')
+SNAPSHOT_COMPRESSION = os.getenv('SNAPSHOT_COMPRESSION', "zstd")
+
+logger.info(f"ALLOCATIONS_TABLE = {ALLOCATIONS_TABLE}")
+logger.info(f"APPLICATIONS_TABLE = {APPLICATIONS_TABLE}")
+logger.info(f"EVENT_INSTANCE_TABLE = {EVENT_INSTANCE_TABLE}")
+logger.info(f"EVENT_SERIES_TABLE = {EVENT_SERIES_TABLE}")
+logger.info(f"MEMBERS_TABLE = {MEMBERS_TABLE}")
+logger.info(f"REFERENCES_TABLE = {REFERENCES_TABLE}")
+logger.info(f"SCAN_SEGMENTS = {SCAN_SEGMENTS}")
+logger.info(f"SNAPSHOT_BUCKET = {SNAPSHOT_BUCKET}")
+logger.info(f"SNAPSHOT_COMPRESSION = {SNAPSHOT_COMPRESSION}")
+
+# Name used for each table's partition in the snapshot
+TABLES = {
+  "members": MEMBERS_TABLE,
+  "instances": EVENT_INSTANCE_TABLE,
+  "series": EVENT_SERIES_TABLE,
+  "allocations": ALLOCATIONS_TABLE,
+  "applications": APPLICATIONS_TABLE,
+  "references": REFERENCES_TABLE
+}
+
+# Clients are thread safe, resources are not, so use the low-level client throughout
+dynamodb = boto3.client('dynamodb')
+s3 = boto3.client('s3')
+
+deserializer = TypeDeserializer()
+
+def handler(event, context):
+  snapshot_date = datetime.date.today().isoformat()
+  prefix = f"snapshot_date={snapshot_date}"
+  started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+  logger.info(f"Writing snapshot of {len(TABLES)} tables to s3://{SNAPSHOT_BUCKET}/{prefix}/ using {SCAN_SEGMENTS} segments per table")
+
+  manifest_tables = {name: {"tableName": table_name, "rows": 0, "files": [], "fileSchemas": {}} for name, table_name in TABLES.items()}
+  file_schemas = {name: [] for name in TABLES}
+  errors = 0
+
+  with ThreadPoolExecutor(max_workers=len(TABLES) * SCAN_SEGMENTS) as executor:
+    # Scan and write every segment of every table in parallel, so only the segments in progress are held in memory
+    futures = {}
+    for name, table_name in TABLES.items():
+      for segment in range(SCAN_SEGMENTS):
+        future = executor.submit(snapshot_segment, name, table_name, segment, prefix)
+        futures[future] = (name, segment)
+
+    for future in as_completed(futures):
+      name, segment = futures[future]
+      try:
+        key, rows, schema = future.result()
+      except Exception as e:
+        logger.error(f"Unable to snapshot segment {segment} of {name}: {str(e)}")
+        errors += 1
+        continue
+
+      manifest_tables[name]["rows"] += rows
+      if key is not None:
+        manifest_tables[name]["files"].append(key)
+        manifest_tables[name]["fileSchemas"][key] = {field.name: str(field.type) for field in schema}
+        file_schemas[name].append(schema)
+
+  # Each file's schema is inferred from its own segment, so readers should cast every file to the
+  # table's schema, which reconciles them, before combining them
+  for name in manifest_tables:
+    schema = unify_schemas(file_schemas[name])
+    manifest_tables[name]["schema"] = {field.name: str(field.type) for field in schema}
+    manifest_tables[name]["files"].sort()
+    logger.info(f"{manifest_tables[name]['rows']} rows written for {name} in {len(manifest_tables[name]['files'])} files")
+
+  # Write manifest last, so that its presence indicates a completed snapshot
+  manifest = {
+    "snapshotDate": snapshot_date,
+    "startedAt": started_at,
+    "finishedAt": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    "compression": SNAPSHOT_COMPRESSION,
+    "segments": SCAN_SEGMENTS,
+    "complete": errors == 0,
+    "tables": manifest_tables
+  }
+
+  s3.put_object(
+    Bucket=SNAPSHOT_BUCKET,
+    Key=f"{prefix}/manifest.json",
+    Body=json.dumps(manifest, indent=2).encode("utf-8"),
+    ContentType="application/json"
+  )
+
+  logger.info(f"Snapshot {snapshot_date} written ({errors} errors)")
+
+  if errors > 0:
+    raise Exception(f"{errors} segments failed to snapshot")
+
+
+def snapshot_segment(name, table_name, segment, prefix):
+  items = scan_segment(name, table_name, segment)
+  schema = build_schema(items)
+  key, rows = write_segment(name, segment, items, schema, prefix)
+
+  return (key, rows, schema)
+
+
+def scan_segment(name, table_name, segment):
+  items = []
+  kwargs = {
+    "TableName": table_name,
+    "Segment": segment,
+    "TotalSegments": SCAN_SEGMENTS
+  }
+
+  while True:
+    response = dynamodb.scan(**kwargs)
+    items.extend({k: to_column_value(deserializer.deserialize(v)) for k, v in item.items()} for item in response['Items'])
+
+    if 'LastEvaluatedKey' not in response:
+      break
+
+    kwargs["ExclusiveStartKey"] = response['LastEvaluatedKey']
+
+  logger.debug(f"{len(items)} items scanned from segment {segment} of {name}")
+
+  return items
+
+
+def write_segment(name, segment, items, schema, prefix):
+  if len(items) == 0:
+    return (None, 0)
+
+  buffer = io.BytesIO()
+  pq.write_table(to_arrow_table(items, schema), buffer, compression=SNAPSHOT_COMPRESSION)
+
+  key = f"{prefix}/dataset={name}/part-{segment:04d}.parquet"
+  s3.put_object(
+    Bucket=SNAPSHOT_BUCKET,
+    Key=key,
+    Body=buffer.getvalue()
+  )
+
+  return (key, len(items))
+
+
+def to_column_value(value):
+  # DynamoDB numbers are Decimals, which Parquet can't store without a fixed precision
+  if isinstance(value, Decimal):
+    return int(value) if value == value.to_integral_value() else float(value)
+
+  # Maps, lists and sets vary in shape between items, so store them as JSON
+  if isinstance(value, (dict, list, set)):
+    return json.dumps(value, default=json_default, sort_keys=True)
+
+  # Binary attributes are base64 encoded, so they're stored the same way whatever else is in the column
+  if isinstance(value, Binary):
+    return base64.b64encode(value.value).decode("ascii")
+
+  return value
+
+
+def json_default(value):
+  if isinstance(value, Decimal):
+    return int(value) if value == value.to_integral_value() else float(value)
+
+  if isinstance(value, set):
+    return sorted(value)
+
+  if isinstance(value, Binary):
+    return base64.b64encode(value.value).decode("ascii")
+
+  return str(value)
+
+
+def build_schema(items):
+  columns = sorted({k for item in items for k in item.keys()})
+
+  return pa.schema([pa.field(column, unify_types([infer_type([item.get(column) for item in items])])) for column in columns])
+
+
+def unify_schemas(schemas):
+  # Reconcile the type each file has for a column into one type per column
+  column_types = {}
+  for schema in schemas:
+    for field in schema:
+      column_types.setdefault(field.name, []).append(field.type)
+
+  return pa.schema([pa.field(column, unify_types(column_types[column])) for column in sorted(column_types)])
+
+
+def infer_type(values):
+  try:
+    return pa.array(values).type
+  except (pa.ArrowInvalid, pa.ArrowTypeError):
+    # Attribute has mixed types across items, so fall back to strings
+    return pa.string()
+
+
+def unify_types(types):
+  types = {t for t in types if not pa.types.is_null(t)}
+
+  # Column is null in every segment
+  if len(types) == 0:
+    return pa.string()
+
+  if len(types) == 1:
+    return types.pop()
+
+  # Whole numbers in one segment and fractions in another
+  if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+    return pa.float64()
+
+  return pa.string()
+
+
+def to_arrow_table(items, schema):
+  arrays = []
+  for field in schema:
+    values = [item.get(field.name) for item in items]
+
+    if pa.types.is_string(field.type):
+      values = [v if v is None or isinstance(v, str) else str(v) for v in values]
+
+    arrays.append(pa.array(values, type=field.type))
+
+  return pa.Table.from_arrays(arrays, schema=schema)
@@ -0,0 +1,109 @@
+from   concurrent.futures import ThreadPoolExecutor
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of keys in a single BatchGetItem request, and of requests in a single BatchWriteItem
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+
+# How many times to retry unprocessed keys or items before giving up
+BATCH_RETRIES = 8
+
+
+def backoff(attempt):
+  # Full jitter, so that concurrent batches don't all retry at once
+  time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
+
+
+def batch_get(dynamodb, table_name, keys, projection=None, attribute_names=None):
+  # Use the resource's client, as it is thread safe but still deserializes items
+  client = dynamodb.meta.client
+
+  request = {table_name: {"Keys": keys}}
+  if projection is not None:
+    request[table_name]["ProjectionExpression"] = projection
+  if attribute_names is not None:
+    request[table_name]["ExpressionAttributeNames"] = attribute_names
+
+  results = []
+  for attempt in range(BATCH_RETRIES):
+    response = client.batch_get_item(RequestItems=request)
+    results.extend(response['Responses'].get(table_name, []))
+
+    request = response.get('UnprocessedKeys', {})
+    if not request:
+      return results
+
+    # Retry only the keys which weren't processed
+    backoff(attempt)
+
+  raise Exception(f"{len(request[table_name]['Keys'])} keys from {table_name} were still unprocessed after {BATCH_RETRIES} attempts")
+
+
+def batch_get_items(dynamodb, table_name, keys, projection=None, attribute_names=None, workers=1):
+  # BatchGetItem rejects duplicate keys, so remove them (preserving order)
+  keys = list({tuple(sorted(k.items())): k for k in keys}.values())
+  chunks = [keys[i:i + BATCH_GET_SIZE] for i in range(0, len(keys), BATCH_GET_SIZE)]
+
+  items = []
+  with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as executor:
+    for chunk_items in executor.map(lambda chunk: batch_get(dynamodb, table_name, chunk, projection, attribute_names), chunks):
+      items.extend(chunk_items)
+
+  return items
+
+
+def batch_write(dynamodb, table_name, requests):
+  # Use the resource's client, as it is thread safe
+  client = dynamodb.meta.client
+  request = {table_name: requests}
+
+  for attempt in range(BATCH_RETRIES):
+    try:
+      response = client.batch_write_item(RequestItems=request)
+    except Exception as e:
+      logger.error(f"Unable to write batch of {len(request[table_name])} requests to {table_name}: {str(e)}")
+      break
+
+    request = response.get('UnprocessedItems', {})
+    if not request:
+      return []
+
+    # Retry only the items which weren't processed
+    backoff(attempt)
+
+  # Requests which were never written
+  logger.error(f"{len(request[table_name])} requests to {table_name} were not written")
+  return request[table_name]
+
+
+def bulk_write(dynamodb, table_name, requests, workers=1):
+  # Stream requests into BatchWriteItem batches, writing several batches at once
+  futures = []
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+    batch = []
+    for request in requests:
+      batch.append(request)
+      if len(batch) == BATCH_WRITE_SIZE:
+        futures.append((executor.submit(batch_write, dynamodb, table_name, batch), len(batch)))
+        batch = []
+
+    if len(batch) > 0:
+      futures.append((executor.submit(batch_write, dynamodb, table_name, batch), len(batch)))
+
+    written = 0
+    failed = []
+    for future, size in futures:
+      batch_failed = future.result()
+      written += size - len(batch_failed)
+      failed.extend(batch_failed)
+
+  return (written, failed)
+
+
+def bulk_delete(dynamodb, table_name, keys, workers=1):
+  deleted, failed = bulk_write(dynamodb, table_name, ({"DeleteRequest": {"Key": key}} for key in keys), workers)
+  return (deleted, [r["DeleteRequest"]["Key"] for r in failed])
@@ -0,0 +1,63 @@
+from   boto3.dynamodb.conditions import Key
+import logging
+from   portal_common.dynamodb import BATCH_GET_SIZE, batch_get
+
+logger = logging.getLogger(__name__)
+
+# Every event is one of these location types, which partition the date indexes
+LOCATION_TYPES = ["physical", "virtual"]
+
+
+def query_index(event_instance_table, index_name, date_condition):
+  events = []
+  for location_type in LOCATION_TYPES:
+    kwargs = {
+      "IndexName": index_name,
+      "KeyConditionExpression": Key('locationType').eq(location_type) & date_condition
+    }
+
+    while True:
+      response = event_instance_table.query(**kwargs)
+      events.extend(response['Items'])
+
+      if 'LastEvaluatedKey' not in response:
+        break
+
+      kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+  return events
+
+
+def get_series_names(dynamodb, table_name, series_ids):
+  # Series which can't be fetched are left out, so only their events are skipped
+  series_ids = list(dict.fromkeys(series_ids))
+
+  series_names = {}
+  for i in range(0, len(series_ids), BATCH_GET_SIZE):
+    chunk = series_ids[i:i + BATCH_GET_SIZE]
+    try:
+      series = batch_get(dynamodb, table_name, [{"eventSeriesId": s} for s in chunk], "eventSeriesId, #n", {"#n": "name"})
+    except Exception as e:
+      logger.error(f"Unable to get event series information for {len(chunk)} series: {str(e)}")
+      continue
+
+    series_names.update({s["eventSeriesId"]: s["name"] for s in series})
+
+  return series_names
+
+
+def get_event_details(events, series_names):
+  event_details = []
+  for event in events:
+    if event["eventSeriesId"] not in series_names:
+      logger.error(f"Unable to get event series information for {event['eventSeriesId']}")
+      continue
+
+    event_details.append({
+      "eventSeriesId": event["eventSeriesId"],
+      "eventId": event["eventId"],
+      "location": event["location"],
+      "name": series_names[event["eventSeriesId"]]
+    })
+
+  return event_details
@@ -0,0 +1,77 @@
+from   aws_lambda_powertools.metrics import MetricUnit
+from   botocore.exceptions import ClientError
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Sequence numbers of records from a failed batch, so their redelivery can be counted as a retry
+retry_sequence_numbers = set()
+
+# Client errors which will recur however often a record is retried, so the record is logged and skipped instead
+NON_RETRYABLE_ERRORS = ["AliasExistsException", "InvalidParameterException", "InvalidParameterValue", "ResourceNotFoundException", "ValidationException"]
+
+
+def sequence_number(record):
+  return record.get('dynamodb', {}).get('SequenceNumber')
+
+
+def is_retryable(e):
+  # Malformed records (e.g. a missing attribute) will never succeed either
+  if isinstance(e, (KeyError, TypeError, ValueError)):
+    return False
+
+  if isinstance(e, ClientError):
+    return e.response.get('Error', {}).get('Code') not in NON_RETRYABLE_ERRORS
+
+  return True
+
+
+def process_stream_records(event, process_record, metrics):
+  # Process records in order, stopping at the first failure as Lambda retries the batch from there
+  started = time.perf_counter()
+  processed = 0
+  skipped = 0
+  failures = []
+
+  for record in event['Records']:
+    try:
+      process_record(record)
+    except Exception as e:
+      if not is_retryable(e):
+        logger.error(f"Skipping record {sequence_number(record)}, as retrying won't help: {repr(e)}")
+        skipped += 1
+        continue
+
+      logger.error(f"Unable to process record {sequence_number(record)}: {str(e)}")
+      failures.append(sequence_number(record))
+      break
+
+    processed += 1
+
+  return stream_batch_result(event, metrics, started, processed, failures, skipped)
+
+
+def stream_batch_result(event, metrics, started, processed, failures, skipped=0):
+  global retry_sequence_numbers
+
+  sequence_numbers = [sequence_number(r) for r in event['Records']]
+  retries = len([s for s in sequence_numbers if s in retry_sequence_numbers])
+
+  # Lambda retries from the earliest failed record, so every record from there on will be replayed,
+  # including any which have already been processed
+  if len(failures) > 0:
+    earliest = min(int(s) for s in failures)
+    retry_sequence_numbers = {s for s in sequence_numbers if s is not None and int(s) >= earliest}
+  else:
+    retry_sequence_numbers = set()
+
+  metrics.add_metric(name="StreamRecordsProcessed", unit=MetricUnit.Count, value=processed)
+  metrics.add_metric(name="StreamRecordFailures", unit=MetricUnit.Count, value=len(failures))
+  metrics.add_metric(name="StreamRecordsSkipped", unit=MetricUnit.Count, value=skipped)
+  metrics.add_metric(name="StreamRecordRetries", unit=MetricUnit.Count, value=retries)
+  metrics.add_metric(name="StreamBatchProcessingTime", unit=MetricUnit.Milliseconds, value=(time.perf_counter() - started) * 1000)
+
+  return {
+    "batchItemFailures": [{"itemIdentifier": s} for s in failures]
+  }
@@ -1,129 +1,258 @@
+from   aws_lambda_powertools import Metrics
 import boto3
+from   itertools import groupby
 import json
 import logging
 import os
+from   portal_common.dynamodb import batch_get_items
+from   portal_common.streams import is_retryable, sequence_number, stream_batch_result
+import time
 
 logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
+metrics = Metrics()
+
 EVENT_ALLOCATION_TEMPLATE = os.getenv('EVENT_ALLOCATION_TEMPLATE')
 EVENT_SERIES_TABLE = os.getenv('EVENT_SERIES_TABLE')
 EVENTS_EMAIL = os.getenv('EVENTS_EMAIL')
 MEMBERS_TABLE = os.getenv('MEMBERS_TABLE')
+SEND_RATE = float(os.getenv('SEND_RATE', "0"))
 
 logger.info(f"EVENT_ALLOCATION_TEMPLATE = {EVENT_ALLOCATION_TEMPLATE}")
 logger.info(f"EVENT_SERIES_TABLE = {EVENT_SERIES_TABLE}")
 logger.info(f"EVENTS_EMAIL = {EVENTS_EMAIL}")
 logger.info(f"MEMBERS_TABLE = {MEMBERS_TABLE}")
+logger.info(f"SEND_RATE = {SEND_RATE}")
+
+# Maximum number of destinations in a single SendBulkTemplatedEmail request
+BULK_SIZE = 50
+
+# Per-destination statuses worth retrying - any other (e.g. MessageRejected, MailFromDomainNotVerified)
+# will fail again, so is logged and skipped rather than holding back the rest of the stream
+RETRYABLE_STATUSES = ["AccountDailyQuotaExceeded", "AccountThrottled", "Failed", "TransientFailure"]
+
+# Allocation statuses which members are notified of, with the text used in the e-mail
+ALLOCATIONS = {
+  "ALLOCATED": ("Allocated", "You have been selected to attend the above event, and will receive further details in due course."),
+  "RESERVE": ("Reserve list", "You have been placed on the reserve list to attend the above event. Please keep the date free if possible."),
+  "NOT_ALLOCATED": ("Not allocated", "You have not been selected to attend the above event. Thank you for offering your time."),
+  "DROPPED_OUT": ("Dropped out", "You have notified us that you will no longer be able to attend this event."),
+  "NO_SHOW": ("No show", "You were due to attend this event, but did not attend without giving us prior notice (or without giving us sufficient notice).")
+}
 
 dynamodb = boto3.resource('dynamodb')
 ses = boto3.client('ses')
 
-event_series_table = dynamodb.Table(EVENT_SERIES_TABLE)
-members_table = dynamodb.Table(MEMBERS_TABLE)
+# Time at which the next bulk send may start, to keep within the SES send rate
+next_send_at = 0
 
+@metrics.log_metrics
 def handler(event, context):
   logger.debug(event)
 
-  for record in event['Records']:
-    if record['eventSource'] != "aws:dynamodb":
-      logger.warning(f"Non-DynamoDB event found - skipping: {json.dumps(record)}")
-      continue
+  started = time.perf_counter()
+  records = event['Records']
 
-    if record['eventName'] == "REMOVE":
-      logger.info("REMOVE event received - skipping")
-      continue
+  # Index of the earliest record which failed, as Lambda retries the batch from there
+  failed_at = None
 
-    combinedEventId = record['dynamodb']['Keys']['combinedEventId']['S']
-    membershipNumber = record['dynamodb']['Keys']['membershipNumber']['S']
+  skipped = 0
+  notifications = []
+  for i, record in enumerate(records):
+    try:
+      notification = process_record(record)
+    except Exception as e:
+      if not is_retryable(e):
+        logger.error(f"Skipping record {sequence_number(record)}, as retrying won't help: {repr(e)}")
+        skipped += 1
+        continue
 
-    if 'NewImage' not in record['dynamodb']:
-      logger.warning(f"New image not included in record - skipping: {json.dumps(record)}")
-      continue
+      logger.error(f"Unable to process record {sequence_number(record)}: {str(e)}")
+      failed_at = i
+      break
+
+    if notification is not None:
+      notification['index'] = i
+      notifications.append(notification)
+
+  if len(notifications) > 0:
+    try:
+      failed = send_allocation_notifications(notifications)
+    except Exception as e:
+      logger.error(f"Unable to send allocation notifications: {str(e)}")
+      failed = [n['index'] for n in notifications]
+
+    if len(failed) > 0:
+      failed_at = min(failed + ([failed_at] if failed_at is not None else []))
+
+  if failed_at is not None:
+    return stream_batch_result(event, metrics, started, failed_at, [sequence_number(records[failed_at])], skipped)
+
+  return stream_batch_result(event, metrics, started, len(records) - skipped, [], skipped)
+
+
+def process_record(record):
+  if record['eventSource'] != "aws:dynamodb":
+    logger.warning(f"Non-DynamoDB event found - skipping: {json.dumps(record)}")
+    return
+
+  if record['eventName'] == "REMOVE":
+    logger.info("REMOVE event received - skipping")
+    return
+
+  combinedEventId = record['dynamodb']['Keys']['combinedEventId']['S']
+  membershipNumber = record['dynamodb']['Keys']['membershipNumber']['S']
 
-    allocation = record['dynamodb']['NewImage']['allocation']['S']
-
-    logger.info(f"{record['eventName']} event for member {membershipNumber} on {combinedEventId}")
-
-    if record['eventName'] == "INSERT" or record['eventName'] == "MODIFY":
-      updated_allocation(combinedEventId, membershipNumber, allocation)
-
-
-def updated_allocation(combinedEventId, membershipNumber, allocation):
-  logger.debug("Sending new/updated allocation notification")
-
-  if allocation == "ALLOCATED":
-    a = "Allocated"
-    aText = "You have been selected to attend the above event, and will receive further details in due course."
-  elif allocation == "RESERVE":
-    a = "Reserve list"
-    aText = "You have been placed on the reserve list to attend the above event. Please keep the date free if possible."
-  elif allocation == "NOT_ALLOCATED":
-    a = "Not allocated"
-    aText = "You have not been selected to attend the above event. Thank you for offering your time."
-  elif allocation == "DROPPED_OUT":
-    a = "Dropped out"
-    aText = "You have notified us that you will no longer be able to attend this event."
-  elif allocation == "NO_SHOW":
-    a = "No show"
-    aText = "You were due to attend this event, but did not attend without giving us prior notice (or without giving us sufficient notice)."
-  else:
+  if 'NewImage' not in record['dynamodb']:
+    logger.warning(f"New image not included in record - skipping: {json.dumps(record)}")
+    return
+
+  allocation = record['dynamodb']['NewImage']['allocation']['S']
+
+  logger.info(f"{record['eventName']} event for member {membershipNumber} on {combinedEventId}")
+
+  if allocation not in ALLOCATIONS:
     logger.info(f"New allocation status is {allocation} - e-mail will not be sent")
     return
 
-  # Get series details
-  eventSeriesId = combinedEventId.split("/", 1)[0]
-  try:
-    eventSeries = event_series_table.get_item(
-      Key={
-        "eventSeriesId": eventSeriesId
-      }
-    )['Item']
-  except Exception as e:
-    logger.error(f"Unable to get event series {eventSeriesId} from {EVENT_SERIES_TABLE}: {str(e)}")
-    raise e
-  
-  # Get member details
-  try:
-    member = members_table.get_item(
-      Key={
-        "membershipNumber": membershipNumber
-      },
-      ProjectionExpression="firstName,preferredName,surname,email"
-    )['Item']
-  except Exception as e:
-    logger.error(f"Unable to get member {membershipNumber} from {MEMBERS_TABLE}: {str(e)}")
-    raise e
-  
-  if member.get('preferredName'):
-    firstName = member['preferredName']
-    name = f"{member['preferredName']} {member['surname']}"
-  else:
-    firstName = member['firstName']
-    name = f"{member['firstName']} {member['surname']}"
+  return {
+    "combinedEventId": combinedEventId,
+    "membershipNumber": membershipNumber,
+    "allocation": allocation
+  }
 
-  try:
-    ses.send_templated_email(
-      Source='"KSWP Portal" <portal@kswp.org.uk>',
-      Destination={
+
+def send_allocation_notifications(notifications):
+  # Committing an event's allocations produces a record per member, so look up each series once
+  # and all of the members together
+  event_series = {s['eventSeriesId']: s for s in batch_get_items(dynamodb, EVENT_SERIES_TABLE, [{"eventSeriesId": n['combinedEventId'].split("/", 1)[0]} for n in notifications])}
+  members = {m['membershipNumber']: m for m in batch_get_items(dynamodb, MEMBERS_TABLE, [{"membershipNumber": n['membershipNumber']} for n in notifications], "membershipNumber,firstName,preferredName,surname,email")}
+
+  logger.info(f"Fetched {len(event_series)} event series and {len(members)} members for {len(notifications)} notifications")
+
+  sendable = []
+  for notification in notifications:
+    eventSeriesId = notification['combinedEventId'].split("/", 1)[0]
+
+    if eventSeriesId not in event_series:
+      logger.warning(f"Event series {eventSeriesId} not found - allocation e-mail will not be sent to {notification['membershipNumber']}")
+      continue
+
+    if notification['membershipNumber'] not in members:
+      logger.warning(f"Member {notification['membershipNumber']} not found - allocation e-mail will not be sent for {notification['combinedEventId']}")
+      continue
+
+    sendable.append(notification)
+
+  # Send in record order, batching consecutive notifications for the same event, and stop at the first
+  # chunk with failures, as Lambda retries every record from the earliest failure and anything sent
+  # after it would be e-mailed again
+  chunks = []
+  for combinedEventId, event_notifications in groupby(sendable, key=lambda n: n['combinedEventId']):
+    event_notifications = list(event_notifications)
+    chunks.extend(event_notifications[i:i + BULK_SIZE] for i in range(0, len(event_notifications), BULK_SIZE))
+
+  rate = get_send_rate()
+  for c, chunk in enumerate(chunks):
+    eventSeries = event_series[chunk[0]['combinedEventId'].split("/", 1)[0]]
+    failed = send_notifications(eventSeries, chunk, members, rate)
+    if len(failed) > 0:
+      return failed + [n['index'] for later in chunks[c + 1:] for n in later]
+
+  return []
+
+
+def send_notifications(eventSeries, notifications, members, rate):
+  destinations = []
+  for notification in notifications:
+    member = members[notification['membershipNumber']]
+    a, aText = ALLOCATIONS[notification['allocation']]
+
+    if member.get('preferredName'):
+      firstName = member['preferredName']
+      name = f"{member['preferredName']} {member['surname']}"
+    else:
+      firstName = member['firstName']
+      name = f"{member['firstName']} {member['surname']}"
+
+    destinations.append({
+      'Destination': {
         'ToAddresses': [
           '"'+name+'" <'+member['email']+'>',
         ]
       },
+      'ReplacementTemplateData': json.dumps({
+        'firstName': firstName,
+        'allocation': a,
+        'allocationText': aText
+      })
+    })
+
+  throttle(len(destinations), rate)
+
+  combinedEventId = notifications[0]['combinedEventId']
+  try:
+    response = ses.send_bulk_templated_email(
+      Source='"KSWP Portal" <portal@kswp.org.uk>',
       ReplyToAddresses=[
         EVENTS_EMAIL
       ],
       ReturnPath='bounces@kswp.org.uk',
       Template=EVENT_ALLOCATION_TEMPLATE,
-      TemplateData=json.dumps({
-        'firstName': firstName,
+      DefaultTemplateData=json.dumps({
+        'firstName': "",
         'eventName': eventSeries['name'],
-        'allocation': a,
-        'allocationText': aText
-      })
+        'allocation': "",
+        'allocationText': ""
+      }),
+      Destinations=destinations
     )
+  except (ses.exceptions.MessageRejected, ses.exceptions.MailFromDomainNotVerifiedException, ses.exceptions.TemplateDoesNotExistException,
+          ses.exceptions.ConfigurationSetDoesNotExistException, ses.exceptions.ConfigurationSetSendingPausedException, ses.exceptions.AccountSendingPausedException) as e:
+    logger.error(f"Unable to send {EVENT_ALLOCATION_TEMPLATE} e-mail to {len(notifications)} members for {combinedEventId}, and retrying won't help: {str(e)}")
+    return []
   except Exception as e:
-    logger.error(f"Unable to send {EVENT_ALLOCATION_TEMPLATE} e-mail to {member['email']} for {membershipNumber} on {combinedEventId}: {str(e)}")
-    raise e
+    logger.error(f"Unable to send {EVENT_ALLOCATION_TEMPLATE} e-mail to {len(notifications)} members for {combinedEventId}: {str(e)}")
+    return [n['index'] for n in notifications]
+
+  # Statuses are returned in the same order as the destinations
+  failed = []
+  skipped = 0
+  for notification, status in zip(notifications, response['Status']):
+    if status['Status'] == "Success":
+      continue
+
+    if status['Status'] in RETRYABLE_STATUSES:
+      logger.error(f"Unable to send {EVENT_ALLOCATION_TEMPLATE} e-mail to {notification['membershipNumber']} for {combinedEventId}: {status['Status']} {status.get('Error', '')}")
+      failed.append(notification['index'])
+    else:
+      logger.error(f"Unable to send {EVENT_ALLOCATION_TEMPLATE} e-mail to {notification['membershipNumber']} for {combinedEventId}, and retrying won't help: {status['Status']} {status.get('Error', '')}")
+      skipped += 1
+
+  logger.info(f"Sent {len(notifications) - len(failed) - skipped} allocation notifications for {combinedEventId} ({len(failed)} errors to retry, {skipped} skipped)")
+
+  return failed
+
+
+def get_send_rate():
+  if SEND_RATE > 0:
+    return SEND_RATE
+
+  try:
+    return ses.get_send_quota()['MaxSendRate']
+  except Exception as e:
+    logger.warning(f"Unable to get SES send quota, so assuming 1 e-mail per second: {str(e)}")
+    return 1
+
+
+def throttle(count, rate):
+  global next_send_at
+
+  # Reserve time for this many e-mails at the send rate, then wait until our turn
+  send_at = max(time.monotonic(), next_send_at)
+  next_send_at = send_at + count / rate
 
-  logger.info(f"Finished sending allocation notification for {membershipNumber} on {combinedEventId}")
+  delay = send_at - time.monotonic()
+  if delay > 0:
+    time.sleep(delay)
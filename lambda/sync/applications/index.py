@@ -1,19 +1,26 @@
+from   aws_lambda_powertools import Metrics
 import boto3
 from   boto3.dynamodb.conditions import Key
 import json
 import logging
 import os
+from   portal_common.dynamodb import bulk_delete
+from   portal_common.streams import process_stream_records
 
 logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
+metrics = Metrics()
+
 APPLICATION_RECEIVED_TEMPLATE = os.getenv('APPLICATION_RECEIVED_TEMPLATE')
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', "4"))
 EVIDENCE_BUCKET_NAME = os.getenv('EVIDENCE_BUCKET_NAME')
 MEMBERS_EMAIL = os.getenv('MEMBERS_EMAIL')
 PORTAL_DOMAIN = os.getenv('PORTAL_DOMAIN')
 REFERENCES_TABLE = os.getenv('REFERENCES_TABLE')
 
 logger.info(f"APPLICATION_RECEIVED_TEMPLATE = {APPLICATION_RECEIVED_TEMPLATE}")
+logger.info(f"BATCH_WORKERS = {BATCH_WORKERS}")
 logger.info(f"EVIDENCE_BUCKET_NAME = {EVIDENCE_BUCKET_NAME}")
 logger.info(f"MEMBERS_EMAIL = {MEMBERS_EMAIL}")
 logger.info(f"PORTAL_DOMAIN = {PORTAL_DOMAIN}")
@@ -24,24 +31,28 @@ s3 = boto3.client('s3')
 ses = boto3.client('ses')
 
 
+@metrics.log_metrics
 def handler(event, context):
   logger.debug(event)
 
-  for record in event['Records']:
-    if record['eventSource'] != "aws:dynamodb":
-      logger.warning(f"Non-DynamoDB event found - skipping: {json.dumps(record)}")
-      continue
+  return process_stream_records(event, process_record, metrics)
+
 
-    membershipNumber = record['dynamodb']['Keys']['membershipNumber']['S']
-    logger.info(f"{record['eventName']} event for {membershipNumber}")
+def process_record(record):
+  if record['eventSource'] != "aws:dynamodb":
+    logger.warning(f"Non-DynamoDB event found - skipping: {json.dumps(record)}")
+    return
 
-    if record['eventName'] == "INSERT":
-      a = record['dynamodb']['NewImage']
-      application_received(a)
-    elif record['eventName'] == "REMOVE":
-      logger.debug("REMOVE event received")
-      remove_evidence(membershipNumber)
-      remove_references(membershipNumber)
+  membershipNumber = record['dynamodb']['Keys']['membershipNumber']['S']
+  logger.info(f"{record['eventName']} event for {membershipNumber}")
+
+  if record['eventName'] == "INSERT":
+    a = record['dynamodb']['NewImage']
+    application_received(a)
+  elif record['eventName'] == "REMOVE":
+    logger.debug("REMOVE event received")
+    remove_evidence(membershipNumber)
+    remove_references(membershipNumber)
 
 
 def application_received(application):
@@ -100,34 +111,39 @@ def remove_references(membershipNumber):
 
   table = dynamodb.Table(REFERENCES_TABLE)
 
-  # List references
+  keys = ({'membershipNumber': r['membershipNumber'], 'referenceEmail': r['referenceEmail']} for r in get_references(table, membershipNumber))
+
   try:
-    toDelete = table.query(
-      KeyConditionExpression=Key('membershipNumber').eq(membershipNumber)
-    )
+    deletedCount, failed = bulk_delete(dynamodb, REFERENCES_TABLE, keys, BATCH_WORKERS)
   except Exception as e:
     logger.error(f"Unable to get list of references to delete: {str(e)}")
-    return
-  
-  logger.info(f"{len(toDelete['Items'])} references for {membershipNumber} found for deletion")
-
-  deletedCount = 0
-  for reference in toDelete['Items']:
-    logger.debug(f"Deleting reference for {membershipNumber} from {reference['referenceEmail']}")
-
-    # Delete references from DynamoDB
-    try:
-      table.delete_item(
-        Key={
-          'membershipNumber': reference['membershipNumber'],
-          'referenceEmail': reference['referenceEmail']
-        }
-      )
-
-      deletedCount += 1
-    except Exception as e:
-      logger.error(f"Unable to delete {reference['referenceEmail']} from DynamoDB: {str(e)}")
-      continue
-  
+    raise e
+
+  for key in failed:
+    logger.error(f"Unable to delete {key['referenceEmail']} from DynamoDB")
+
+  logger.info(f"Deleted {deletedCount} references for {membershipNumber} ({len(failed)} errors)")
+
+  # Deletes are idempotent, so fail the record to have it retried
+  if len(failed) > 0:
+    raise Exception(f"Unable to delete {len(failed)} references for {membershipNumber}")
+
+
+def get_references(table, membershipNumber):
+  # Yield references a page at a time, so deletes can start before the query finishes
+  last_evaluated_key = None
+
+  while True:
+    kwargs = {
+      'KeyConditionExpression': Key('membershipNumber').eq(membershipNumber),
+      'ProjectionExpression': "membershipNumber, referenceEmail"
+    }
+    if last_evaluated_key:
+      kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+    response = table.query(**kwargs)
+    yield from response['Items']
 
-  logger.info(f"Deleted {deletedCount} references for {membershipNumber} ({len(toDelete['Items']) - deletedCount} errors)")
+    last_evaluated_key = response.get('LastEvaluatedKey')
+    if not last_evaluated_key:
+      break
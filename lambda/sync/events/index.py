@@ -1,29 +1,45 @@
+from   aws_lambda_powertools import Metrics
 import boto3
 from   boto3.dynamodb.conditions import Attr,Key
+from   concurrent.futures import ThreadPoolExecutor
 import datetime
 import json
 import logging
 import os
+from   portal_common.dynamodb import bulk_delete
+from   portal_common.streams import process_stream_records
+import threading
+import time
 
 logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
+metrics = Metrics()
+
 ALLOCATIONS_TABLE = os.getenv('ALLOCATIONS_TABLE')
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', "4"))
 EVENT_ADDED_TEMPLATE = os.getenv('EVENT_ADDED_TEMPLATE')
 EVENT_SERIES_TABLE = os.getenv('EVENT_SERIES_TABLE')
 EVENTS_EMAIL = os.getenv('EVENTS_EMAIL')
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', "4"))
 MEMBERS_STATUS_INDEX = os.getenv('MEMBERS_STATUS_INDEX')
 MEMBERS_TABLE = os.getenv('MEMBERS_TABLE')
 PORTAL_DOMAIN = os.getenv('PORTAL_DOMAIN')
+SEND_RATE = float(os.getenv('SEND_RATE', "0"))
 
 logger.info(f"ALLOCATIONS_TABLE = {ALLOCATIONS_TABLE}")
+logger.info(f"BATCH_WORKERS = {BATCH_WORKERS}")
 logger.info(f"EVENT_ADDED_TEMPLATE = {EVENT_ADDED_TEMPLATE}")
 logger.info(f"EVENT_SERIES_TABLE = {EVENT_SERIES_TABLE}")
 logger.info(f"EVENTS_EMAIL = {EVENTS_EMAIL}")
-
+logger.info(f"MAX_WORKERS = {MAX_WORKERS}")
 logger.info(f"MEMBERS_STATUS_INDEX = {MEMBERS_STATUS_INDEX}")
 logger.info(f"MEMBERS_TABLE = {MEMBERS_TABLE}")
 logger.info(f"PORTAL_DOMAIN = {PORTAL_DOMAIN}")
+logger.info(f"SEND_RATE = {SEND_RATE}")
+
+# Maximum number of destinations in a single SendBulkTemplatedEmail request
+BULK_SIZE = 50
 
 dynamodb = boto3.resource('dynamodb')
 ses = boto3.client('ses')
@@ -32,23 +48,31 @@ allocations_table = dynamodb.Table(ALLOCATIONS_TABLE)
 event_series_table = dynamodb.Table(EVENT_SERIES_TABLE)
 members_table = dynamodb.Table(MEMBERS_TABLE)
 
+# Time at which the next bulk send may start, shared between threads to keep within the SES send rate
+throttle_lock = threading.Lock()
+next_send_at = 0
+
+@metrics.log_metrics
 def handler(event, context):
   logger.debug(event)
 
-  for record in event['Records']:
-    if record['eventSource'] != "aws:dynamodb":
-      logger.warning(f"Non-DynamoDB event found - skipping: {json.dumps(record)}")
-      continue
+  return process_stream_records(event, process_record, metrics)
+
 
-    eventSeriesId = record['dynamodb']['Keys']['eventSeriesId']['S']
-    eventId = record['dynamodb']['Keys']['eventId']['S']
-    logger.info(f"{record['eventName']} event for {eventSeriesId}/{eventId}")
+def process_record(record):
+  if record['eventSource'] != "aws:dynamodb":
+    logger.warning(f"Non-DynamoDB event found - skipping: {json.dumps(record)}")
+    return
 
-    if record['eventName'] == "INSERT":
-      e = record['dynamodb']['NewImage']
-      new_event(eventSeriesId, e)
-    elif record['eventName'] == "REMOVE":
-      remove_event(eventSeriesId, eventId)
+  eventSeriesId = record['dynamodb']['Keys']['eventSeriesId']['S']
+  eventId = record['dynamodb']['Keys']['eventId']['S']
+  logger.info(f"{record['eventName']} event for {eventSeriesId}/{eventId}")
+
+  if record['eventName'] == "INSERT":
+    e = record['dynamodb']['NewImage']
+    new_event(eventSeriesId, e)
+  elif record['eventName'] == "REMOVE":
+    remove_event(eventSeriesId, eventId)
 
 
 def new_event(eventSeriesId, eventInstance):
@@ -65,13 +89,41 @@ def new_event(eventSeriesId, eventInstance):
     logger.error(f"Unable to get event series {eventSeriesId} from {EVENT_SERIES_TABLE}: {str(e)}")
     raise e
 
+  # Details common to every e-mail, with each member's name added per destination
+  default_template_data = {
+    'firstName': "",
+    'eventSeriesId': eventSeriesId,
+    'eventInstanceId': eventInstance['eventId']['S'],
+    'eventName': eventSeries['name'],
+    'eventDescription': eventSeries['description'],
+    'startDate': eventInstance['startDate']['S'],
+    'endDate': eventInstance['endDate']['S'],
+    'location': eventInstance['location']['S'],
+    'registrationDate': eventInstance['registrationDate']['S'],
+    'portalDomain': PORTAL_DOMAIN
+  }
+
   # Get a list of all ACTIVE members
+  members = get_members(eventInstance['startDate']['S'][0:10], eventInstance['attendanceCriteria']['L'])
+  chunks = [members[i:i + BULK_SIZE] for i in range(0, len(members), BULK_SIZE)]
+
+  rate = get_send_rate()
+  logger.info(f"Sending event notification to {len(members)} members in {len(chunks)} batches at up to {rate} e-mails per second")
+
   error_count = 0
   success_count = 0
 
-  for member in get_members(eventInstance['startDate']['S'][0:10], eventInstance['attendanceCriteria']['L']):
-    logger.debug(f"Sending event notification to {member['email']}")
+  with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(chunks)))) as executor:
+    for successes, errors in executor.map(lambda chunk: send_notifications(chunk, default_template_data, rate), chunks):
+      success_count += successes
+      error_count += errors
 
+  logger.info(f"Finished sending notifications for event {eventSeriesId}/{eventInstance['eventId']['S']} - {success_count} successful, {error_count} errors")
+
+
+def send_notifications(members, default_template_data, rate):
+  destinations = []
+  for member in members:
     if member.get('preferredName'):
       firstName = member['preferredName']
       name = f"{member['preferredName']} {member['surname']}"
@@ -79,55 +131,81 @@ def new_event(eventSeriesId, eventInstance):
       firstName = member['firstName']
       name = f"{member['firstName']} {member['surname']}"
 
-    try:
-      ses.send_templated_email(
-        Source='"KSWP Portal" <portal@kswp.org.uk>',
-        Destination={
-          'ToAddresses': [
-            '"'+name+'" <'+member['email']+'>',
-          ]
-        },
-        ReplyToAddresses=[
-          EVENTS_EMAIL
-        ],
-        ReturnPath='bounces@kswp.org.uk',
-        Template=EVENT_ADDED_TEMPLATE,
-        TemplateData=json.dumps({
-          'firstName': firstName,
-          'eventSeriesId': eventSeriesId,
-          'eventInstanceId': eventInstance['eventId']['S'],
-          'eventName': eventSeries['name'],
-          'eventDescription': eventSeries['description'],
-          'startDate': eventInstance['startDate']['S'],
-          'endDate': eventInstance['endDate']['S'],
-          'location': eventInstance['location']['S'],
-          'registrationDate': eventInstance['registrationDate']['S'],
-          'portalDomain': PORTAL_DOMAIN
-        })
-      )
+    destinations.append({
+      'Destination': {
+        'ToAddresses': [
+          '"'+name+'" <'+member['email']+'>',
+        ]
+      },
+      'ReplacementTemplateData': json.dumps({
+        'firstName': firstName
+      })
+    })
 
-      success_count += 1
-    except Exception as e:
-      logger.error(f"Unable to send {EVENT_ADDED_TEMPLATE} e-mail to {member['email']} for {eventSeriesId}/{eventInstance['eventId']}: {str(e)}")
+  throttle(len(destinations), rate)
+
+  try:
+    response = ses.send_bulk_templated_email(
+      Source='"KSWP Portal" <portal@kswp.org.uk>',
+      ReplyToAddresses=[
+        EVENTS_EMAIL
+      ],
+      ReturnPath='bounces@kswp.org.uk',
+      Template=EVENT_ADDED_TEMPLATE,
+      DefaultTemplateData=json.dumps(default_template_data),
+      Destinations=destinations
+    )
+  except Exception as e:
+    logger.error(f"Unable to send {EVENT_ADDED_TEMPLATE} e-mail to {len(members)} members for {default_template_data['eventSeriesId']}/{default_template_data['eventInstanceId']}: {str(e)}")
+    return (0, len(members))
+
+  # Statuses are returned in the same order as the destinations
+  error_count = 0
+  for member, status in zip(members, response['Status']):
+    if status['Status'] != "Success":
+      logger.error(f"Unable to send {EVENT_ADDED_TEMPLATE} e-mail to {member['email']} for {default_template_data['eventSeriesId']}/{default_template_data['eventInstanceId']}: {status['Status']} {status.get('Error', '')}")
       error_count += 1
 
-  logger.info(f"Finished sending notifications for event {eventSeriesId}/{eventInstance['eventId']} - {success_count} successful, {error_count} errors")
+  return (len(members) - error_count, error_count)
+
+
+def get_send_rate():
+  if SEND_RATE > 0:
+    return SEND_RATE
+
+  try:
+    return ses.get_send_quota()['MaxSendRate']
+  except Exception as e:
+    logger.warning(f"Unable to get SES send quota, so assuming 1 e-mail per second: {str(e)}")
+    return 1
+
+
+def throttle(count, rate):
+  global next_send_at
+
+  # Reserve time for this many e-mails at the send rate, then wait until our turn
+  with throttle_lock:
+    send_at = max(time.monotonic(), next_send_at)
+    next_send_at = send_at + count / rate
+
+  delay = send_at - time.monotonic()
+  if delay > 0:
+    time.sleep(delay)
 
 
 def remove_event(eventSeriesId, eventId):
   combined_event_id = f"{eventSeriesId}/{eventId}"
-  allocations = get_allocations(combined_event_id)
-
-  for allocation in allocations:
-    try:
-      allocations_table.delete_item(
-        Key={
-          "combinedEventId": combined_event_id,
-          "membershipNumber": allocation["membershipNumber"]
-        }
-      )
-    except Exception as e:
-      logger.warn(f"Unable to delete allocation of {allocation['membershipNumber']} for {combinedEventId}: {str(e)}")
+  keys = ({"combinedEventId": combined_event_id, "membershipNumber": a["membershipNumber"]} for a in get_allocations(combined_event_id))
+
+  deleted, failed = bulk_delete(dynamodb, ALLOCATIONS_TABLE, keys, BATCH_WORKERS)
+  logger.info(f"Deleted {deleted} allocations for {combined_event_id} ({len(failed)} errors)")
+
+  # Deletes are idempotent, so fail the record to have it retried
+  if len(failed) > 0:
+    raise Exception(f"Unable to delete {len(failed)} allocations for {combined_event_id}")
+
+  return (deleted, len(failed))
+
 
 def get_cutoff(event_date):
   event = datetime.date.fromisoformat(event_date)
@@ -172,24 +250,24 @@ def get_members(event_date, attendance_criteria):
 
 
 def get_allocations(combined_event_id):
-  results = []
+  # Yield allocations a page at a time, so deletes can start before the query finishes
   last_evaluated_key = None
 
   while True:
     if last_evaluated_key:
       response = allocations_table.query(
         KeyConditionExpression=Key("combinedEventId").eq(combined_event_id),
+        ProjectionExpression="membershipNumber",
         ExclusiveStartKey=last_evaluated_key
       )
     else: 
       response = allocations_table.query(
-        KeyConditionExpression=Key("combinedEventId").eq(combined_event_id)
+        KeyConditionExpression=Key("combinedEventId").eq(combined_event_id),
+        ProjectionExpression="membershipNumber"
       )
 
     last_evaluated_key = response.get('LastEvaluatedKey')    
-    results.extend(response['Items'])
+    yield from response['Items']
         
     if not last_evaluated_key:
-      break
-
-  return results
\ No newline at end of file
+      break
\ No newline at end of file
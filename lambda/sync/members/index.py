@@ -1,14 +1,22 @@
+from   aws_lambda_powertools import Metrics
+from   aws_lambda_powertools.metrics import MetricUnit
 import boto3
+from   collections import Counter
+from   concurrent.futures import ThreadPoolExecutor, wait
 import json
 import logging
 import hashlib
 from   mailchimp_marketing import Client
 from   mailchimp_marketing.api_client import ApiClientError
 import os
+from   portal_common.streams import is_retryable, stream_batch_result
+import time
 
 logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
+metrics = Metrics()
+
 API_KEY_SECRET_NAME = os.getenv('API_KEY_SECRET_NAME')
 APPLICATION_ACCEPTED_TEMPLATE = os.getenv('APPLICATION_ACCEPTED_TEMPLATE')
 COGNITO_PHONE = (os.getenv('COGNITO_PHONE', 'false').lower() == "true")
@@ -16,9 +24,13 @@ EVENTS_EMAIL = os.getenv('EVENTS_EMAIL')
 FUTURE_EVENTS_LAMBDA = os.getenv('FUTURE_EVENTS_LAMBDA')
 MAILCHIMP_LIST_ID = os.getenv('MAILCHIMP_LIST_ID')
 MAILCHIMP_SERVER_PREFIX = os.getenv('MAILCHIMP_SERVER_PREFIX')
+MAILCHIMP_STUB = (os.getenv('MAILCHIMP_STUB', 'false').lower() == "true")
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', "8"))
 MEMBERS_EMAIL = os.getenv('MEMBERS_EMAIL')
 PHOTO_BUCKET_NAME = os.getenv('PHOTO_BUCKET_NAME')
 PORTAL_DOMAIN = os.getenv('PORTAL_DOMAIN')
+RENDITION_SIZES = sorted([int(s) for s in os.getenv('RENDITION_SIZES', "64,128,256,512,1024").split(",")], reverse=True)
+SECRET_TTL = int(os.getenv('SECRET_TTL', "3600"))
 SUSPENDED_TEMPLATE = os.getenv('SUSPENDED_TEMPLATE')
 SUSPENDED_EVENTS_TEMPLATE = os.getenv('SUSPENDED_EVENTS_TEMPLATE')
 UNSUSPENDED_TEMPLATE = os.getenv('UNSUSPENDED_TEMPLATE')
@@ -41,9 +53,13 @@ logger.info(f"EVENTS_EMAIL = {EVENTS_EMAIL}")
 logger.info(f"FUTURE_EVENTS_LAMBDA = {FUTURE_EVENTS_LAMBDA}")
 logger.info(f"MAILCHIMP_LIST_ID = {MAILCHIMP_LIST_ID}")
 logger.info(f"MAILCHIMP_SERVER_PREFIX = {MAILCHIMP_SERVER_PREFIX}")
+logger.info(f"MAILCHIMP_STUB = {MAILCHIMP_STUB}")
+logger.info(f"MAX_WORKERS = {MAX_WORKERS}")
 logger.info(f"MEMBERS_EMAIL = {MEMBERS_EMAIL}")
 logger.info(f"PHOTO_BUCKET_NAME = {PHOTO_BUCKET_NAME}")
 logger.info(f"PORTAL_DOMAIN = {PORTAL_DOMAIN}")
+logger.info(f"RENDITION_SIZES = {RENDITION_SIZES}")
+logger.info(f"SECRET_TTL = {SECRET_TTL}")
 logger.info(f"SUSPENDED_TEMPLATE = {SUSPENDED_TEMPLATE}")
 logger.info(f"SUSPENDED_EVENTS_TEMPLATE = {SUSPENDED_EVENTS_TEMPLATE}")
 logger.info(f"UNSUSPENDED_TEMPLATE = {UNSUSPENDED_TEMPLATE}")
@@ -59,6 +75,9 @@ logger.info(f"SOCIALS_GROUP = {SOCIALS_GROUP}")
 logger.info(f"COMMITTEE_GROUP = {COMMITTEE_GROUP}")
 logger.info(f"STANDARD_GROUP = {STANDARD_GROUP}")
 
+# Every rendition of a member's photo, as written by the sync_photos Lambda
+PHOTO_SUFFIXES = [".jpg", ".thumb.jpg"] + [f".{size}.{ext}" for size in RENDITION_SIZES for ext in ["webp", "jpg"]]
+
 # AWS Clients
 cognito = boto3.client('cognito-idp')
 lambda_client = boto3.client('lambda')
@@ -66,46 +85,157 @@ secrets = boto3.client('secretsmanager')
 ses = boto3.client('ses')
 s3 = boto3.client('s3')
 
-# Mailchimp Client
-try:
-  mailchimp_api_key = json.loads(secrets.get_secret_value(
-    SecretId=API_KEY_SECRET_NAME
-  )['SecretString'])['mailchimp']
+# Shared by all records, so the number of concurrent calls to SES, Cognito, MailChimp and S3 is bounded
+side_effects = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
-  mailchimp = Client()
-  mailchimp.set_config({
-    "api_key": mailchimp_api_key,
-    "server": MAILCHIMP_SERVER_PREFIX
-  })
+# Stands in for the MailChimp client when MAILCHIMP_STUB is set (e.g. when testing locally),
+# recording and logging each call instead of making it. Calls are recorded on the stub they're made
+# through, and cleared at the start of each invocation
+class MailchimpStub:
+  def __init__(self, name="mailchimp", calls=None):
+    self.name = name
+    self.calls = [] if calls is None else calls
+
+  def __getattr__(self, attr):
+    return MailchimpStub(f"{self.name}.{attr}", self.calls)
+
+  def __call__(self, *args, **kwargs):
+    logger.info(f"Stubbed MailChimp call to {self.name}: {json.dumps(args)}")
+    self.calls.append((self.name, args))
+    return {"id": "stub"}
 
-  del mailchimp_api_key
-except Exception as e:
-  logger.error(f"Failed to initialize MailChimp client: {str(e)}")
-  mailchimp = None
+# Mailchimp Client, created on first use as most records never reach MailChimp
+mailchimp = None
+mailchimp_created_at = None
 
+@metrics.log_metrics
 def handler(event, context):
   logger.debug(event)
 
+  started = time.perf_counter()
+
+  if isinstance(mailchimp, MailchimpStub):
+    mailchimp.calls.clear()
+
+  # Records for the same member must be applied in order, but different members are independent
+  records_by_member = {}
   for record in event['Records']:
     if record['eventSource'] != "aws:dynamodb":
       logger.warning(f"Non-DynamoDB event found - skipping: {json.dumps(record)}")
       continue
 
     membershipNumber = record['dynamodb']['Keys']['membershipNumber']['S']
-    logger.info(f"{record['eventName']} event for {membershipNumber}")
-
-    if record['eventName'] == "INSERT":
-      send_welcome_email(membershipNumber, record['dynamodb']['NewImage'])
-      create_user(membershipNumber, record['dynamodb']['NewImage'])
-      subscribe_to_mailchimp(membershipNumber, record['dynamodb']['NewImage'])
-    elif record['eventName'] == "MODIFY":
-      update_user(membershipNumber, record['dynamodb']['NewImage'], record['dynamodb']['OldImage'])
-      update_user_groups(membershipNumber, record['dynamodb']['NewImage'], record['dynamodb']['OldImage'])
-      check_suspension(membershipNumber, record['dynamodb']['NewImage'], record['dynamodb']['OldImage'])
-    elif record['eventName'] == "REMOVE":
-      delete_user(membershipNumber)
-      unsubscribe_from_mailchimp(membershipNumber, record['dynamodb']['OldImage'])
-      delete_member_photo(membershipNumber)
+    records_by_member.setdefault(membershipNumber, []).append(record)
+
+  # MailChimp changes are collected and sent together once every record has been processed
+  with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(records_by_member)))) as executor:
+    member_results = list(executor.map(process_member_records, records_by_member.values()))
+
+  member_operations = [operations for operations, _, _, _, _ in member_results]
+  processed = sum(count for _, count, _, _, _ in member_results)
+  failures = [failed for _, _, failed, _, _ in member_results if failed is not None]
+  unsent = sum(count for _, _, _, count, _ in member_results)
+  skipped = sum(count for _, _, _, _, count in member_results)
+
+  # Operations in a MailChimp batch may run in any order, so where several touch the same
+  # subscriber (e.g. a member's own changes, or a renumbered member's old and new records)
+  # apply them one by one instead
+  subscriber_counts = Counter(h for operations in member_operations for operation in operations for h in get_subscriber_hashes(operation))
+
+  batch_operations = []
+  for operations in member_operations:
+    if len(operations) == 1 and all(subscriber_counts[h] == 1 for h in get_subscriber_hashes(operations[0])):
+      batch_operations.extend(operations)
+    else:
+      for operation in operations:
+        apply_mailchimp_operation(operation)
+
+  submit_mailchimp_batch(batch_operations)
+
+  metrics.add_metric(name="NotificationFailures", unit=MetricUnit.Count, value=unsent)
+
+  return stream_batch_result(event, metrics, started, processed, failures, skipped)
+
+
+def process_member_records(records):
+  operations = []
+  processed = 0
+  unsent = 0
+  skipped = 0
+  for record in records:
+    try:
+      operation, record_unsent = process_record(record)
+    except Exception as e:
+      sequence_number = record['dynamodb']['SequenceNumber']
+      if not is_retryable(e):
+        logger.error(f"Skipping record {sequence_number}, as retrying won't help: {repr(e)}")
+        skipped += 1
+        continue
+
+      logger.error(f"Unable to process record {sequence_number}: {str(e)}")
+
+      # Stop here, so this member's later records aren't applied before this one
+      return (operations, processed, sequence_number, unsent, skipped)
+
+    processed += 1
+    unsent += record_unsent
+    if operation is not None:
+      operations.append(operation)
+
+  return (operations, processed, None, unsent, skipped)
+
+
+def process_record(record):
+  membershipNumber = record['dynamodb']['Keys']['membershipNumber']['S']
+  logger.info(f"{record['eventName']} event for {membershipNumber}")
+
+  # The side effects of a single record don't depend on each other, so run them concurrently.
+  # Cognito and S3 changes are safe to repeat, so if any fail the whole record is retried, but
+  # e-mails aren't, so they're only sent once the rest have succeeded and are counted if they fail
+  tasks = []
+  notifications = []
+  mailchimp_change = None
+  if record['eventName'] == "INSERT":
+    tasks.append(side_effects.submit(create_user, membershipNumber, record['dynamodb']['NewImage']))
+    notifications.append((send_welcome_email, membershipNumber, record['dynamodb']['NewImage']))
+    mailchimp_change = (subscribe_to_mailchimp, membershipNumber, record['dynamodb']['NewImage'])
+  elif record['eventName'] == "MODIFY":
+    tasks.append(side_effects.submit(update_user, membershipNumber, record['dynamodb']['NewImage'], record['dynamodb']['OldImage']))
+    tasks.append(side_effects.submit(update_user_groups, membershipNumber, record['dynamodb']['NewImage'], record['dynamodb']['OldImage']))
+    notifications.append((check_suspension, membershipNumber, record['dynamodb']['NewImage'], record['dynamodb']['OldImage']))
+    mailchimp_change = (update_mailchimp, membershipNumber, record['dynamodb']['NewImage'], record['dynamodb']['OldImage'])
+  elif record['eventName'] == "REMOVE":
+    tasks.append(side_effects.submit(delete_user, membershipNumber))
+    tasks.append(side_effects.submit(delete_member_photo, membershipNumber))
+
+    # A renumbered member is still subscribed under the same e-mail address, and unsubscribing them
+    # would race subscribing their new record
+    if 'renumberedTo' in record['dynamodb']['OldImage']:
+      logger.info(f"Member {membershipNumber} was renumbered to {record['dynamodb']['OldImage']['renumberedTo']['S']} - leaving MailChimp subscription")
+    else:
+      mailchimp_change = (unsubscribe_from_mailchimp, membershipNumber, record['dynamodb']['OldImage'])
+
+  # Wait for all of them before raising, so the member's next record (or this one's retry) isn't applied until they're complete
+  wait(tasks)
+  for task in tasks:
+    task.result()
+
+  # A member missing the attributes MailChimp needs shouldn't hold up their other changes
+  operation = None
+  if mailchimp_change is not None:
+    try:
+      operation = mailchimp_change[0](*mailchimp_change[1:])
+    except KeyError as e:
+      logger.error(f"Unable to build MailChimp change for {membershipNumber}, as {str(e)} is missing")
+
+  unsent = 0
+  for task in [side_effects.submit(*n) for n in notifications]:
+    try:
+      task.result()
+    except Exception:
+      unsent += 1
+
+  return (operation, unsent)
 
 
 def send_welcome_email(membershipNumber, newImage):
@@ -129,6 +259,7 @@ def send_welcome_email(membershipNumber, newImage):
     )
   except Exception as e:
     logger.error(f"Unable to send {APPLICATION_ACCEPTED_TEMPLATE} e-mail to {membershipNumber} ({newImage['email']['S']}): {str(e)}")
+    raise e
 
 
 def create_user(membershipNumber, newImage):
@@ -161,8 +292,12 @@ def create_user(membershipNumber, newImage):
       UserAttributes=userAttributes,
       DesiredDeliveryMediums=["EMAIL"]
     )
+  except cognito.exceptions.UsernameExistsException:
+    # Created by an earlier attempt at this record
+    logger.info(f"User {membershipNumber} already exists in Cognito")
   except Exception as e:
     logger.error(f"Unable to create user {membershipNumber} in Cognito: {str(e)}")
+    raise e
   
   # Add to STANDARD group
   try:
@@ -173,6 +308,7 @@ def create_user(membershipNumber, newImage):
     )
   except Exception as e:
     logger.error(f"Unable to add user {membershipNumber} to group {STANDARD_GROUP}: {str(e)}")
+    raise e
   
 
 def subscribe_to_mailchimp(membershipNumber, member):
@@ -185,21 +321,17 @@ def subscribe_to_mailchimp(membershipNumber, member):
     }
   }
 
-  try:
-    response = mailchimp.lists.add_list_member(MAILCHIMP_LIST_ID, member_info)
-    logger.info(f"{membershipNumber} ({member['email']['S']}) subscribed to MailChimp with id {response['id']}")
-  
-  except ApiClientError as e:
-    logger.error(f"Unable to subscribe {membershipNumber} to MailChimp: {e.text}")
-  
-  except Exception as e:
-    logger.error(f"Unable to subscribe {membershipNumber} to MailChimp: {str(e)}")
+  return {
+    "membershipNumber": membershipNumber,
+    "action": "subscribe",
+    "method": "POST",
+    "path": f"/lists/{MAILCHIMP_LIST_ID}/members",
+    "body": member_info
+  }
 
 
 def update_user(membershipNumber, newImage, oldImage):
   cognito_changes = []
-  mailchimp_changes = {}
-  mailchimp_merge_fields = {}
   logMessage = []
 
   if 'email' in newImage and 'S' in newImage['email']:
@@ -213,7 +345,6 @@ def update_user(membershipNumber, newImage, oldImage):
         'Name': 'email_verified',
         'Value': 'true'
       })
-      mailchimp_changes['email_address'] = newEmail
       logMessage.append(f"New e-mail: {newEmail}")
 
   if 'telephone' in newImage and 'S' in newImage['telephone'] and COGNITO_PHONE:
@@ -228,21 +359,6 @@ def update_user(membershipNumber, newImage, oldImage):
         'Value': 'true'
       })
       logMessage.append(f"New phone number: {newPhone}")
-  
-  if 'firstName' in newImage and 'S' in newImage['firstName']:
-    newFirstName = newImage['firstName']['S']
-    if oldImage.get('firstName', {}).get('S') != newFirstName:
-      mailchimp_merge_fields['FNAME'] = newFirstName
-      logMessage.append(f"New first name: {newFirstName}")
-  
-  if 'surname' in newImage and 'S' in newImage['surname']:
-    newSurname = newImage['surname']['S']
-    if oldImage.get('surname', {}).get('S') != newSurname:
-      mailchimp_merge_fields['LNAME'] = newSurname
-      logMessage.append(f"New surname: {newSurname}")
-
-  if len(mailchimp_merge_fields) > 0:
-    mailchimp_changes['merge_fields'] = mailchimp_merge_fields
 
   if len(cognito_changes) == 0:
     logger.info("Changes don't require modifications to Cognito")
@@ -255,21 +371,47 @@ def update_user(membershipNumber, newImage, oldImage):
       )
 
       logger.info(f"Cognito profile for {membershipNumber} updated. {'; '.join(logMessage)}")
+    except cognito.exceptions.UserNotFoundException:
+      # Retrying won't help if they don't have an account
+      logger.warning(f"Unable to update details for user {membershipNumber}, as they don't exist in Cognito")
     except Exception as e:
       logger.error(f"Unable to update details for user {membershipNumber} in Cognito: {str(e)}")
+      raise e
+
+
+def update_mailchimp(membershipNumber, newImage, oldImage):
+  mailchimp_changes = {}
+  mailchimp_merge_fields = {}
+
+  if 'email' in newImage and 'S' in newImage['email']:
+    newEmail = newImage['email']['S']
+    if oldImage.get('email', {}).get('S') != newEmail:
+      mailchimp_changes['email_address'] = newEmail
   
+  if 'firstName' in newImage and 'S' in newImage['firstName']:
+    newFirstName = newImage['firstName']['S']
+    if oldImage.get('firstName', {}).get('S') != newFirstName:
+      mailchimp_merge_fields['FNAME'] = newFirstName
+  
+  if 'surname' in newImage and 'S' in newImage['surname']:
+    newSurname = newImage['surname']['S']
+    if oldImage.get('surname', {}).get('S') != newSurname:
+      mailchimp_merge_fields['LNAME'] = newSurname
+
+  if len(mailchimp_merge_fields) > 0:
+    mailchimp_changes['merge_fields'] = mailchimp_merge_fields
+
   if len(mailchimp_changes) == 0:
     logger.info("Changes don't require modifications to MailChimp")
-  else:
-    try:
-      response = mailchimp.lists.update_list_member(MAILCHIMP_LIST_ID, get_mailchimp_hash(oldImage['email']['S']), mailchimp_changes)
-      logger.info(f"{membershipNumber} ({newImage['email']['S']}) updated in MailChimp with id {response['id']}")
+    return None
 
-    except ApiClientError as e:
-      logger.error(f"Unable to update {membershipNumber} in MailChimp: {e.text}")
-  
-    except Exception as e:
-      logger.error(f"Unable to update {membershipNumber} in MailChimp: {str(e)}")
+  return {
+    "membershipNumber": membershipNumber,
+    "action": "update",
+    "method": "PATCH",
+    "path": f"/lists/{MAILCHIMP_LIST_ID}/members/{get_mailchimp_hash(oldImage['email']['S'])}",
+    "body": mailchimp_changes
+  }
 
 
 def update_user_groups(membershipNumber, newImage, oldImage):
@@ -286,49 +428,35 @@ def update_user_groups(membershipNumber, newImage, oldImage):
   if oldRoleGroup is not None:
     # Remove old role
     logger.info(f"Removing {membershipNumber} from Cognito group {oldRoleGroup}")
-    try:
-      cognito.admin_remove_user_from_group(
-        UserPoolId=USER_POOL,
-        Username=membershipNumber,
-        GroupName=oldRoleGroup
-      )
-    except Exception as e:
-      logger.error(f"Unable to remove user {membershipNumber} from group {oldRoleGroup}: {str(e)}")
+    set_group_membership(membershipNumber, oldRoleGroup, False)
   
   if newRoleGroup is not None:
     # Add new role
     logger.info(f"Adding {membershipNumber} to Cognito group {newRoleGroup}")
-    try:
-      cognito.admin_add_user_to_group(
-        UserPoolId=USER_POOL,
-        Username=membershipNumber,
-        GroupName=newRoleGroup
-      )
-    except Exception as e:
-      logger.error(f"Unable to add user {membershipNumber} to group {newRoleGroup}: {str(e)}")
+    set_group_membership(membershipNumber, newRoleGroup, True)
 
   if oldRoleGroup is not None and newRoleGroup is None:
     # Remove from COMMITTEE group
     logger.info(f"Removing {membershipNumber} from Cognito group {COMMITTEE_GROUP}")
-    try:
-      cognito.admin_remove_user_from_group(
-        UserPoolId=USER_POOL,
-        Username=membershipNumber,
-        GroupName=COMMITTEE_GROUP
-      )
-    except Exception as e:
-      logger.error(f"Unable to remove user {membershipNumber} from group {COMMITTEE_GROUP}: {str(e)}")
+    set_group_membership(membershipNumber, COMMITTEE_GROUP, False)
   elif newRoleGroup is not None and oldRoleGroup is None:
     # Add to COMMITTEE group
     logger.info(f"Adding {membershipNumber} to Cognito group {COMMITTEE_GROUP}")
-    try:
-      cognito.admin_add_user_to_group(
-        UserPoolId=USER_POOL,
-        Username=membershipNumber,
-        GroupName=COMMITTEE_GROUP
-      )
-    except Exception as e:
-      logger.error(f"Unable to add user {membershipNumber} to group {COMMITTEE_GROUP}: {str(e)}")
+    set_group_membership(membershipNumber, COMMITTEE_GROUP, True)
+
+
+def set_group_membership(membershipNumber, group, member):
+  try:
+    if member:
+      cognito.admin_add_user_to_group(UserPoolId=USER_POOL, Username=membershipNumber, GroupName=group)
+    else:
+      cognito.admin_remove_user_from_group(UserPoolId=USER_POOL, Username=membershipNumber, GroupName=group)
+  except cognito.exceptions.UserNotFoundException:
+    # Retrying won't help if they don't have an account
+    logger.warning(f"Unable to {'add' if member else 'remove'} user {membershipNumber} {'to' if member else 'from'} group {group}, as they don't exist in Cognito")
+  except Exception as e:
+    logger.error(f"Unable to {'add' if member else 'remove'} user {membershipNumber} {'to' if member else 'from'} group {group}: {str(e)}")
+    raise e
 
 
 def get_cognito_group(role):
@@ -358,28 +486,34 @@ def check_suspension(membershipNumber, newImage, oldImage):
     return
   
   if newSuspension == True:
-    send_suspended_email(membershipNumber, newImage)
-
-    # Check if allocated to any events, and if so send an e-mail to the events coordinator (utils/members/future_events)
+    # The events coordinator still needs to know, even if the member's own e-mail fails
     try:
-      future_events = json.loads(lambda_client.invoke(
-        FunctionName=FUTURE_EVENTS_LAMBDA,
-        Payload=json.dumps({
-          "membershipNumber": membershipNumber
-        })
-      )['Payload'].read())
-
-    except Exception as e:
-      logger.error(f"Unable to get list of future events for member {membershipNumber}: {str(e)}")
-      future_events = {}
-    
-    if len(future_events) > 0:
-      send_suspended_events_email(membershipNumber, newImage, future_events)
+      send_suspended_email(membershipNumber, newImage)
+    finally:
+      notify_suspended_events(membershipNumber, newImage)
 
   else:
     send_unsuspended_email(membershipNumber, newImage)
 
 
+def notify_suspended_events(membershipNumber, newImage):
+  # Check if allocated to any events, and if so send an e-mail to the events coordinator (utils/members/future_events)
+  try:
+    future_events = json.loads(lambda_client.invoke(
+      FunctionName=FUTURE_EVENTS_LAMBDA,
+      Payload=json.dumps({
+        "membershipNumber": membershipNumber
+      })
+    )['Payload'].read())
+
+  except Exception as e:
+    logger.error(f"Unable to get list of future events for member {membershipNumber}: {str(e)}")
+    raise e
+  
+  if len(future_events) > 0:
+    send_suspended_events_email(membershipNumber, newImage, future_events)
+
+
 def send_suspended_email(membershipNumber, newImage):
   try:
     ses.send_templated_email(
@@ -403,6 +537,7 @@ def send_suspended_email(membershipNumber, newImage):
     )
   except Exception as e:
     logger.error(f"Unable to send {SUSPENDED_TEMPLATE} e-mail to {membershipNumber} ({newImage['email']['S']}): {str(e)}")
+    raise e
 
 
 def send_suspended_events_email(membershipNumber, newImage, futureEvents):
@@ -426,6 +561,7 @@ def send_suspended_events_email(membershipNumber, newImage, futureEvents):
     )
   except Exception as e:
     logger.error(f"Unable to send {SUSPENDED_EVENTS_TEMPLATE} e-mail to events@kswp.org.uk: {str(e)}")
+    raise e
 
 
 def send_unsuspended_email(membershipNumber, newImage):
@@ -451,6 +587,7 @@ def send_unsuspended_email(membershipNumber, newImage):
     )
   except Exception as e:
     logger.error(f"Unable to send {UNSUSPENDED_TEMPLATE} e-mail to {membershipNumber} ({newImage['email']['S']}): {str(e)}")
+    raise e
 
 
 def delete_user(membershipNumber):
@@ -461,20 +598,126 @@ def delete_user(membershipNumber):
     )
 
     logger.info(f"User {membershipNumber} deleted from Cognito")
+  except cognito.exceptions.UserNotFoundException:
+    # Deleted by an earlier attempt at this record, or never had an account
+    logger.info(f"User {membershipNumber} doesn't exist in Cognito")
   except Exception as e:
     logger.error(f"Unable to delete user {membershipNumber} from Cognito: {str(e)}")
+    raise e
   
 
 def unsubscribe_from_mailchimp(membershipNumber, member):
+  return {
+    "membershipNumber": membershipNumber,
+    "action": "delete",
+    "method": "DELETE",
+    "path": f"/lists/{MAILCHIMP_LIST_ID}/members/{get_mailchimp_hash(member['email']['S'])}"
+  }
+
+
+def get_subscriber_hashes(operation):
+  hashes = set()
+  if operation['method'] != "POST":
+    hashes.add(operation['path'].rsplit("/", 1)[-1])
+  if 'email_address' in operation.get('body', {}):
+    hashes.add(get_mailchimp_hash(operation['body']['email_address']))
+
+  return hashes
+
+
+def get_mailchimp(refresh=False):
+  global mailchimp, mailchimp_created_at
+
+  if MAILCHIMP_STUB:
+    if mailchimp is None:
+      mailchimp = MailchimpStub()
+    return mailchimp
+
+  if not refresh and mailchimp is not None and time.monotonic() - mailchimp_created_at < SECRET_TTL:
+    return mailchimp
+
+  started = time.perf_counter()
+  mailchimp_api_key = json.loads(secrets.get_secret_value(
+    SecretId=API_KEY_SECRET_NAME
+  )['SecretString'])['mailchimp']
+
+  client = Client()
+  client.set_config({
+    "api_key": mailchimp_api_key,
+    "server": MAILCHIMP_SERVER_PREFIX
+  })
+
+  mailchimp = client
+  mailchimp_created_at = time.monotonic()
+
+  logger.info(f"MailChimp API key loaded from Secrets Manager in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+  return mailchimp
+
+
+def call_mailchimp(call):
   try:
-    mailchimp.lists.delete_list_member(MAILCHIMP_LIST_ID, get_mailchimp_hash(member['email']['S']))
-    logger.info(f"{membershipNumber} ({member['email']['S']}) deleted from MailChimp")
-  
+    return call(get_mailchimp())
   except ApiClientError as e:
-    logger.error(f"Unable to delete {membershipNumber} from MailChimp: {e.text}")
-  
+    if e.status_code != 401:
+      raise e
+
+    # Key may have been rotated since it was cached, so fetch it again and retry once
+    logger.warning("MailChimp rejected the API key - reloading from Secrets Manager")
+    return call(get_mailchimp(refresh=True))
+
+
+def apply_mailchimp_operation(operation):
+  membershipNumber = operation['membershipNumber']
+  subscriber_hash = operation['path'].rsplit("/", 1)[-1]
+
+  try:
+    if operation['method'] == "POST":
+      response = call_mailchimp(lambda m: m.lists.add_list_member(MAILCHIMP_LIST_ID, operation['body']))
+    elif operation['method'] == "PATCH":
+      response = call_mailchimp(lambda m: m.lists.update_list_member(MAILCHIMP_LIST_ID, subscriber_hash, operation['body']))
+    else:
+      response = call_mailchimp(lambda m: m.lists.delete_list_member(MAILCHIMP_LIST_ID, subscriber_hash))
+
+    logger.info(f"MailChimp {operation['action']} for {membershipNumber} complete{' with id ' + response['id'] if response else ''}")
+
+  except ApiClientError as e:
+    logger.error(f"Unable to {operation['action']} {membershipNumber} in MailChimp: {e.text}")
+
   except Exception as e:
-    logger.error(f"Unable to delete {membershipNumber} from MailChimp: {str(e)}")
+    logger.error(f"Unable to {operation['action']} {membershipNumber} in MailChimp: {str(e)}")
+
+
+def submit_mailchimp_batch(operations):
+  if len(operations) == 0:
+    return
+
+  # A single change isn't worth the overhead of a batch, and gets an immediate result
+  if len(operations) == 1:
+    apply_mailchimp_operation(operations[0])
+    return
+
+  batch = {
+    "operations": [
+      {
+        "method": operation['method'],
+        "path": operation['path'],
+        "operation_id": f"{operation['membershipNumber']}-{operation['action']}",
+        **({"body": json.dumps(operation['body'])} if 'body' in operation else {})
+      } for operation in operations
+    ]
+  }
+
+  # Batches run asynchronously, so results for each operation are available from the batch status
+  try:
+    response = call_mailchimp(lambda m: m.batches.start(batch))
+    logger.info(f"{len(operations)} MailChimp changes submitted as batch {response['id']}")
+
+  except ApiClientError as e:
+    logger.error(f"Unable to submit batch of {len(operations)} MailChimp changes: {e.text}")
+
+  except Exception as e:
+    logger.error(f"Unable to submit batch of {len(operations)} MailChimp changes: {str(e)}")
 
 
 def get_mailchimp_hash(email):
@@ -484,14 +727,16 @@ def get_mailchimp_hash(email):
 
 def delete_member_photo(membershipNumber):
   try:
-    s3.delete_objects(
+    response = s3.delete_objects(
       Bucket=PHOTO_BUCKET_NAME,
       Delete={
-        "Objects": [
-          { "Key": f"{membershipNumber}.jpg" },
-          { "Key": f"{membershipNumber}.thumb.jpg" }
-        ]
+        "Objects": [{ "Key": membershipNumber + suffix } for suffix in PHOTO_SUFFIXES]
       }
     )
   except Exception as e:
-    logger.error(f"Unable to delete photo for {membershipNumber}: {str(e)}")
\ No newline at end of file
+    logger.error(f"Unable to delete photo for {membershipNumber}: {str(e)}")
+    raise e
+
+  # Keys which don't exist are reported as deleted, so any errors are worth retrying
+  if len(response.get('Errors', [])) > 0:
+    raise Exception(f"Unable to delete {len(response['Errors'])} photo renditions for {membershipNumber}: {response['Errors'][0].get('Message')}")
\ No newline at end of file
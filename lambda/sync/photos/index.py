@@ -0,0 +1,140 @@
+import boto3
+from   concurrent.futures import ThreadPoolExecutor
+import io
+import logging
+import os
+from PIL import Image, ImageOps
+import urllib.parse
+
+logger = logging.getLogger()
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+MEMBERS_TABLE = os.getenv('MEMBERS_TABLE')
+PHOTO_BUCKET_NAME = os.getenv('PHOTO_BUCKET_NAME')
+RENDITION_SIZES = sorted([int(s) for s in os.getenv('RENDITION_SIZES', "64,128,256,512,1024").split(",")], reverse=True)
+UPLOAD_PREFIX = os.getenv('UPLOAD_PREFIX', "uploads/")
+
+logger.info(f"MEMBERS_TABLE = {MEMBERS_TABLE}")
+logger.info(f"PHOTO_BUCKET_NAME = {PHOTO_BUCKET_NAME}")
+logger.info(f"RENDITION_SIZES = {RENDITION_SIZES}")
+logger.info(f"UPLOAD_PREFIX = {UPLOAD_PREFIX}")
+
+dynamodb = boto3.resource('dynamodb')
+s3 = boto3.client('s3')
+
+members_table = dynamodb.Table(MEMBERS_TABLE)
+
+def handler(event, context):
+  logger.debug(event)
+
+  for record in event['Records']:
+    if record.get('eventSource') != "aws:s3":
+      logger.warning(f"Non-S3 event found - skipping: {record}")
+      continue
+
+    key = urllib.parse.unquote_plus(record['s3']['object']['key'])
+    if not key.startswith(UPLOAD_PREFIX):
+      logger.warning(f"Object {key} is not an upload - skipping")
+      continue
+
+    membershipNumber = key[len(UPLOAD_PREFIX):]
+    logger.info(f"Processing uploaded photo for {membershipNumber}")
+
+    process_upload(membershipNumber, key)
+
+
+def process_upload(membershipNumber, key):
+  try:
+    upload = s3.get_object(Bucket=PHOTO_BUCKET_NAME, Key=key)
+    photo = open_photo(upload['Body'].read())
+  except Exception as e:
+    logger.warning(f"Unable to open uploaded photo {key}: {str(e)}")
+    delete_upload(key)
+    return
+
+  # Resize image to each rendition size, and upload as WebP and JPEG
+  logger.debug(f"Creating renditions of photo for {membershipNumber}")
+  renditions = create_renditions(photo)
+  upload_renditions(membershipNumber, renditions)
+  set_has_photo(membershipNumber, list(renditions.keys()))
+
+  # Original is no longer needed
+  delete_upload(key)
+
+  logger.info(f"Photo updated for {membershipNumber}")
+
+
+def open_photo(data):
+  photo = Image.open(io.BytesIO(data))
+
+  # Let the JPEG decoder scale down while loading, as we never need more than the largest rendition
+  photo.draft("RGB", (RENDITION_SIZES[0], RENDITION_SIZES[0]))
+
+  return photo.convert("RGB")
+
+
+def create_renditions(photo):
+  # Resize from largest to smallest, so that each size is produced from the smallest possible source
+  renditions = {}
+
+  for size in RENDITION_SIZES:
+    if photo.width > size or photo.height > size:
+      photo = ImageOps.contain(photo, (size, size), Image.Resampling.LANCZOS)
+
+    renditions[size] = photo
+
+  return renditions
+
+
+def upload_renditions(membershipNumber, renditions):
+  # Original 1024px photo and 128px thumbnail names are kept for existing clients
+  uploads = []
+  for size, image in renditions.items():
+    uploads.append((f"{membershipNumber}.{size}.webp", image, "WEBP"))
+    uploads.append((f"{membershipNumber}.{size}.jpg", image, "JPEG"))
+
+  uploads.append((membershipNumber + ".jpg", renditions[RENDITION_SIZES[0]], "JPEG"))
+  if 128 in renditions:
+    uploads.append((membershipNumber + ".thumb.jpg", renditions[128], "JPEG"))
+
+  with ThreadPoolExecutor(max_workers=len(uploads)) as executor:
+    for _ in executor.map(lambda u: upload_image(u[0], u[1], u[2]), uploads):
+      pass
+
+
+def upload_image(filename, image, format):
+  logger.debug(f"Uploading {filename} as {format} to S3 bucket")
+
+  image_b = io.BytesIO()
+  if format == "WEBP":
+    image.save(image_b, "WEBP", quality=80, method=4)
+  else:
+    image.save(image_b, "JPEG", quality=85, optimize=True, progressive=True)
+  image_b.seek(0)
+
+  try:
+    s3.upload_fileobj(image_b, PHOTO_BUCKET_NAME, filename, ExtraArgs={'ContentType': "image/webp" if format == "WEBP" else "image/jpeg"})
+  except Exception as e:
+    logger.error(f"Failed to upload photo {filename} to S3: {str(e)}")
+    raise e
+
+
+def set_has_photo(membershipNumber, renditions):
+  # Kept on the member so that photo URLs can be signed without checking the bucket,
+  # along with the sizes written, as photos from before renditions only have .jpg and .thumb.jpg
+  try:
+    members_table.update_item(
+      Key={"membershipNumber": membershipNumber},
+      UpdateExpression="SET hasPhoto = :hasPhoto, photoRenditions = :photoRenditions",
+      ConditionExpression="attribute_exists(membershipNumber)",
+      ExpressionAttributeValues={":hasPhoto": True, ":photoRenditions": renditions}
+    )
+  except Exception as e:
+    logger.error(f"Unable to set hasPhoto for {membershipNumber}: {str(e)}")
+
+
+def delete_upload(key):
+  try:
+    s3.delete_object(Bucket=PHOTO_BUCKET_NAME, Key=key)
+  except Exception as e:
+    logger.error(f"Unable to delete uploaded photo {key}: {str(e)}")
@@ -1,12 +1,16 @@
+from   aws_lambda_powertools import Metrics
 import boto3
 from   boto3.dynamodb.conditions import Key
 import json
 import logging
 import os
+from   portal_common.streams import process_stream_records
 
 logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
+metrics = Metrics()
+
 APPLICATION_TABLE = os.getenv('APPLICATION_TABLE')
 MEMBERS_EMAIL = os.getenv('MEMBERS_EMAIL')
 PORTAL_DOMAIN = os.getenv('PORTAL_DOMAIN')
@@ -25,46 +29,50 @@ ses = boto3.client('ses')
 table = dynamodb.Table(APPLICATION_TABLE)
 
 
+@metrics.log_metrics
 def handler(event, context):
   logger.debug(event)
 
-  for record in event['Records']:
-    if record['eventSource'] != "aws:dynamodb":
-      logger.warning(f"Non-DynamoDB event found - skipping: {json.dumps(record)}")
-      continue
-
-    membershipNumber = record['dynamodb']['Keys']['membershipNumber']['S']
-    logger.info(f"{record['eventName']} event for {membershipNumber}")
-
-    if record['eventName'] == "INSERT" or record['eventName'] == "MODIFY":
-      r = record['dynamodb']['NewImage']
-
-      # If accepted has changed, assume that's the only change and don't send updates
-      if 'OldImage' in record['dynamodb'] and 'accepted' in r and r['accepted'] != record['dynamodb']['OldImage'].get('accepted') :
-        continue
-      
-      logger.debug("Getting applicant information")
-      try:
-        applications = table.get_item(
-          Key={
-            "membershipNumber":  membershipNumber
-          },
-          ProjectionExpression="membershipNumber,firstName,surname,email"
-        )
-      except Exception as e:
-        logger.error(f"Unable to get applicant information for {r['membershipNumber']}: {str(e)}")
-        raise e
-      
-      if 'Item' not in applications or applications['Item'] is None:
-        logger.warning(f"No application found for {r['membershipNumber']} - reference invitation will not be sent")
-        return
-
-      a = applications['Item']
-
-      if 'submittedAt' in r and r['submittedAt']:
-        reference_completed(r, a)
-      else:
-        referee_added(r, a)
+  return process_stream_records(event, process_record, metrics)
+
+
+def process_record(record):
+  if record['eventSource'] != "aws:dynamodb":
+    logger.warning(f"Non-DynamoDB event found - skipping: {json.dumps(record)}")
+    return
+
+  membershipNumber = record['dynamodb']['Keys']['membershipNumber']['S']
+  logger.info(f"{record['eventName']} event for {membershipNumber}")
+
+  if record['eventName'] == "INSERT" or record['eventName'] == "MODIFY":
+    r = record['dynamodb']['NewImage']
+
+    # If accepted has changed, assume that's the only change and don't send updates
+    if 'OldImage' in record['dynamodb'] and 'accepted' in r and r['accepted'] != record['dynamodb']['OldImage'].get('accepted') :
+      return
+    
+    logger.debug("Getting applicant information")
+    try:
+      applications = table.get_item(
+        Key={
+          "membershipNumber":  membershipNumber
+        },
+        ProjectionExpression="membershipNumber,firstName,surname,email"
+      )
+    except Exception as e:
+      logger.error(f"Unable to get applicant information for {r['membershipNumber']}: {str(e)}")
+      raise e
+    
+    if 'Item' not in applications or applications['Item'] is None:
+      logger.warning(f"No application found for {r['membershipNumber']} - reference invitation will not be sent")
+      return
+
+    a = applications['Item']
+
+    if 'submittedAt' in r and r['submittedAt']:
+      reference_completed(r, a)
+    else:
+      referee_added(r, a)
 
 
 def reference_completed(reference, application):
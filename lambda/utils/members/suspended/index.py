@@ -5,6 +5,7 @@ from aws_lambda_powertools.utilities.typing import LambdaContext
 import boto3
 import datetime
 import os
+from   portal_common.dynamodb import BATCH_GET_SIZE, batch_get
 
 # Configure logging
 logger = Logger()
@@ -24,22 +25,29 @@ def handler(event, context):
   if not isinstance(membership_numbers, list):
     membership_numbers = [membership_numbers]
 
+  # Keys are stored as strings, but return results keyed on the values we were given
+  requested = {}
+  for m in membership_numbers:
+    requested.setdefault(str(m), []).append(m)
+
+  logger.info("Getting members", extra={"count": len(requested)})
+
+  keys = list(requested.keys())
   ret = dict()
 
-  for m in membership_numbers:
-    logger.info("Getting member", extra={"membership_number": m})
-  
+  for i in range(0, len(keys), BATCH_GET_SIZE):
     try:
-      member = members_table.get_item(
-        Key={
-          "membershipNumber": str(m)
-        },
-        ProjectionExpression="membershipNumber,suspended"
-      )['Item']
+      members = batch_get(dynamodb, MEMBERS_TABLE, [{"membershipNumber": k} for k in keys[i:i + BATCH_GET_SIZE]], "membershipNumber,suspended")
     except Exception as e:
-      logger.error("Unable to get member", extra={"membership_number": m})
+      logger.error("Unable to get members", extra={"count": len(keys[i:i + BATCH_GET_SIZE]), "error": str(e)})
       continue
 
-    ret[m] = member.get("suspended", False)
+    for member in members:
+      for m in requested[member['membershipNumber']]:
+        ret[m] = member.get("suspended", False)
+
+  for key in keys:
+    if requested[key][0] not in ret:
+      logger.error("Unable to get member", extra={"membership_number": key})
   
-  return ret
\ No newline at end of file
+  return ret
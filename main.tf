@@ -1,10 +1,14 @@
 locals {
   powertools_layer_arn = "arn:aws:lambda:${data.aws_region.current.name}:017000801446:layer:AWSLambdaPowertoolsPythonV2-Arm64:71"
   pandas_layer_arn = "arn:aws:lambda:${data.aws_region.current.name}:336392948345:layer:AWSSDKPandas-Python312-Arm64:8"
+  common_layer_arn = module.common_layer.lambda_layer_arn
 
   lambda_architecture  = ["arm64"]
   lambda_runtime       = "python3.12"
 
+  # Sizes of member photo renditions, shared by every Lambda which writes, copies or deletes them
+  photo_rendition_sizes = "64,128,256,512,1024"
+
   lambda_assume_role_policy = {
     lambda = {
       actions = ["sts:AssumeRole"]
@@ -48,6 +52,38 @@ END
 END
 }
 
+# Layers
+
+# Helpers shared between Lambdas (e.g. batched DynamoDB reads and writes), imported as portal_common
+module "common_layer" {
+  source = "terraform-aws-modules/lambda/aws"
+
+  create_function = false
+  create_layer    = true
+
+  layer_name          = "${var.prefix}-common-layer"
+  description         = "Helpers shared between Portal Lambdas"
+  compatible_runtimes = [local.lambda_runtime]
+
+  # Pure Python, so also usable by the x86_64 Lambdas which need Pillow
+  compatible_architectures = ["arm64", "x86_64"]
+
+  source_path = [
+    {
+      path          = "${path.module}/lambda/layers/common"
+      prefix_in_zip = "python"
+    }
+  ]
+}
+
+# Stream Failures
+
+# Stream records which still fail after retrying, sent here by each sync Lambda's event source mapping
+resource "aws_sqs_queue" "stream_failures" {
+  name                      = "${var.prefix}-stream-failures"
+  message_retention_seconds = 1209600
+}
+
 # Cron Timings
 
 resource "aws_cloudwatch_event_rule" "daily_0700" {
@@ -49,6 +49,94 @@ resource "aws_s3_bucket_public_access_block" "member_photos_bucket" {
   restrict_public_buckets = true
 }
 
+resource "aws_s3_bucket" "member_exports_bucket" {
+  bucket_prefix = "${var.prefix}-member-exports"
+}
+
+resource "aws_s3_bucket_acl" "member_exports_bucket" {
+  bucket = aws_s3_bucket.member_exports_bucket.id
+  acl    = "private"
+}
+
+resource "aws_s3_bucket_public_access_block" "member_exports_bucket" {
+  bucket = aws_s3_bucket.member_exports_bucket.id
+
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+# Allow Compass exports to be uploaded directly from the browser
+resource "aws_s3_bucket_cors_configuration" "member_exports_bucket" {
+  bucket = aws_s3_bucket.member_exports_bucket.id
+
+  cors_rule {
+    allowed_headers = ["*"]
+    allowed_methods = ["POST"]
+    allowed_origins = ["https://${local.domain}"]
+    max_age_seconds = 3000
+  }
+}
+
+# Exports contain personal data, so only keep them long enough to be downloaded
+resource "aws_s3_bucket_lifecycle_configuration" "member_exports_bucket" {
+  bucket = aws_s3_bucket.member_exports_bucket.id
+
+  rule {
+    id     = "expire-exports"
+    status = "Enabled"
+
+    filter {}
+
+    expiration {
+      days = 1
+    }
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+}
+
+resource "aws_s3_bucket_cors_configuration" "member_photos_bucket" {
+  bucket = aws_s3_bucket.member_photos_bucket.id
+
+  cors_rule {
+    allowed_headers = ["*"]
+    allowed_methods = ["POST"]
+    allowed_origins = ["https://${local.domain}"]
+    max_age_seconds = 3000
+  }
+}
+
+resource "aws_s3_bucket_lifecycle_configuration" "member_photos_bucket" {
+  bucket = aws_s3_bucket.member_photos_bucket.id
+
+  rule {
+    id     = "expire-uploads"
+    status = "Enabled"
+
+    filter {
+      prefix = "uploads/"
+    }
+
+    expiration {
+      days = 1
+    }
+  }
+}
+
+resource "aws_s3_bucket_notification" "member_photos_bucket" {
+  bucket = aws_s3_bucket.member_photos_bucket.id
+
+  lambda_function {
+    lambda_function_arn = module.sync_photos.lambda_function_arn
+    events              = ["s3:ObjectCreated:*"]
+    filter_prefix       = "uploads/"
+  }
+}
+
 # Lambda - Expire Members
 
 module "expire_membership" {
@@ -149,7 +237,7 @@ module "delete_accounts" {
     dynamodb = {
       actions = [
         "dynamodb:Query",
-        "dynamodb:DeleteItem"
+        "dynamodb:BatchWriteItem"
       ]
       resources = [
         aws_dynamodb_table.members_table.arn,
@@ -182,6 +270,10 @@ module "delete_accounts" {
   timeout     = 300
   memory_size = 512
 
+  layers = [
+    local.common_layer_arn
+  ]
+
   environment_variables = {
     TABLE_NAME               = aws_dynamodb_table.members_table.name
     STATUS_INDEX_NAME        = "${var.prefix}-membership_status"
@@ -189,6 +281,7 @@ module "delete_accounts" {
     ACCOUNT_DELETED_TEMPLATE = aws_ses_template.account_deleted.name
     PORTAL_DOMAIN            = aws_route53_record.portal.fqdn
     MEMBERS_EMAIL            = var.members_email
+    BATCH_WORKERS            = 4
   }
 }
 
@@ -333,7 +426,17 @@ module "sync_members" {
         "s3:DeleteObject"
       ]
       resources = [
-        "${aws_s3_bucket.member_photos_bucket.arn}/*.jpg"
+        "${aws_s3_bucket.member_photos_bucket.arn}/*.jpg",
+        "${aws_s3_bucket.member_photos_bucket.arn}/*.webp"
+      ]
+    }
+
+    sqs = {
+      actions = [
+        "sqs:SendMessage"
+      ]
+      resources = [
+        aws_sqs_queue.stream_failures.arn
       ]
     }
   }
@@ -345,6 +448,11 @@ module "sync_members" {
   timeout     = 300
   memory_size = 512
 
+  layers = [
+    local.powertools_layer_arn,
+    local.common_layer_arn
+  ]
+
   environment_variables = {
     API_KEY_SECRET_NAME           = aws_secretsmanager_secret.api_keys.arn
     APPLICATION_ACCEPTED_TEMPLATE = aws_ses_template.application_accepted.name
@@ -352,9 +460,12 @@ module "sync_members" {
     FUTURE_EVENTS_LAMBDA          = module.utils_members_future_events.lambda_function_arn
     MAILCHIMP_LIST_ID             = var.mailchimp_list_id
     MAILCHIMP_SERVER_PREFIX       = var.mailchimp_server_prefix
+    MAX_WORKERS                   = 8
     PHOTO_BUCKET_NAME             = aws_s3_bucket.member_photos_bucket.id
     MEMBERS_EMAIL                 = var.members_email
     PORTAL_DOMAIN                 = aws_route53_record.portal.fqdn
+    RENDITION_SIZES               = local.photo_rendition_sizes
+    SECRET_TTL                    = 3600
     SUSPENDED_TEMPLATE            = aws_ses_template.account_suspended.name
     SUSPENDED_EVENTS_TEMPLATE     = aws_ses_template.account_suspended_events.name
     UNSUSPENDED_TEMPLATE          = aws_ses_template.account_unsuspended.name
@@ -369,13 +480,102 @@ module "sync_members" {
     SOCIALS_GROUP   = aws_cognito_user_group.socials.name
     COMMITTEE_GROUP = aws_cognito_user_group.committee.name
     STANDARD_GROUP  = aws_cognito_user_group.standard.name
+
+    POWERTOOLS_METRICS_NAMESPACE = var.prefix
+    POWERTOOLS_SERVICE_NAME      = "${var.prefix}-sync_members"
   }
 }
 
 resource "aws_lambda_event_source_mapping" "sync_members" {
-  event_source_arn  = aws_dynamodb_table.members_table.stream_arn
-  function_name     = module.sync_members.lambda_function_arn
-  starting_position = "LATEST"
+  event_source_arn        = aws_dynamodb_table.members_table.stream_arn
+  function_name           = module.sync_members.lambda_function_arn
+  starting_position       = "LATEST"
+  function_response_types = ["ReportBatchItemFailures"]
+
+  # Give up on records which keep failing, rather than holding back the rest of the shard,
+  # and keep them for investigation
+  maximum_retry_attempts         = 5
+  bisect_batch_on_function_error = true
+
+  destination_config {
+    on_failure {
+      destination_arn = aws_sqs_queue.stream_failures.arn
+    }
+  }
+}
+
+# Lambda - Resize uploaded photos
+
+module "sync_photos" {
+  source = "terraform-aws-modules/lambda/aws"
+
+  source_path = [
+    {
+      path             = "${path.module}/lambda/sync/photos"
+      pip_requirements = true
+    }
+  ]
+
+  function_name = "${var.prefix}-sync_photos-lambda"
+  description   = "Resize uploaded member photos and create thumbnails"
+  handler       = "index.handler"
+
+  runtime       = local.lambda_runtime
+  architectures = ["x86_64"]    # Pillow requires x86_64
+
+  attach_cloudwatch_logs_policy = true
+
+  attach_policy_statements = true
+  policy_statements = {
+    dynamodb = {
+      actions = [
+        "dynamodb:UpdateItem"
+      ]
+      resources = [
+        aws_dynamodb_table.members_table.arn
+      ]
+    }
+
+    s3_uploads = {
+      actions = [
+        "s3:GetObject",
+        "s3:DeleteObject"
+      ]
+      resources = [
+        "${aws_s3_bucket.member_photos_bucket.arn}/uploads/*"
+      ]
+    }
+
+    s3_photos = {
+      actions = [
+        "s3:PutObject"
+      ]
+      resources = [
+        "${aws_s3_bucket.member_photos_bucket.arn}/*.jpg",
+        "${aws_s3_bucket.member_photos_bucket.arn}/*.webp"
+      ]
+    }
+  }
+
+  role_name = "${var.prefix}-sync_photos-role"
+
+  publish = true
+  allowed_triggers = {
+    s3 = {
+      principal  = "s3.amazonaws.com"
+      source_arn = aws_s3_bucket.member_photos_bucket.arn
+    }
+  }
+
+  timeout     = 60
+  memory_size = 1024
+
+  environment_variables = {
+    MEMBERS_TABLE     = aws_dynamodb_table.members_table.name
+    PHOTO_BUCKET_NAME = aws_s3_bucket.member_photos_bucket.id
+    RENDITION_SIZES   = local.photo_rendition_sizes
+    UPLOAD_PREFIX     = "uploads/"
+  }
 }
 
 # Lambda - Membership Summary
@@ -242,7 +242,7 @@ module "utils_members_suspended" {
   policy_statements = {
     dynamodb = {
       actions = [
-        "dynamodb:GetItem"
+        "dynamodb:BatchGetItem"
       ]
       resources = [
         aws_dynamodb_table.members_table.arn
@@ -276,6 +276,7 @@ module "utils_members_suspended" {
   }
 
   layers = [
-    local.powertools_layer_arn
+    local.powertools_layer_arn,
+    local.common_layer_arn
   ]
 }